@@ -25,6 +25,8 @@ import logging
 import random
 import string
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from string import Template
 from datetime import datetime, timedelta
 
@@ -40,8 +42,15 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-SQL_BATCH_SIZE = 1000
+# Rows committed per BULK INSERT batch, and number of tables inserted into at the same time
+SQL_BATCH_SIZE = 100_000
 MAX_SQL_WORKERS = 8
+# Records generated (across all tables) before they are bulk inserted. Generation goes on while they are inserted, so
+# at most twice as many records are held in memory
+RECORDS_PER_FLUSH = 1_000_000
+# From this number of main samples on, the nonclustered indexes of the tables are disabled during the generation and
+# rebuilt at the end
+DISABLE_INDEXES_MIN_MAIN_SAMPLES = 100_000
 
 NUM_USERS = 100
 NUM_AREAS = 3
@@ -133,6 +142,63 @@ record_composition = Template("${composition_id}, ${object_id}, ${compound_index
 def apply_replacements(replacements, record: Template):
     return record.substitute(replacements)
 
+
+class RecordBuffers:
+    """
+    Buffers the generated records of several tables, and bulk inserts them in the background every RECORDS_PER_FLUSH
+    records (see MSSQLDB.execute_bulk_inserts), while the generation goes on
+    """
+    def __init__(self, sql_db: MSSQLDB, tables: list[tuple[str, str]]):
+        """
+        :param tables: List of (table, headers)
+        """
+        self.sql_db = sql_db
+        self.headers = dict(tables)
+        self.records: dict[str, list[str]] = {table: [] for (table, _) in tables}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_flush = None
+
+    def __getitem__(self, table: str) -> list[str]:
+        """
+        Returns the buffer of a table. It is emptied (not replaced) when flushed, so it can be kept by the caller
+        """
+        return self.records[table]
+
+    def _wait_for_pending_flush(self):
+        if self._pending_flush is not None:
+            self._pending_flush.result()
+            self._pending_flush = None
+
+    def flush(self):
+        """
+        Bulk inserts the buffered records in the background, once the previous flush is done
+        """
+        self._wait_for_pending_flush()
+
+        inserts = []
+        for table, records in self.records.items():
+            if len(records) > 0:
+                inserts.append((table, self.headers[table], list(records)))
+                records.clear()
+
+        if len(inserts) > 0:
+            self._pending_flush = self._executor.submit(self.sql_db.execute_bulk_inserts,
+                                                        inserts,
+                                                        MAX_SQL_WORKERS,
+                                                        SQL_BATCH_SIZE)
+
+    def flush_if_full(self):
+        if sum(len(records) for records in self.records.values()) >= RECORDS_PER_FLUSH:
+            self.flush()
+
+    def close(self):
+        """
+        Bulk inserts the remaining records and waits for all inserts to finish
+        """
+        self.flush()
+        self._wait_for_pending_flush()
+        self._executor.shutdown()
+
 def create_projects_list():
     project_letters = list(string.ascii_uppercase)[:NUM_AREAS]
 
@@ -205,7 +271,7 @@ def get_user_records(user_id, user_name, first_name, last_name, project):
     return user_record, claim_records
 
 
-def create_users_and_projects():
+def create_users_and_projects(sql_db: MSSQLDB):
     logging.info("Creating users...")
 
     projects = create_projects_list()
@@ -234,9 +300,10 @@ def create_users_and_projects():
         all_user_claims += user_claim_records
 
     logging.info("Executing transactions...")
-    sql_db = MSSQLDB()
-    sql_db.execute_bulk_insert(table_user, headers_user, all_user_records)
-    sql_db.execute_bulk_insert(table_claim, headers_claim, all_user_claims)
+    sql_db.execute_bulk_inserts([(table_user, headers_user, all_user_records),
+                                 (table_claim, headers_claim, all_user_claims)],
+                                MAX_SQL_WORKERS,
+                                SQL_BATCH_SIZE)
 
 
 def generate_random_chemical_formula():
@@ -257,13 +324,16 @@ def generate_random_chemical_formula():
     return len(random_elements), elements_string
 
 
-def create_samples_and_pieces():
+def create_samples_and_pieces(sql_db: MSSQLDB):
     global global_object_id
     global global_link_id
 
-    object_info_records = []
-    sample_records = []
-    link_records = []
+    buffers = RecordBuffers(sql_db, [(table_object_info, headers_object_info),
+                                     (table_sample, headers_sample),
+                                     (table_link_object, headers_link_object)])
+    object_info_records = buffers[table_object_info]
+    sample_records = buffers[table_sample]
+    link_records = buffers[table_link_object]
     # Traces of pieces
     samples_and_pieces = []
     samples_and_pieces_created = 0
@@ -457,11 +527,10 @@ def create_samples_and_pieces():
             }
             link_records.append(apply_replacements(replacements, record_link_object))
 
+        buffers.flush_if_full()
+
     logging.info("Executing transactions...")
-    sql_db = MSSQLDB()
-    sql_db.execute_bulk_insert(table_object_info, headers_object_info, object_info_records)
-    sql_db.execute_bulk_insert(table_sample, headers_sample, sample_records)
-    sql_db.execute_bulk_insert(table_link_object, headers_link_object, link_records)
+    buffers.close()
 
     return samples_and_pieces_created, samples_and_pieces
 
@@ -692,18 +761,25 @@ def generate_handovers_for_sample(sample_creation_date,
     return sample_handovers
 
 
-def create_handovers_and_measurements(samples_and_pieces):
+def create_handovers_and_measurements(sql_db: MSSQLDB, samples_and_pieces):
     global global_object_id
     global measurements_created
     global compositions_created
 
-    object_info_records = []
-    handover_records = []
-    object_link_records = []
-    property_int_records = []
-    property_float_records = []
-    sample_records = []
-    composition_records = []
+    buffers = RecordBuffers(sql_db, [(table_object_info, headers_object_info),
+                                     (table_handover, headers_handover),
+                                     (table_link_object, headers_link_object),
+                                     (table_property_int, headers_property_int),
+                                     (table_property_float, headers_property_float),
+                                     (table_sample, headers_sample),
+                                     (table_composition, headers_composition)])
+    object_info_records = buffers[table_object_info]
+    handover_records = buffers[table_handover]
+    object_link_records = buffers[table_link_object]
+    property_int_records = buffers[table_property_int]
+    property_float_records = buffers[table_property_float]
+    sample_records = buffers[table_sample]
+    composition_records = buffers[table_composition]
 
     for (sample_id, creator_id, n_elements, formula, creation_date, pieces) in \
             (pbar := tqdm(samples_and_pieces, total=len(samples_and_pieces))):
@@ -751,15 +827,10 @@ def create_handovers_and_measurements(samples_and_pieces):
                                                    composition_records)
                 n_measurements += 1
 
+        buffers.flush_if_full()
+
     logging.info("Executing transactions...")
-    sql_db = MSSQLDB()
-    sql_db.execute_bulk_insert(table_object_info, headers_object_info, object_info_records)
-    sql_db.execute_bulk_insert(table_handover, headers_handover, handover_records)
-    sql_db.execute_bulk_insert(table_link_object, headers_link_object, object_link_records)
-    sql_db.execute_bulk_insert(table_property_int, headers_property_int, property_int_records)
-    sql_db.execute_bulk_insert(table_property_float, headers_property_float, property_float_records)
-    sql_db.execute_bulk_insert(table_sample, headers_sample, sample_records)
-    sql_db.execute_bulk_insert(table_composition, headers_composition, composition_records)
+    buffers.close()
 
 
 def create_synthetic_records(
@@ -827,11 +898,17 @@ def create_synthetic_records(
     MAX_MEASUREMENTS_PER_SAMPLE_PIECE = max_measurements_per_sample_piece
     CHANCE_FOR_EDX_MEASUREMENT = chance_for_EDX_measurement
 
-    create_users_and_projects()
-    samples_and_pieces_created, samples_and_pieces = create_samples_and_pieces()
-    sample_objects_created = global_object_id
-    logging.info(f"Generated {samples_and_pieces_created} samples and pieces. Total objects created: {sample_objects_created}")
+    sql_db = MSSQLDB()
+    tables = [table_user, table_claim, table_object_info, table_sample, table_link_object, table_handover,
+              table_property_int, table_property_float, table_composition]
+    with (sql_db.disabled_nonclustered_indexes(tables) if NUM_MAIN_SAMPLES >= DISABLE_INDEXES_MIN_MAIN_SAMPLES
+          else nullcontext()):
+        create_users_and_projects(sql_db)
+        samples_and_pieces_created, samples_and_pieces = create_samples_and_pieces(sql_db)
+        sample_objects_created = global_object_id
+        logging.info(f"Generated {samples_and_pieces_created} samples and pieces. Total objects created: {sample_objects_created}")
+
+        create_handovers_and_measurements(sql_db, samples_and_pieces)
 
-    create_handovers_and_measurements(samples_and_pieces)
     hnd_measurement_objects_created = global_object_id - sample_objects_created
     logging.info(f"Generated {measurements_created} measurements, of which there are {compositions_created} compositions. Total objects created: {hnd_measurement_objects_created}")
\ No newline at end of file
@@ -1,4 +1,5 @@
 import asyncio
+import gzip
 import logging
 import os
 import subprocess
@@ -11,7 +12,7 @@ from dotenv import load_dotenv
 import aiorwlock
 import httpx
 
-from datastores.rdf.rdf_datastore import RDFDatastore, MAIN_GRAPH_IRI, UpdateType
+from datastores.rdf.rdf_datastore import RDFDatastore, MAIN_GRAPH_IRI, UpdateType, is_compressed
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -115,9 +116,14 @@ class QleverRDFDatastore(RDFDatastore):
 
     async def _upload_file(self, file_path: str, graph_iri: str = MAIN_GRAPH_IRI):
         """
-        Uploads a file using the SPARQL 1.2 Graph Store Protocol. The file must be in turtle (.ttl) format.
+        Uploads a file using the SPARQL 1.2 Graph Store Protocol. The file must be in turtle (.ttl) format, and may be
+        gzip-compressed (.ttl.gz).
         """
-        file_contents = open(file_path, 'r').read()
+        if is_compressed(file_path):
+            with gzip.open(file_path, 'rt') as f:
+                file_contents = f.read()
+        else:
+            file_contents = open(file_path, 'r').read()
 
         # This shoud be illegal
         g = rdflib.Graph()
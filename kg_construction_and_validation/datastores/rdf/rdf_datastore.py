@@ -1,6 +1,8 @@
+import base64
 import subprocess
 from abc import ABC, abstractmethod
 from enum import Enum
+from pathlib import Path
 
 from requests import Response
 
@@ -11,6 +13,50 @@ class UpdateType(str, Enum):
 MAIN_GRAPH_IRI = "https://crc1625.mdi.ruhr-uni-bochum.de/graph"
 WORKFLOWS_GRAPH_IRI = "https://crc1625.mdi.ruhr-uni-bochum.de/graph/workflows"
 
+# Extension of gzip-compressed RDF files, e.g. materialized_triples.ttl.gz
+COMPRESSED_FILE_EXTENSION = "gz"
+
+
+def get_file_extension(file_path: str) -> str:
+    """
+    Returns the extension of an RDF file, including that of its compression if compressed (e.g. "ttl" or "ttl.gz")
+    """
+    suffixes = Path(file_path).suffixes
+    if len(suffixes) >= 2 and suffixes[-1] == f".{COMPRESSED_FILE_EXTENSION}":
+        return "".join(suffixes[-2:])[1:]
+    return Path(file_path).suffix[1:]
+
+
+def is_compressed(file_path_or_extension: str) -> bool:
+    return (file_path_or_extension == COMPRESSED_FILE_EXTENSION
+            or file_path_or_extension.endswith(f".{COMPRESSED_FILE_EXTENSION}"))
+
+
+def read_file_for_payload(file_path: str) -> tuple[str, str]:
+    """
+    Reads an RDF file to be sent to the datastore API, returning (its contents, its extension). Compressed files are
+    sent as they are, base64-encoded
+    """
+    extension = get_file_extension(file_path)
+    if is_compressed(extension):
+        with open(file_path, 'rb') as f:
+            return base64.b64encode(f.read()).decode("ascii"), extension
+
+    with open(file_path, 'r') as f:
+        return f.read(), extension
+
+
+def write_file_from_payload(contents: str, file_path: str):
+    """
+    Writes an RDF file received by the datastore API, see read_file_for_payload
+    """
+    if is_compressed(file_path):
+        with open(file_path, 'wb') as f:
+            f.write(base64.b64decode(contents))
+    else:
+        with open(file_path, 'w') as f:
+            f.write(contents)
+
 class RDFDatastore(ABC):
     """
     Abstract class for operating with an RDF store
@@ -11,7 +11,7 @@ from fastapi import FastAPI, HTTPException, Body
 from pydantic import BaseModel
 
 from datastores.rdf.qlever_datastore import QleverRDFDatastore
-from datastores.rdf.rdf_datastore import UpdateType, RDFDatastore, MAIN_GRAPH_IRI
+from datastores.rdf.rdf_datastore import UpdateType, RDFDatastore, MAIN_GRAPH_IRI, write_file_from_payload
 from datastores.rdf.virtuoso_datastore import VirtuosoRDFDatastore
 
 logging.basicConfig(
@@ -100,7 +100,7 @@ async def rpc_launch_updates(payload: UpdatesRequest):
                 actions.append((query_or_file_str, update_type))
             else:
                 random_filename = get_random_file_name(file_extension_or_none)
-                open(f"{random_filename}", "w").write(query_or_file_str)
+                write_file_from_payload(query_or_file_str, random_filename)
                 actions.append((random_filename, update_type))
 
         await rdf_store.launch_updates(
@@ -126,7 +126,7 @@ async def rpc_upload_file(payload: FileUploadRequest):
     """
     try:
         random_filename = get_random_file_name(payload.file_extension)
-        open(f"{random_filename}", "w").write(payload.file_as_str)
+        write_file_from_payload(payload.file_as_str, random_filename)
 
         await rdf_store.upload_file(
             file=random_filename,
@@ -150,7 +150,7 @@ async def rpc_bulk_file_load(payload: BulkFileUploadRequest):
         file_paths = []
         for file_as_str, extension in payload.files_as_str:
             random_filename = get_random_file_name(extension)
-            open(f"{random_filename}", "w").write(file_as_str)
+            write_file_from_payload(file_as_str, random_filename)
             file_paths.append(random_filename)
 
         await rdf_store.bulk_file_load(
@@ -1,12 +1,11 @@
 import asyncio
 import os
-from pathlib import Path
 from typing import List, Tuple, Coroutine
 from dotenv import load_dotenv
 
 import httpx
 
-from datastores.rdf.rdf_datastore import UpdateType, MAIN_GRAPH_IRI, WORKFLOWS_GRAPH_IRI
+from datastores.rdf.rdf_datastore import UpdateType, MAIN_GRAPH_IRI, WORKFLOWS_GRAPH_IRI, read_file_for_payload
 
 module_dir = os.path.dirname(__file__)
 load_dotenv(os.path.join(module_dir, '../../.env'))
@@ -87,14 +86,15 @@ async def launch_updates(actions: List[Tuple[str, UpdateType]],
     Launches a set of update queries with an exclusive writer lock. Note that this is not a transaction, i.e. there is no rollback
     mechanism if any of the updates fails.
 
-    Any file upload update will its file read and uploaded to the API transparently
+    Any file upload update will its file read and uploaded to the API transparently. Files may be gzip-compressed
     """
     actions_to_send = []
     for query_or_file_path, update_type in actions:
         if update_type == UpdateType.query:
             actions_to_send.append((query_or_file_path, update_type, None))
         else:
-            actions_to_send.append((open(query_or_file_path, 'r').read(), update_type, Path(query_or_file_path).suffix[1:]))
+            (file_as_str, file_extension) = read_file_for_payload(query_or_file_path)
+            actions_to_send.append((file_as_str, update_type, file_extension))
 
     payload = {
         "actions": actions_to_send,
@@ -113,15 +113,17 @@ async def upload_file(file_path: str,
                       graph_iri: str = MAIN_GRAPH_IRI,
                       delete_file_after_upload: bool = False):
     """
-    Uploads a local RDF file to the SPARQL endpoint. The file must be in turtle (.ttl) format.
+    Uploads a local RDF file to the SPARQL endpoint. The file must be in turtle (.ttl) format, and may be gzip-compressed
+    (.ttl.gz).
 
     If no graph IRI is specified, it will be stored in the CRC 1625 graph.
 
     The file is read and uploaded to the API transparently.
     """
+    (file_as_str, file_extension) = read_file_for_payload(file_path)
     payload = {
-        "file_as_str": open(file_path, 'r').read(),
-        "file_extension": Path(file_path).suffix[1:],
+        "file_as_str": file_as_str,
+        "file_extension": file_extension,
         "graph_iri": graph_iri
     }
     response = await _post("upload_file", payload)
@@ -137,14 +139,15 @@ async def bulk_file_load(file_paths: list[str],
                          use_lock: bool = True,
                          graph_iri: str = MAIN_GRAPH_IRI):
     """
-    Uploads a collection of local RDF files to the SPARQL endpoint. The files must be in turtle (.ttl) format.
+    Uploads a collection of local RDF files to the SPARQL endpoint. The files must be in turtle (.ttl) format, and may be
+    gzip-compressed (.ttl.gz).
 
     If no graph IRI is specified, it will be stored in the CRC 1625 graph.
 
-    The files are read and uploaded to the API transparently.
+    The files are read and uploaded to the API transparently. Compressed files are sent and loaded without decompressing them.
     """
     payload = {
-        "files_as_str" : [(open(file_path, 'r').read(), Path(file_path).suffix[1:]) for file_path in file_paths],
+        "files_as_str" : [read_file_for_payload(file_path) for file_path in file_paths],
         "graph_iri" : graph_iri,
         "delete_files_after_upload" : True, # We write a tempfile at the virtuoso endpoint
         "use_lock": use_lock
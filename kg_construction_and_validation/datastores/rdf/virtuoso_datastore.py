@@ -1,6 +1,7 @@
 import glob
 import logging
 import os
+import re
 import shutil
 import subprocess
 import sys
@@ -12,7 +13,7 @@ from dotenv import load_dotenv
 import aiorwlock
 import httpx
 
-from datastores.rdf.rdf_datastore import RDFDatastore, MAIN_GRAPH_IRI, UpdateType
+from datastores.rdf.rdf_datastore import RDFDatastore, MAIN_GRAPH_IRI, UpdateType, COMPRESSED_FILE_EXTENSION, is_compressed
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -37,6 +38,18 @@ CONTAINER_DATA_DIR = "/data"
 
 DOCKER_CONTAINER_NAME = os.environ.get("VIRTUOSO_DOCKER_CONTAINER_NAME")
 
+# Number of concurrent rdf_loader_run() calls of a bulk load. Each loader loads one file at a time, so large files are
+# split into this number of shards (see _register_file). Virtuoso runs on the same host, so it defaults to its cores
+BULK_LOADERS = int(os.environ.get("VIRTUOSO_BULK_LOADERS", os.cpu_count() or 1))
+# Line-based files larger than this are split into shards before loading them
+SHARD_MIN_FILE_BYTES = 64 * 1024 ** 2
+# Bytes read from the start of a file to tell whether it is line-based (N-Triples or N-Quads) or not (e.g. Turtle)
+LINE_BASED_SAMPLE_BYTES = 64 * 1024
+# Buffer size used to copy the shards
+SHARD_COPY_BUFFER_BYTES = 1024 * 1024
+
+line_based_statement_pattern = re.compile(rb'^\s*(?:(?:<|_:).*\.\s*|#.*)?$')
+
 class VirtuosoRDFDatastore(RDFDatastore):
     """
     Wrapper for a Virtuoso instance deployed as a local docker container
@@ -129,18 +142,78 @@ class VirtuosoRDFDatastore(RDFDatastore):
         ]
         subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
 
-    def _register_file(self, file_path: str):
+    @staticmethod
+    def _is_line_based(file_path: str) -> bool:
+        """
+        Returns whether the file looks like N-Triples or N-Quads (one statement per line, as written by the mapping
+        engines) from its first LINE_BASED_SAMPLE_BYTES, in which case it can be split at any line boundary
+        """
+        with open(file_path, 'rb') as f:
+            sample = f.read(LINE_BASED_SAMPLE_BYTES)
+
+        # The last line may be cut
+        lines = sample.split(b"\n")[:-1] if len(sample) == LINE_BASED_SAMPLE_BYTES else sample.split(b"\n")
+        return all(line_based_statement_pattern.match(line) for line in lines)
+
+    @staticmethod
+    def _split_file(file_path: str, number_of_shards: int) -> list[str]:
+        """
+        Splits a line-based file into up to number_of_shards files of roughly the same size in the Virtuoso data folder,
+        cutting it at line boundaries, and returns their file paths
+        """
+        file_size = os.path.getsize(file_path)
+        (stem, extension) = os.path.splitext(os.path.basename(file_path))
+
+        shard_paths = []
+        with open(file_path, 'rb') as f:
+            # Every shard starts after the first line break following its share of the file
+            boundaries = [0]
+            for i in range(1, number_of_shards):
+                f.seek(i * file_size // number_of_shards)
+                f.readline()
+                if boundaries[-1] < f.tell() < file_size:
+                    boundaries.append(f.tell())
+            boundaries.append(file_size)
+
+            for i in range(0, len(boundaries) - 1):
+                shard_path = os.path.join(HOST_DATA_DIR, f"{stem}_shard_{i}{extension}")
+                f.seek(boundaries[i])
+                remaining_bytes = boundaries[i + 1] - boundaries[i]
+                with open(shard_path, 'wb') as shard:
+                    while remaining_bytes > 0:
+                        chunk = f.read(min(SHARD_COPY_BUFFER_BYTES, remaining_bytes))
+                        shard.write(chunk)
+                        remaining_bytes -= len(chunk)
+                shard_paths.append(shard_path)
+
+        return shard_paths
+
+    def _register_file(self, file_path: str) -> list[str]:
         """
-        Copies the .ttl file to the Virtuoso data folder, for later processing, and returns its file path
+        Places the .ttl (or gzip-compressed .ttl.gz) file in the Virtuoso data folder, for later processing, and returns
+        the file paths placed there. The file is hard-linked if possible, and copied otherwise (e.g. if it is in another
+        filesystem)
+
+        Virtuoso's loaders load one file each at a time, so large N-Triples/N-Quads files are split into BULK_LOADERS
+        shards instead, letting all of them work on the same file. Compressed files are not split
 
         The actual registration into Virtuoso's bulk loader is done over the entire
         folder after registering all files
         """
+        if (BULK_LOADERS > 1
+                and not is_compressed(file_path)
+                and os.path.getsize(file_path) > SHARD_MIN_FILE_BYTES
+                and self._is_line_based(file_path)):
+            return self._split_file(file_path, BULK_LOADERS)
+
         filename = os.path.basename(file_path)
         target_path = os.path.join(HOST_DATA_DIR, filename)
-        shutil.copy(file_path, target_path)
+        try:
+            os.link(file_path, target_path)
+        except OSError:
+            shutil.copy(file_path, target_path)
 
-        return target_path
+        return [target_path]
 
     async def bulk_file_load(self,
                              file_paths: list[str],
@@ -149,7 +222,7 @@ class VirtuosoRDFDatastore(RDFDatastore):
                              use_lock=True):
         """
         Uploads RDF files to the SPARQL endpoint, optimized for speed by
-        parallelizing requests if possible
+        parallelizing requests if possible: BULK_LOADERS loaders run concurrently, over the shards of large files
 
         If no graph IRI is specified, it will be stored in the CRC 1625 graph.
         """
@@ -163,7 +236,7 @@ class VirtuosoRDFDatastore(RDFDatastore):
 
             registered_file_paths = []
             for file in file_paths:
-                registered_file_paths.append(self._register_file(file))
+                registered_file_paths.extend(self._register_file(file))
 
             # Write a file called global.graph in CONTAINER_DATA_DIR containing only GRAPH_IRI as its contents
             with open(os.path.join(HOST_DATA_DIR, "global.graph"), "w") as f:
@@ -171,9 +244,11 @@ class VirtuosoRDFDatastore(RDFDatastore):
 
             self._run_isql(f"DELETE FROM DB.DBA.load_list;")  # This took a while to discover...
             self._run_isql(f"ld_dir('{CONTAINER_DATA_DIR}', '*.ttl', '{graph_iri}');")
+            # The bulk loader decompresses .gz files itself
+            self._run_isql(f"ld_dir('{CONTAINER_DATA_DIR}', '*.ttl.{COMPRESSED_FILE_EXTENSION}', '{graph_iri}');")
 
-            with ThreadPoolExecutor(max_workers=16) as executor:
-                futures = [executor.submit(self._run_isql, "rdf_loader_run();") for _ in range(0, 16)]
+            with ThreadPoolExecutor(max_workers=BULK_LOADERS) as executor:
+                futures = [executor.submit(self._run_isql, "rdf_loader_run();") for _ in range(0, BULK_LOADERS)]
                 for future in as_completed(futures):
                     future.result()
 
@@ -1,18 +1,26 @@
+import csv
+import glob
+import hashlib
+import itertools
 import logging
 import os
+import re
 import shutil
 import stat
 import subprocess
 import sys
+import threading
 import time
 import uuid
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from subprocess import CalledProcessError
 
 import pandas as pd
-import pymssql
 import requests
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, Engine, URL
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -34,6 +42,50 @@ MSSQL_MASTER_DATABASE_NAME = os.environ.get("MSSQL_MASTER_DATABASE_NAME")
 MSSQL_PROD_TENANT_URL = os.environ.get("MSSQL_PROD_TENANT_URL")
 MSSQL_PROD_API_KEY = os.environ.get("MSSQL_PROD_API_KEY")
 
+# Rows fetched from the server at once when exporting query results to CSV files
+CSV_EXPORT_BATCH_SIZE = 50_000
+
+# Connection pool of each database. The mappings queries are run in os.cpu_count() threads
+SQL_POOL_SIZE = os.cpu_count()
+SQL_POOL_MAX_OVERFLOW = 4
+SQL_POOL_TIMEOUT = 600 # s., queries can run for minutes while other threads wait for their connection
+SQL_POOL_RECYCLE = 3600 # s.
+
+# Readiness probe of a local DB container (see wait_until_ready): first wait between probes, factor by which the wait
+# grows after each failed probe, maximum wait and maximum total time before giving up, in s.
+READINESS_PROBE_INITIAL_INTERVAL = 0.5
+READINESS_PROBE_BACKOFF = 1.5
+READINESS_PROBE_MAX_INTERVAL = 5
+READINESS_PROBE_TIMEOUT = 300
+
+# Database-level extended property storing the hash of the additional indexes applied to the DB. It is part of the DB,
+# so it is kept in its backups too
+ADDITIONAL_INDEXES_PROPERTY = "materialization_additional_indexes"
+
+# Database snapshots of the CRC 1625 DB (see create_snapshot) are named {SNAPSHOT_DATABASE_PREFIX}{snapshot name}
+SNAPSHOT_DATABASE_PREFIX = f"{MSSQL_CRC1625_DATABASE_NAME}_snapshot_"
+snapshot_name_pattern = re.compile(r"^\w+$")
+
+# XML namespace of the execution plans (see query_with_actual_plans and get_estimated_plans)
+showplan_namespace = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+# Backups (see dump_database): number of files each backup is striped across, which SQL Server writes and reads with one
+# thread each, whether to compress them, and the number and size (in bytes, at most 4 MB) of the I/O buffers.
+# The startup restore of docker_compose_mssql.yml reads a single uncompressed file, so striping and compression are opt-in
+BACKUP_STRIPES = 1
+BACKUP_COMPRESSION = False
+BACKUP_BUFFER_COUNT = 64
+BACKUP_MAX_TRANSFER_SIZE = 4 * 1024 ** 2
+
+# Bulk inserts (see execute_bulk_insert): rows written to each batch file, rows committed per BULK INSERT batch, and
+# number of tables inserted into at the same time by execute_bulk_inserts
+BULK_INSERT_FILE_ROWS = 1_000_000
+BULK_INSERT_BATCH_SIZE = 100_000
+BULK_INSERT_MAX_WORKERS = 8
+
+HOST_BACKUP_DIR = os.path.join(module_dir, './db_dumps')
+CONTAINER_BACKUP_DIR = "/var/opt/mssql/backup"
+
 class MSSQLDB():
     """
     Wrapper for a remote production endpoint or a local MSSQL Docker container storing an instance of the CRC 1625 DB.
@@ -48,32 +100,180 @@ class MSSQLDB():
     docker_file: str = ""
     is_remote: bool = False
 
+    def __init__(self):
+        # Database name -> engine, created on first use. Every method obtains its connections from their pools
+        self._engines: dict[str, Engine] = dict()
+        self._lock = threading.Lock()
+        self._pool_metrics = {
+            "connections_created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "max_overflow": 0
+        }
+
+    def __getstate__(self):
+        # Engines cannot be sent to other processes (e.g. process pools), they will create their own
+        state = self.__dict__.copy()
+        state["_engines"] = dict()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get_engine(self, database: str) -> Engine:
+        """
+        Returns the engine of a database, creating it and its connection pool if it does not exist yet
+        """
+        with self._lock:
+            if database not in self._engines:
+                engine = create_engine(
+                    URL.create("mssql+pymssql",
+                               username=MSSQL_USER,
+                               password=MSSQL_PASSWORD,
+                               host=MSSQL_HOST,
+                               port=int(MSSQL_PORT) if MSSQL_PORT else None,
+                               database=database),
+                    pool_size=SQL_POOL_SIZE,
+                    max_overflow=SQL_POOL_MAX_OVERFLOW,
+                    pool_timeout=SQL_POOL_TIMEOUT,
+                    pool_recycle=SQL_POOL_RECYCLE,
+                    pool_pre_ping=True
+                )
+                event.listen(engine, "connect", self._on_connect)
+                event.listen(engine, "checkout", self._on_checkout)
+                self._engines[database] = engine
+
+            return self._engines[database]
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self._pool_metrics["connections_created"] += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self._pool_metrics["checkouts"] += 1
+
+    @contextmanager
+    def _connection(self, database: str = MSSQL_CRC1625_DATABASE_NAME, autocommit: bool = False):
+        """
+        Checks out a pymssql connection from the pool of the database, returning it once the context is left
+        """
+        engine = self._get_engine(database)
+
+        had_to_wait = engine.pool.checkedout() >= SQL_POOL_SIZE + SQL_POOL_MAX_OVERFLOW
+        start = time.perf_counter()
+        conn = engine.raw_connection()
+        wait_time = time.perf_counter() - start
+
+        with self._lock:
+            if had_to_wait:
+                self._pool_metrics["waits"] += 1
+                self._pool_metrics["wait_time"] += wait_time
+            self._pool_metrics["max_overflow"] = max(self._pool_metrics["max_overflow"], engine.pool.overflow())
+
+        try:
+            if autocommit:
+                conn.driver_connection.autocommit(True)
+            yield conn
+        finally:
+            if autocommit:
+                conn.driver_connection.autocommit(False)
+            conn.close()
+
+    def get_pool_metrics(self) -> dict[str, int | float]:
+        """
+        Returns metrics of the connection pools since the object was created:
+            - connections_created: New connections opened against the server
+            - checkouts: Connections handed out by the pools
+            - waits / wait_time: Checkouts (and the total s. they spent) that had to wait for a connection to be returned
+            - max_overflow: Maximum number of connections opened beyond SQL_POOL_SIZE at the same time
+        """
+        with self._lock:
+            return dict(self._pool_metrics)
+
+    def close(self):
+        """
+        Closes all pooled connections. The pools will be recreated if the object is used again
+        """
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines = dict()
+
     def _execute_query(self, query: str):
         """
         Executes a query. Does not return its result
         """
-        conn = pymssql.connect(
-            server=MSSQL_HOST,
-            port=MSSQL_PORT,
-            user=MSSQL_USER,
-            password=MSSQL_PASSWORD,
-            database=MSSQL_CRC1625_DATABASE_NAME,
-        )
-        cursor = conn.cursor()
-        cursor.execute(query)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query)
+
+            conn.commit()
+            cursor.close()
+
+    def query_to_records(self, query: str, database: str = MSSQL_CRC1625_DATABASE_NAME) -> list[dict]:
+        """
+        Executes a query and returns its results as a list of column name -> value dicts. Intended for small results
+        (e.g. bookkeeping queries), use query_to_csv for the mappings
+
+        :param database: Database to run the query against, ignored if the DB is remote
+        """
+        if self.is_remote:
+            headers = {'VroApi': MSSQL_PROD_API_KEY}
+            data = {'sql': query}
+            response = requests.post(MSSQL_PROD_TENANT_URL + "execute", headers=headers, data=data)
+            response.raise_for_status()
+            if not response.text:
+                return []
+            return pd.DataFrame.from_dict(response.json()).to_dict(orient='records')
+
+        with self._connection(database) as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(query)
+            records = cursor.fetchall()
+
+            cursor.close()
+
+        return records
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+    def iterate_query(self, query: str, batch_size: int = 10_000):
+        """
+        Executes a query and lazily yields its results as column name -> value dicts, fetching them from the server in
+        batches of batch_size rows, so that large results never have to be fully held in memory.
+
+        The remote endpoint does not support streaming, its results are fetched in full and then yielded
+        """
+        if self.is_remote:
+            yield from self.query_to_records(query)
+            return
+
+        with self._connection() as conn:
+            cursor = conn.cursor(as_dict=True)
+            try:
+                cursor.execute(query)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cursor.close()
 
     def query_to_csv(self,
                      query: str,
-                     csv_filename: str) -> tuple[bool, str]:
+                     csv_filename: str,
+                     batch_size: int = CSV_EXPORT_BATCH_SIZE) -> tuple[bool, str, int, int]:
         """
-        Executes a query and writes results to a CSV file
+        Executes a query and writes results to a CSV file. Results are streamed from the server in batches of batch_size
+        rows, so that memory usage does not depend on the size of the result. Line breaks in values are replaced by
+        spaces.
 
-        Returns (True, query) if the query yielded results, (False, query) otherwise. Query is returned to identify jobs,
-        as they are run in thread pools.
+        Returns (True, query, rows, bytes) if the query yielded results, (False, query, 0, 0) otherwise, where rows and
+        bytes are the number of rows and bytes written to the CSV file. Query is returned to identify jobs, as they are
+        run in thread pools.
         """
         if self.is_remote:
             headers = {'VroApi': MSSQL_PROD_API_KEY}
@@ -81,24 +281,161 @@ class MSSQLDB():
             response = requests.post(MSSQL_PROD_TENANT_URL + "execute", headers=headers, data=data)
             response.raise_for_status()
             if not response.text:
-                return (False, query)
-            else:
-                try:
-                    df = pd.DataFrame.from_dict(response.json())
-                except Exception as e:
-                    print("EXCEPTION:", query, "FILENAME", csv_filename)
-                    return e
-        else:
-            df = pd.read_sql(query, create_engine(f'mssql+pymssql://{MSSQL_USER}:{MSSQL_PASSWORD.replace("@", "%40")}@{MSSQL_HOST}:{MSSQL_PORT}/RUB_INF'))
+                return (False, query, 0, 0)
 
-        if not df.empty:
-            str_cols = df.select_dtypes(include=['object', 'string']).columns
-            df[str_cols] = df[str_cols].replace({r'[\r\n]+': ' '}, regex=True)
-            df.to_csv(csv_filename, index=False, encoding='utf-8')
-            return (True, query)
+            df = pd.DataFrame.from_dict(response.json())
+            df = df.astype(object).where(df.notna(), None) # NULLs as empty values
+            rows_written = self._write_csv(csv_filename, list(df.columns), [df.itertuples(index=False, name=None)])
         else:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query)
+                    rows_written = self._write_csv(csv_filename,
+                                                   [column[0] for column in cursor.description],
+                                                   iter(lambda: cursor.fetchmany(batch_size), []))
+                finally:
+                    cursor.close()
+
+        if rows_written == 0:
+            os.remove(csv_filename)
             logging.warning(f'A .csv query returned no results ({csv_filename}). This may happen when, e.g., mappings for specific object types that are not used.')
-            return (False, query)
+            return (False, query, 0, 0)
+
+        return (True, query, rows_written, os.path.getsize(csv_filename))
+
+    def query_with_actual_plans(self,
+                                query: str,
+                                batch_size: int = CSV_EXPORT_BATCH_SIZE) -> tuple[int, float, list[str]]:
+        """
+        Executes a query under SET STATISTICS XML ON, fetching (and discarding) its results in batches of batch_size
+        rows, as query_to_csv does. The plans include the actual number of rows and executions of each operator, and the
+        indexes the optimizer found missing
+
+        :returns: (number of rows returned, execution time in s., actual execution plans (showplan XML) of its statements)
+        """
+        if self.is_remote:
+            raise RuntimeError("Execution plans can only be obtained from local DBs deployed as docker containers")
+
+        rows = 0
+        plans = []
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SET STATISTICS XML ON;")
+                start = time.perf_counter()
+                cursor.execute(query)
+                # Each statement yields its results, followed by its plan as a one-row result set
+                while True:
+                    if cursor.description is not None and "Showplan" in cursor.description[0][0]:
+                        plans += [row[0] for row in cursor.fetchall()]
+                    elif cursor.description is not None:
+                        while batch := cursor.fetchmany(batch_size):
+                            rows += len(batch)
+                    if not cursor.nextset():
+                        break
+                execution_time = time.perf_counter() - start
+            finally:
+                cursor.close()
+                # Discarded instead of returned to the pool, so that the setting does not apply to other queries
+                conn.invalidate()
+
+        return rows, execution_time, plans
+
+    def get_estimated_plans(self, query: str) -> list[str]:
+        """
+        Compiles a query under SET SHOWPLAN_XML ON, without executing it. The plans include the number of rows the
+        optimizer estimates each statement and operator to return (StatementEstRows and EstimateRows), taken from the
+        statistics of the tables
+
+        :returns: Estimated execution plans (showplan XML) of the statements of the query
+        """
+        if self.is_remote:
+            raise RuntimeError("Estimated execution plans can only be obtained from local DBs deployed as docker containers")
+
+        plans = []
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SET SHOWPLAN_XML ON;")
+                cursor.execute(query)
+                # Each batch yields its plan as a one-row result set
+                while True:
+                    if cursor.description is not None:
+                        plans += [row[0] for row in cursor.fetchall()]
+                    if not cursor.nextset():
+                        break
+            finally:
+                cursor.close()
+                # Discarded instead of returned to the pool, so that the setting does not apply to other queries
+                conn.invalidate()
+
+        return plans
+
+    def drop_clean_buffers(self):
+        """
+        Empties the buffer pool of the server, so that the next queries read their data from disk (i.e. run with cold
+        caches)
+        """
+        if self.is_remote:
+            raise RuntimeError("The buffer pool can only be emptied in local DBs deployed as docker containers")
+
+        with self._connection(autocommit=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("CHECKPOINT; DBCC DROPCLEANBUFFERS;")
+            cursor.close()
+
+    @staticmethod
+    def _write_csv(csv_filename: str, columns: list[str], batches) -> int:
+        """
+        Writes batches of rows to a CSV file, replacing line breaks in values by spaces. Returns the number of rows written
+        """
+        rows_written = 0
+        with open(csv_filename, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(columns)
+
+            for batch in batches:
+                rows = [[re.sub(r'[\r\n]+', ' ', value) if isinstance(value, str) else value for value in row]
+                        for row in batch]
+                writer.writerows(rows)
+                rows_written += len(rows)
+
+        return rows_written
+
+    def create_staging_table(self,
+                             table_name: str,
+                             query: str,
+                             indexes: list[list[str]]):
+        """
+        Materializes the results of a query into a (regular) table, replacing it if it already exists, so that they can
+        be reused by other queries running in any connection.
+
+        :param table_name: Name of the table to create, in the default schema
+        :param query: Query whose results will fill the table
+        :param indexes: Lists of columns to create an index for. The first index will be the clustered one
+        """
+        if self.is_remote:
+            raise RuntimeError("Staging tables can only be created in local DBs deployed as docker containers")
+
+        statements = [
+            f"DROP TABLE IF EXISTS {table_name};",
+            f"SELECT * INTO {table_name} FROM ({query}) stagingQuery;"
+        ]
+        for i, columns in enumerate(indexes):
+            statements.append(f"CREATE {"CLUSTERED" if i == 0 else "NONCLUSTERED"} INDEX IX_{table_name}_{i} "
+                              f"ON {table_name} ({", ".join(columns)});")
+
+        self._execute_query("\n".join(statements))
+
+    def drop_table(self, table_name: str):
+        """
+        Drops a table, if it exists
+        """
+        if self.is_remote:
+            raise RuntimeError("Tables can only be dropped in local DBs deployed as docker containers")
+
+        self._execute_query(f"DROP TABLE IF EXISTS {table_name};")
 
 
     def clear_data_dir(self):
@@ -114,10 +451,66 @@ class MSSQLDB():
             else:
                 os.remove(item_path)
 
-    def select_and_start_db(self, db_option: str | None =None):
+    def is_ready(self) -> bool:
+        """
+        Returns whether the local DB container accepts connections and the CRC 1625 DB is online (i.e. restored)
+        """
+        try:
+            records = self.query_to_records(f"SELECT state_desc FROM sys.databases WHERE name = '{MSSQL_CRC1625_DATABASE_NAME}'",
+                                            database=MSSQL_MASTER_DATABASE_NAME)
+        except Exception:
+            return False
+
+        return len(records) == 1 and records[0]["state_desc"] == "ONLINE"
+
+    def wait_until_ready(self):
+        """
+        Probes the DB (see is_ready) with an exponential backoff until it is ready
+
+        :raises TimeoutError: If the DB is not ready after READINESS_PROBE_TIMEOUT s.
+        """
+        start = time.perf_counter()
+        interval = READINESS_PROBE_INITIAL_INTERVAL
+        while not self.is_ready():
+            if time.perf_counter() - start > READINESS_PROBE_TIMEOUT:
+                raise TimeoutError(f"The MSSQL container was not ready after {READINESS_PROBE_TIMEOUT} s.")
+            time.sleep(interval)
+            interval = min(interval * READINESS_PROBE_BACKOFF, READINESS_PROBE_MAX_INTERVAL)
+
+        logging.info(f"MSSQL ready after {time.perf_counter() - start:.1f} s.")
+
+    def apply_additional_indexes(self):
+        """
+        Creates the additional indexes (see ADDITIONAL_INDEXES_QUERY), unless the DB already has this same set of indexes,
+        as recorded in its ADDITIONAL_INDEXES_PROPERTY
+        """
+        indexes_hash = hashlib.sha256(self.ADDITIONAL_INDEXES_QUERY.encode()).hexdigest()
+
+        records = self.query_to_records(f"""
+            SELECT CAST(value AS NVARCHAR(64)) AS indexesHash
+            FROM sys.extended_properties
+            WHERE class = 0 AND name = '{ADDITIONAL_INDEXES_PROPERTY}'
+        """)
+        if len(records) == 1 and records[0]["indexesHash"] == indexes_hash:
+            logging.info("The additional indexes were already created")
+            return
+
+        logging.info("Creating additional indexes...")
+        self._execute_query(self.ADDITIONAL_INDEXES_QUERY)
+        self._execute_query(f"""
+            IF EXISTS (SELECT 1 FROM sys.extended_properties WHERE class = 0 AND name = '{ADDITIONAL_INDEXES_PROPERTY}')
+                EXEC sp_updateextendedproperty @name = N'{ADDITIONAL_INDEXES_PROPERTY}', @value = N'{indexes_hash}';
+            ELSE
+                EXEC sp_addextendedproperty @name = N'{ADDITIONAL_INDEXES_PROPERTY}', @value = N'{indexes_hash}';
+        """)
+
+    def select_and_start_db(self, db_option: str | None =None, reuse_container: bool = True):
         """
         Selects and starts the selected SQL database container.
         If `db_option` == None, then the choice will be requested via CLI
+
+        If reuse_container and a container is already running, the selected DB dump is restored into it instead of
+        recreating it
         Possible values:
             Production DB endpoints:
             - 'p': Remote production endpoint (only available within the CRC, will not create a local Docker container)
@@ -186,9 +579,17 @@ class MSSQLDB():
         if db_option == 'p':
             self.is_remote = True
             logging.info("The production DB endpoint has been chosen. No local containers will be created.")
+        elif reuse_container and self.get_docker_container_id() is not None and self.is_ready():
+            logging.info("Reusing the running MSSQL container, restoring the selected DB into it...")
+            self.restore_database(options[db_option].removesuffix(".bak"))
+
+            self.apply_additional_indexes()
         else:
+            self.is_remote = False
             logging.info("Starting MSSQL container...")
 
+            # Pooled connections would point to the previous container
+            self.close()
             self.clear_data_dir()
             try:
                 subprocess.run(
@@ -206,12 +607,14 @@ class MSSQLDB():
                     cwd=module_dir
                 ).check_returncode()
 
-                time.sleep(15) # Allow MSSQL to create the DB and allow connections
             except Exception as e:
                 raise CalledProcessError(f"Error when setting up the MSSQL container: {e}")
 
+            # Wait for MSSQL to accept connections and restore the DB
+            self.wait_until_ready()
+
             # Create additional indexes for better performance
-            self._execute_query(self.ADDITIONAL_INDEXES_QUERY)
+            self.apply_additional_indexes()
 
     def stop_DB(self):
         """
@@ -221,119 +624,422 @@ class MSSQLDB():
             raise RuntimeError("Only local DBs deployed as docker containers can be stopped")
 
         logging.info("Stopping and removing MSSQL container...")
+        self.close()
         subprocess.run(
             ["docker-compose", "-f", "docker_compose_mssql.yml", "down", "--volumes", "--remove-orphans"],
             check=True,
             cwd=module_dir
         )
 
+    def get_docker_container_id(self) -> str | None:
+        """
+        Returns the ID of the DB container, or None if the DB is remote or its container is not running
+        """
+        if self.is_remote:
+            return None
+
+        try:
+            result = subprocess.run(
+                ["docker-compose", "-f", "docker_compose_mssql.yml", "ps", "-q", "db"],
+                capture_output=True,
+                text=True,
+                check=False,
+                timeout=10,
+                cwd=module_dir
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+
+        container_id = result.stdout.strip()
+        return container_id if result.returncode == 0 and container_id != "" else None
+
+    @staticmethod
+    def get_backup_file_names(identifier: str, stripes: int = 1) -> list[str]:
+        """
+        Returns the names of the files of a backup: {identifier}.bak, or {identifier}.stripe_{i}_of_{stripes}.bak if it
+        is striped
+        """
+        if stripes == 1:
+            return [f"{identifier}.bak"]
+        return [f"{identifier}.stripe_{i}_of_{stripes}.bak" for i in range(1, stripes + 1)]
+
+    def find_backup_file_names(self, identifier: str) -> list[str] | None:
+        """
+        Returns the names of the files of an existing backup (see get_backup_file_names), or None if there is no complete
+        backup with the given identifier
+        """
+        if os.path.exists(os.path.join(HOST_BACKUP_DIR, f"{identifier}.bak")):
+            return [f"{identifier}.bak"]
+
+        stripe_files = glob.glob(os.path.join(HOST_BACKUP_DIR, f"{glob.escape(identifier)}.stripe_*_of_*.bak"))
+        stripe_counts = {int(re.search(r"_of_(\d+)\.bak$", stripe_file).group(1)) for stripe_file in stripe_files}
+        for stripes in sorted(stripe_counts, reverse=True):
+            file_names = self.get_backup_file_names(identifier, stripes)
+            if all(os.path.exists(os.path.join(HOST_BACKUP_DIR, file_name)) for file_name in file_names):
+                return file_names
+
+        return None
+
     def database_backup_exists(self, identifier):
         """
-        Returns True if a database backup with the given identifier exists, False otherwise
+        Returns True if a complete database backup (single file or striped) with the given identifier exists, False otherwise
         """
-        return os.path.exists(os.path.join(module_dir, f'./db_dumps/{identifier}.bak'))
+        return self.find_backup_file_names(identifier) is not None
 
-    def dump_database(self, identifier):
+    def dump_database(self,
+                      identifier,
+                      stripes: int = BACKUP_STRIPES,
+                      compression: bool = BACKUP_COMPRESSION,
+                      buffer_count: int = BACKUP_BUFFER_COUNT,
+                      max_transfer_size: int = BACKUP_MAX_TRANSFER_SIZE):
         """
-        Dumps the database as a .bak file, stored in the container's backups folder
+        Dumps the database as .bak files, stored in the container's backups folder. The backup can be striped across
+        several files (see get_backup_file_names), written in parallel, and compressed. By default it is a single
+        uncompressed file, which is what the startup restore of docker_compose_mssql.yml expects
+
+        :param stripes: Number of files to stripe the backup across
+        :param compression: Whether to compress the backup
+        :param buffer_count: Number of I/O buffers used by the backup
+        :param max_transfer_size: Size of the I/O buffers, in bytes. Must be a multiple of 64 KB, up to 4 MB
         """
         if self.is_remote:
             raise RuntimeError("Only local DBs deployed as docker containers can be dumped")
 
-        conn = pymssql.connect(
-            server=MSSQL_HOST,
-            port=MSSQL_PORT,
-            user=MSSQL_USER,
-            password=MSSQL_PASSWORD,
-            database=MSSQL_CRC1625_DATABASE_NAME,
-            autocommit=True
-        )
-        cursor = conn.cursor()
-
-        cursor.execute(f"""
-            BACKUP DATABASE RUB_INF
-            TO DISK = '/var/opt/mssql/backup/{identifier}.bak'
-            WITH FORMAT,
-                MEDIANAME = 'SQLServerBackups',
-                NAME = 'Full Backup of RUB_INF';
-        """)
+        # Backups with the same identifier but another number of stripes would be found instead of this one
+        existing_file_names = self.find_backup_file_names(identifier)
+        for file_name in existing_file_names or []:
+            if file_name not in self.get_backup_file_names(identifier, stripes):
+                os.remove(os.path.join(HOST_BACKUP_DIR, file_name))
+
+        disks = ", ".join(f"DISK = '{CONTAINER_BACKUP_DIR}/{file_name}'"
+                          for file_name in self.get_backup_file_names(identifier, stripes))
+
+        with self._connection(autocommit=True) as conn:
+            cursor = conn.cursor()
+
+            cursor.execute(f"""
+                BACKUP DATABASE RUB_INF
+                TO {disks}
+                WITH FORMAT,
+                    {"COMPRESSION" if compression else "NO_COMPRESSION"},
+                    BUFFERCOUNT = {buffer_count},
+                    MAXTRANSFERSIZE = {max_transfer_size},
+                    MEDIANAME = 'SQLServerBackups',
+                    NAME = 'Full Backup of RUB_INF';
+            """)
+
+            cursor.close()
+
+    def _dispose_crc1625_engine(self):
+        """
+        Closes the pooled connections to the CRC 1625 DB. Restores need exclusive access to it, idle pooled connections
+        would block them
+        """
+        with self._lock:
+            if MSSQL_CRC1625_DATABASE_NAME in self._engines:
+                self._engines.pop(MSSQL_CRC1625_DATABASE_NAME).dispose()
+
+    def restore_database(self,
+                         identifier,
+                         buffer_count: int = BACKUP_BUFFER_COUNT,
+                         max_transfer_size: int = BACKUP_MAX_TRANSFER_SIZE):
+        """
+        Restores the database from a backup contained in the container's backups folder, replacing the current one.
+        Striped backups are read in parallel, and compressed backups are detected by SQL Server. Its snapshots are dropped
+
+        :param buffer_count: Number of I/O buffers used by the restore
+        :param max_transfer_size: Size of the I/O buffers, in bytes. Must be a multiple of 64 KB, up to 4 MB
+        """
+        backup_file_names = self.find_backup_file_names(identifier)
+        if backup_file_names is None:
+            raise ValueError(f"The DB backup {identifier} is not present in the backups folder")
+
+        # A database with snapshots cannot be replaced
+        for snapshot_name in self.list_snapshots():
+            self.drop_snapshot(snapshot_name)
+
+        self._dispose_crc1625_engine()
+
+        with self._connection(MSSQL_MASTER_DATABASE_NAME, autocommit=True) as conn:
+            cursor = conn.cursor()
+
+            # Connections of other clients to the DB would block the restore
+            cursor.execute("""
+                IF DB_ID('RUB_INF') IS NOT NULL
+                    ALTER DATABASE [RUB_INF] SET SINGLE_USER WITH ROLLBACK IMMEDIATE;
+            """)
+            disks = ", ".join(f"DISK = '{CONTAINER_BACKUP_DIR}/{file_name}'" for file_name in backup_file_names)
+            try:
+                cursor.execute(f"""
+                    RESTORE DATABASE [RUB_INF] 
+                    FROM {disks}
+                    WITH MOVE 'RUB_INF' TO '/var/opt/mssql/data/RUB_INF.mdf', 
+                         MOVE 'RUB_INF_log' TO '/var/opt/mssql/data/RUB_INF_log.ldf',
+                         BUFFERCOUNT = {buffer_count},
+                         MAXTRANSFERSIZE = {max_transfer_size},
+                         REPLACE;
+                """)
+            finally:
+                # Also if the restore failed, so that the DB is not left in single-user mode
+                cursor.execute("""
+                    IF DB_ID('RUB_INF') IS NOT NULL
+                        ALTER DATABASE [RUB_INF] SET MULTI_USER;
+                """)
 
-        cursor.close()
-        conn.close()
+            cursor.close()
 
-    def restore_database(self, identifier):
+    @staticmethod
+    def _get_snapshot_database_name(snapshot_name: str) -> str:
+        if not snapshot_name_pattern.match(snapshot_name):
+            raise ValueError(f"Invalid snapshot name '{snapshot_name}', only letters, digits and underscores are allowed")
+        return SNAPSHOT_DATABASE_PREFIX + snapshot_name
+
+    def list_snapshots(self) -> list[str]:
         """
-        Restores the database from a .bak file contained in the container's backups folder
+        Returns the names of the existing snapshots of the CRC 1625 DB (see create_snapshot), oldest first
         """
-        if not self.database_backup_exists(identifier):
-            return ValueError(f"The DB backup {identifier} is not present in the backups folder")
+        if self.is_remote:
+            raise RuntimeError("Only local DBs deployed as docker containers have snapshots")
+
+        records = self.query_to_records(f"""
+            SELECT name
+            FROM sys.databases
+            WHERE source_database_id = DB_ID('{MSSQL_CRC1625_DATABASE_NAME}')
+            ORDER BY create_date
+        """, database=MSSQL_MASTER_DATABASE_NAME)
 
-        conn = pymssql.connect(
-            server=MSSQL_HOST,
-            port=MSSQL_PORT,
-            user=MSSQL_USER,
-            password=MSSQL_PASSWORD,
-            database=MSSQL_MASTER_DATABASE_NAME,
-            autocommit=True
+        return [record["name"].removeprefix(SNAPSHOT_DATABASE_PREFIX)
+                for record in records
+                if record["name"].startswith(SNAPSHOT_DATABASE_PREFIX)]
+
+    def create_snapshot(self, snapshot_name: str):
+        """
+        Creates a database snapshot of the current state of the CRC 1625 DB, which it can be reverted to in seconds
+        (see revert_to_snapshot), regardless of its size. Snapshots are copy-on-write: they are sparse files in the
+        container's data folder that only grow with the pages modified afterwards. They are lost when the container is
+        stopped
+        """
+        if self.is_remote:
+            raise RuntimeError("Only local DBs deployed as docker containers can be snapshotted")
+
+        snapshot_database_name = self._get_snapshot_database_name(snapshot_name)
+
+        # Every data file of the DB needs a sparse file in the snapshot
+        data_files = self.query_to_records(f"""
+            SELECT name
+            FROM sys.master_files
+            WHERE database_id = DB_ID('{MSSQL_CRC1625_DATABASE_NAME}') AND type_desc = 'ROWS'
+        """, database=MSSQL_MASTER_DATABASE_NAME)
+        sparse_files = ", ".join(
+            f"(NAME = [{data_file["name"]}], FILENAME = '/var/opt/mssql/data/{snapshot_database_name}_{data_file["name"]}.ss')"
+            for data_file in data_files
         )
-        cursor = conn.cursor()
 
-        cursor.execute(f"""
-            RESTORE DATABASE [RUB_INF] 
-            FROM DISK = '/var/opt/mssql/backup/{identifier}.bak' 
-            WITH MOVE 'RUB_INF' TO '/var/opt/mssql/data/RUB_INF.mdf', 
-                 MOVE 'RUB_INF_log' TO '/var/opt/mssql/data/RUB_INF_log.ldf';
-        """)
+        logging.info(f"Creating DB snapshot '{snapshot_name}'...")
+        with self._connection(MSSQL_MASTER_DATABASE_NAME, autocommit=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"CREATE DATABASE [{snapshot_database_name}] ON {sparse_files} AS SNAPSHOT OF [{MSSQL_CRC1625_DATABASE_NAME}];")
+            cursor.close()
+
+    def revert_to_snapshot(self, snapshot_name: str):
+        """
+        Reverts the CRC 1625 DB to a snapshot (see create_snapshot), discarding every change made since it was created.
+        The snapshot is kept, so the DB can be reverted to it again.
+
+        SQL Server can only revert a DB with a single snapshot, so the other snapshots are dropped
+        """
+        if self.is_remote:
+            raise RuntimeError("Only local DBs deployed as docker containers can be reverted to a snapshot")
+
+        snapshot_database_name = self._get_snapshot_database_name(snapshot_name)
+        existing_snapshots = self.list_snapshots()
+        if snapshot_name not in existing_snapshots:
+            raise ValueError(f"The DB snapshot '{snapshot_name}' does not exist")
+
+        for other_snapshot_name in existing_snapshots:
+            if other_snapshot_name != snapshot_name:
+                self.drop_snapshot(other_snapshot_name)
+
+        self._dispose_crc1625_engine()
+
+        logging.info(f"Reverting the DB to snapshot '{snapshot_name}'...")
+        with self._connection(MSSQL_MASTER_DATABASE_NAME, autocommit=True) as conn:
+            cursor = conn.cursor()
+
+            # Connections of other clients to the DB would block the revert
+            cursor.execute(f"ALTER DATABASE [{MSSQL_CRC1625_DATABASE_NAME}] SET SINGLE_USER WITH ROLLBACK IMMEDIATE;")
+            try:
+                cursor.execute(f"RESTORE DATABASE [{MSSQL_CRC1625_DATABASE_NAME}] FROM DATABASE_SNAPSHOT = '{snapshot_database_name}';")
+            finally:
+                cursor.execute(f"ALTER DATABASE [{MSSQL_CRC1625_DATABASE_NAME}] SET MULTI_USER;")
+
+            cursor.close()
+
+    def drop_snapshot(self, snapshot_name: str):
+        """
+        Drops a snapshot of the CRC 1625 DB (see create_snapshot), deleting its sparse files
+        """
+        if self.is_remote:
+            raise RuntimeError("Only local DBs deployed as docker containers have snapshots")
+
+        snapshot_database_name = self._get_snapshot_database_name(snapshot_name)
+
+        logging.info(f"Dropping DB snapshot '{snapshot_name}'...")
+        with self._connection(MSSQL_MASTER_DATABASE_NAME, autocommit=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"DROP DATABASE IF EXISTS [{snapshot_database_name}];")
+            cursor.close()
+
+    @contextmanager
+    def disabled_nonclustered_indexes(self, tables: list[str]):
+        """
+        Disables the nonclustered indexes of the tables, and rebuilds them once the context is left. Loading many records
+        and then building the indexes at once is faster than maintaining them row by row during the load.
+
+        Unique indexes (including those of primary keys and unique constraints) are kept, so that they are still enforced
+        """
+        disabled_indexes = []
+        try:
+            for table in tables:
+                records = self.query_to_records(f"""
+                    SELECT name
+                    FROM sys.indexes
+                    WHERE object_id = OBJECT_ID('{table}') AND type = 2 AND is_disabled = 0 AND is_unique = 0
+                """)
+                for record in records:
+                    self._execute_query(f"ALTER INDEX [{record['name']}] ON {table} DISABLE;")
+                    disabled_indexes.append((table, record["name"]))
 
-        cursor.close()
-        conn.close()
+            logging.info(f"Disabled {len(disabled_indexes)} nonclustered indexes")
+            yield
+        finally:
+            if len(disabled_indexes) > 0:
+                logging.info(f"Rebuilding {len(disabled_indexes)} nonclustered indexes...")
+            for table, index in disabled_indexes:
+                self._execute_query(f"ALTER INDEX [{index}] ON {table} REBUILD;")
+
+    @staticmethod
+    def _write_bulk_insert_file(headers: str, records: Iterable[str]) -> tuple[str, int]:
+        """
+        Writes records to a new batch file with a unique name in the backups folder, readable by the container
+
+        :returns: (name of the file, number of records written)
+        """
+        os.makedirs(HOST_BACKUP_DIR, exist_ok=True)
+        file_name = f"bulk_insert_{uuid.uuid4().hex}.csv"
+        file_path = os.path.join(HOST_BACKUP_DIR, file_name)
+
+        written_records = 0
+        try:
+            with open(file_path, "w", newline="", encoding="utf-8") as f:
+                f.write(headers)
+                f.write("\n")
+                for record in records:
+                    f.write(record.replace(" ", ""))
+                    f.write("\n")
+                    written_records += 1
+
+            os.chmod(file_path, os.stat(file_path).st_mode | stat.S_IROTH)
+        except BaseException:
+            os.remove(file_path)
+            raise
+
+        return file_name, written_records
+
+    def _bulk_insert_file(self, table: str, file_name: str, batch_size: int):
+        """
+        Runs a BULK INSERT of a batch file written by _write_bulk_insert_file, and removes it
+        """
+        try:
+            with self._connection(MSSQL_MASTER_DATABASE_NAME, autocommit=True) as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(f"""
+                        BULK INSERT {table}
+                        FROM '{CONTAINER_BACKUP_DIR}/{file_name}'
+                        WITH (
+                            FIRSTROW = 2,
+                            FIELDTERMINATOR = ',',
+                            ROWTERMINATOR = '0x0A',
+                            KEEPNULLS,
+                            TABLOCK,
+                            BATCHSIZE = {batch_size}
+                        );
+                    """)
+
+                cursor.close()
+        finally:
+            os.remove(os.path.join(HOST_BACKUP_DIR, file_name))
 
     def execute_bulk_insert(self,
                             table: str,
                             headers : str,
-                            records: str | list[str]):
+                            records: str | Iterable[str],
+                            batch_size: int = BULK_INSERT_BATCH_SIZE,
+                            file_rows: int = BULK_INSERT_FILE_ROWS) -> int:
         """
-        Executes a BATCH INSERT on the DB, given the name of the table, a string representing
-        the columns of the table in .csv format and a record or list of records as lines in a .csv
+        Executes a BULK INSERT on the DB, given the name of the table, a string representing
+        the columns of the table in .csv format and a record or iterable of records as lines in a .csv
+
+        The records are consumed lazily (e.g. from a generator) and written to batch files of up to file_rows records,
+        with unique names. Each batch file is inserted while the next one is written, so the records never have to be
+        held in memory at once.
 
         The columns and records must follow the same order as in the DB
+
+        :param batch_size: Rows committed per BULK INSERT batch
+        :param file_rows: Records written to each batch file
+
+        :returns: The number of inserted records
         """
         if isinstance(records, str):
             records = [records]
 
-        conn = pymssql.connect(
-            server=MSSQL_HOST,
-            port=MSSQL_PORT,
-            user=MSSQL_USER,
-            password=MSSQL_PASSWORD,
-            database=MSSQL_MASTER_DATABASE_NAME,
-            autocommit=True
-        )
-        cursor = conn.cursor()
+        records = iter(records)
+        inserted_records = 0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            pending_insert = None
+            try:
+                while True:
+                    (file_name, written_records) = self._write_bulk_insert_file(headers,
+                                                                                itertools.islice(records, file_rows))
+                    if written_records == 0:
+                        os.remove(os.path.join(HOST_BACKUP_DIR, file_name))
+                        break
 
-        with open(os.path.join(module_dir, './db_dumps/bulk_insert_records.csv'), "w", newline="", encoding="utf-8") as f:
-            f.write(headers)
-            f.write("\n")
-            for record in records:
-                f.write(record.replace(" ", ""))
-                f.write("\n")
+                    if pending_insert is not None:
+                        pending_insert.result()
+                    pending_insert = executor.submit(self._bulk_insert_file, table, file_name, batch_size)
+                    inserted_records += written_records
 
-        os.chmod(os.path.join(module_dir, './db_dumps/bulk_insert_records.csv'),
-                 os.stat(os.path.join(module_dir, './db_dumps/bulk_insert_records.csv')).st_mode | stat.S_IROTH)
-
-        cursor.execute(f"""
-                BULK INSERT {table}
-                FROM '/var/opt/mssql/backup/bulk_insert_records.csv'
-                WITH (
-                    FIRSTROW = 2,
-                    FIELDTERMINATOR = ',',
-                    ROWTERMINATOR = '0x0A',
-                    KEEPNULLS,
-                    TABLOCK
-                );
-            """)
+                    if written_records < file_rows:
+                        break
+            finally:
+                if pending_insert is not None:
+                    pending_insert.result()
+
+        return inserted_records
+
+    def execute_bulk_inserts(self,
+                             inserts: list[tuple[str, str, str | Iterable[str]]],
+                             max_workers: int = BULK_INSERT_MAX_WORKERS,
+                             batch_size: int = BULK_INSERT_BATCH_SIZE) -> dict[str, int]:
+        """
+        Executes the bulk inserts (see execute_bulk_insert) of several independent tables concurrently, each on its own
+        pooled connection
+
+        :param inserts: List of (table, headers, records). Every table must appear at most once, and the records of each
+                        one must be an independent iterable, as they are consumed in different threads. BULK INSERT does
+                        not check foreign keys, so tables referencing each other can be inserted into at the same time
+        :param max_workers: Number of tables inserted into at the same time
 
-        cursor.close()
-        conn.close()
+        :returns: Dict of table -> number of inserted records
+        """
+        tables = [table for (table, _, _) in inserts]
+        if len(set(tables)) != len(tables):
+            raise ValueError(f"Every table must be bulk inserted into at most once: {tables}")
 
-        os.remove(os.path.join(module_dir, './db_dumps/bulk_insert_records.csv'))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {table: executor.submit(self.execute_bulk_insert, table, headers, records, batch_size)
+                       for (table, headers, records) in inserts}
+            return {table: future.result() for table, future in futures.items()}
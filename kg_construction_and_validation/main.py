@@ -3,12 +3,17 @@ Main script used to execute the complete KG generation pipeline. It can be calle
 (e.g., avoid performing postprocessing..., etc.)
 """
 import argparse
+import json
 import logging
+import os
 import sys
 import time
 
 import datastores.sql.sql_db as sql_db
 import materialization.materialization as materialization
+import materialization.incremental_materialization as incremental_materialization
+import materialization.output_delta as output_delta
+import materialization.stage_cache as stage_cache
 import postprocessing.postprocessing as postprocessing
 from datastores.rdf import rdf_datastore_client, rdf_datastore
 from datastores.rdf.rdf_datastore_api import rdf_store
@@ -47,31 +52,155 @@ def upload_ontology_files(ontology_files: list[dict[str, str]]):
     rdf_datastore_client.run_sync(rdf_datastore_client.bulk_file_load([f["file"] for f in ontology_files], delete_files_after_upload=False))
 
 
+def get_graph_version() -> int:
+    """
+    Returns the version of the main graph of the datastore, used to tell whether it was modified since the last run: its
+    number of triples
+    """
+    response = rdf_datastore_client.run_sync(rdf_datastore_client.launch_query(
+        f"SELECT (COUNT(*) AS ?triples) WHERE {{ GRAPH <{rdf_datastore.MAIN_GRAPH_IRI}> {{ ?s ?p ?o }} }}"
+    ))
+    return int(response["results"]["bindings"][0]["triples"]["value"])
+
+
 def serve_KG(skip_ontologies_upload: bool = True,
              db_option: str = None,
              skip_db_setup: bool = False,
              skip_materialization: bool = False,
              skip_postprocessing: bool = False,
              delete_materialized_triples_files: bool = True,
-             use_rmlstreamer: bool = False):
+             use_rmlstreamer: bool = False,
+             incremental: bool = False,
+             engine: str = "rml",
+             parallel_rml: bool = False,
+             rml_files_per_job: int = 1,
+             typed_activity_mappings: bool = False,
+             shard_large_mappings: bool = False,
+             pipelined: bool = False,
+             cost_based_engine: bool = False,
+             canonical_output: bool = False,
+             delta_upload: bool = False,
+             compress_output: bool = False,
+             stage_caching: bool = False,
+             db: sql_db.MSSQLDB | None = None):
     performance_log_postprocessing = dict()
 
-    db = sql_db.MSSQLDB()
-    if not skip_db_setup:
-        db.select_and_start_db(db_option)
+    # A DB given by the caller (e.g. the service mode) is already set up, and is kept open after the run
+    owns_db = db is None
+    if owns_db:
+        db = sql_db.MSSQLDB()
+        if not skip_db_setup:
+            db.select_and_start_db(db_option)
+
+    incremental_run = None
+    if incremental and not skip_materialization:
+        incremental_run = incremental_materialization.prepare_incremental_run(db)
+
+        if incremental_run.is_up_to_date():
+            logging.info("No changes since the last materialization, the KG is up to date!")
+
+            if owns_db:
+                if not skip_db_setup and not db.is_remote:
+                    db.stop_DB()
+                db.close()
+
+            return dict(), [], dict(), [], 0
+
+    if delta_upload and skip_materialization:
+        logging.warning("The existing materialized files may not be canonical, they will be fully loaded instead of as a delta.")
+        delta_upload = False
+    if delta_upload and incremental_run is not None and not incremental_run.is_full_rebuild:
+        logging.warning("Incremental runs already yield a delta of the KG, it will be loaded as such.")
+        delta_upload = False
+    if delta_upload:
+        # Deltas are computed between canonical outputs
+        canonical_output = True
+    else:
+        # The datastore will be modified by other means, so a later delta upload cannot rely on the previous output
+        output_delta.discard_previous_output()
+
+    if pipelined and (skip_materialization or use_rmlstreamer or engine != "rml"):
+        logging.warning("Pipelined materialization only applies to the 'rml' engine with RMLMapper, the stages will run one after the other.")
+        pipelined = False
+    if pipelined and canonical_output:
+        logging.warning("The canonical output can only be written once all mappings are done, the stages will run one after the other.")
+        pipelined = False
+    if pipelined and incremental_run is not None and not incremental_run.is_full_rebuild:
+        # Outdated triples have to be deleted before loading any file, which requires all of them
+        logging.warning("Incremental deltas cannot be loaded while mapping, the stages will run one after the other.")
+        pipelined = False
+
+    if compress_output and pipelined:
+        logging.warning("Pipelined files are loaded as soon as they are materialized, they will not be compressed.")
+        compress_output = False
+    if compress_output and delta_upload:
+        logging.warning("Delta uploads compare the uncompressed outputs, they will not be compressed.")
+        compress_output = False
+
+    # The upload can only be skipped if the datastore is to be cleared and fully loaded with an output it already holds
+    upload_stage_caching = (stage_caching and not pipelined and not delta_upload
+                            and (incremental_run is None or incremental_run.is_full_rebuild))
+    if not upload_stage_caching:
+        # The datastore will be modified by other means
+        stage_cache.discard_fingerprints(["upload", "graph_version"])
+
+    if pipelined:
+        # Triples are loaded as soon as they are materialized
+        rdf_datastore_client.run_sync(rdf_datastore_client.clear_triples())
 
     materialized_files, performance_log_mappings, resource_usage_mappings = materialization.run_mappings(db,
                                                                                                          skip_materialization=skip_materialization,
-                                                                                                         use_rmlstreamer=use_rmlstreamer)
+                                                                                                         use_rmlstreamer=use_rmlstreamer,
+                                                                                                         incremental_run=incremental_run,
+                                                                                                         engine=engine,
+                                                                                                         parallel_rml=parallel_rml,
+                                                                                                         rml_files_per_job=rml_files_per_job,
+                                                                                                         typed_activity_mappings=typed_activity_mappings,
+                                                                                                         shard_large_mappings=shard_large_mappings,
+                                                                                                         pipelined=pipelined,
+                                                                                                         delete_materialized_triples_files=delete_materialized_triples_files,
+                                                                                                         cost_based_engine=cost_based_engine,
+                                                                                                         canonical_output=canonical_output,
+                                                                                                         compress_output=compress_output,
+                                                                                                         stage_caching=stage_caching)
 
     logging.info("Materialization of the KG finished!")
-    rdf_datastore_client.run_sync(rdf_datastore_client.clear_triples())
+
+    datastore_up_to_date = False
+    if upload_stage_caching:
+        upload_fingerprint = stage_cache.fingerprint(stage_cache.hash_files(materialized_files),
+                                                     json.dumps([skip_ontologies_upload, skip_postprocessing]))
+        previous_stage_fingerprints = stage_cache.load_fingerprints()
+        datastore_up_to_date = (previous_stage_fingerprints.get("upload") == upload_fingerprint
+                                and previous_stage_fingerprints.get("graph_version") == get_graph_version())
+        performance_log_mappings.setdefault("stage_cache_hits", dict())["upload"] = datastore_up_to_date
+
+        if datastore_up_to_date:
+            logging.info("The datastore already holds this output, skipping its upload and the postprocessing")
+            if delete_materialized_triples_files:
+                for materialized_file in materialized_files:
+                    os.remove(materialized_file)
+        else:
+            # Nothing is known about the datastore if the upload fails midway
+            stage_cache.discard_fingerprints(["upload", "graph_version"])
+
+    # If pipelined, the datastore was already cleared and the files loaded while mapping.
+    # If delta_upload, it is not cleared but updated with the differences to the previous output
+    if not pipelined and not delta_upload and not datastore_up_to_date:
+        if incremental_run is None or incremental_run.is_full_rebuild:
+            rdf_datastore_client.run_sync(rdf_datastore_client.clear_triples())
+        else:
+            incremental_materialization.delete_outdated_triples(materialized_files, incremental_run)
 
     file_upload_start = time.perf_counter()
 
-    upload_materialized_triples(materialized_files, delete_materialized_triples_files)
+    if delta_upload:
+        output_delta_stats = output_delta.upload_output_delta(materialized_files[0])
+        performance_log_mappings["output_delta"] = output_delta_stats
+    elif not pipelined and not datastore_up_to_date:
+        upload_materialized_triples(materialized_files, delete_materialized_triples_files)
 
-    if not skip_ontologies_upload:
+    if not skip_ontologies_upload and not datastore_up_to_date:
         upload_ontology_files(ontology_files)
         if rdf_datastore_client.run_sync(rdf_datastore_client.get_datastore_type()) == "virtuoso":
             # We have to enable inference rules manually (ugh)
@@ -82,18 +211,99 @@ def serve_KG(skip_ontologies_upload: bool = True,
 
 
     logging.info("Triples loaded! running postprocessing...")
-    resource_usage_postprocessing = []
-    if not skip_postprocessing:
+    resource_usage_postprocessing = {}
+    if not skip_postprocessing and not datastore_up_to_date:
         performance_log_postprocessing, resource_usage_postprocessing = postprocessing.run_postprocessing()
 
     logging.info("Postprocessing finished!")
 
-    if not skip_db_setup and not db.is_remote:
-        db.stop_DB()
+    if upload_stage_caching and not datastore_up_to_date:
+        stage_cache.save_fingerprints({"upload": upload_fingerprint, "graph_version": get_graph_version()})
+
+    if incremental_run is not None:
+        # Only now the delta is fully applied, a failure before this point will make the next run retry it
+        incremental_materialization.save_watermarks(incremental_run.watermarks)
+
+    if owns_db:
+        if not skip_db_setup and not db.is_remote:
+            db.stop_DB()
+        db.close()
 
     return performance_log_mappings, resource_usage_mappings, performance_log_postprocessing, resource_usage_postprocessing, file_upload_end
 
 
+def run_service(poll_interval: float = 60,
+                debounce: float = 30,
+                full_rebuild_interval: float = 86_400,
+                db_option: str | None = None,
+                skip_db_setup: bool = False,
+                **serve_KG_kwargs):
+    """
+    Keeps the pipeline resident, rebuilding the KG whenever the source DB changes instead of on a fixed schedule.
+
+    The DB (and its connection pools) is set up once and reused by every run, as are the imported modules, caches (e.g.
+    the RML conversions and the parsed templates) and, with the 'python' engine, the mapping engine itself. Every
+    poll_interval s. a cheap fingerprint of the DB is taken (see incremental_materialization.get_change_fingerprint),
+    and a run is only started once it changed and then stayed the same for debounce s., so that a burst of edits
+    triggers a single run. The first run happens at startup.
+
+    Incremental runs cannot see deleted rows. If a watermarked table has fewer rows than on the previous run, a full
+    rebuild is forced. Deletions offset by insertions leave the row counts unchanged, so a full rebuild is also forced
+    every full_rebuild_interval s., even if the DB did not change.
+
+    :param full_rebuild_interval: Seconds between forced full rebuilds. 0 disables them
+    :param serve_KG_kwargs: Parameters of every run, see serve_KG
+    """
+    db = sql_db.MSSQLDB()
+    if not skip_db_setup:
+        db.select_and_start_db(db_option)
+
+    last_run_fingerprint = None
+    last_full_rebuild_time = time.monotonic()
+    try:
+        while True:
+            fingerprint = incremental_materialization.get_change_fingerprint(db)
+            full_rebuild_due = full_rebuild_interval > 0 and time.monotonic() - last_full_rebuild_time >= full_rebuild_interval
+
+            if last_run_fingerprint is not None:
+                if fingerprint == last_run_fingerprint and not full_rebuild_due:
+                    time.sleep(poll_interval)
+                    continue
+
+                if fingerprint != last_run_fingerprint:
+                    logging.info(f"Changes detected in the DB, waiting for them to settle for {debounce} s...")
+                    time.sleep(debounce)
+                    settled_fingerprint = incremental_materialization.get_change_fingerprint(db)
+                    while settled_fingerprint != fingerprint:
+                        fingerprint = settled_fingerprint
+                        time.sleep(debounce)
+                        settled_fingerprint = incremental_materialization.get_change_fingerprint(db)
+
+                if incremental_materialization.has_deleted_rows(last_run_fingerprint, fingerprint):
+                    logging.info("Rows were deleted from the DB, a full rebuild of the KG will be performed")
+                    full_rebuild_due = True
+                elif full_rebuild_due:
+                    logging.info(f"No full rebuild of the KG in the last {full_rebuild_interval} s., performing one")
+
+            if full_rebuild_due:
+                incremental_materialization.discard_watermarks()
+
+            try:
+                serve_KG(db_option=db_option, skip_db_setup=True, db=db, **serve_KG_kwargs)
+                # Changes made during the run differ from this fingerprint, and will trigger the next one
+                last_run_fingerprint = fingerprint
+                if full_rebuild_due:
+                    last_full_rebuild_time = time.monotonic()
+            except Exception:
+                logging.exception("The KG could not be rebuilt, it will be retried on the next poll")
+
+            time.sleep(poll_interval)
+    finally:
+        if not skip_db_setup and not db.is_remote:
+            db.stop_DB()
+        db.close()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
@@ -162,14 +372,165 @@ if __name__ == "__main__":
         help="Use RMLStreamer instead of RMLMapper. Only recommended for very large databases due to its overhead"
     )
 
+    parser.add_argument(
+        "--parallel_rml",
+        action="store_true",
+        default=False,
+        help="Convert and run each mapping file (or group of them, see --rml_files_per_job) as its own RMLMapper job, "
+             "in parallel, instead of one single RML file. Not compatible with --use_rmlstreamer"
+    )
+
+    parser.add_argument(
+        "--rml_files_per_job",
+        type=int,
+        default=1,
+        help="Number of mapping files converted and executed by each RMLMapper job when using --parallel_rml"
+    )
+
+    parser.add_argument(
+        "--typed_activity_mappings",
+        action="store_true",
+        default=False,
+        help="Run each activity mapping once for all measurement types, taking their names and classes from a TypeId "
+             "lookup, instead of once per measurement type"
+    )
+
+    parser.add_argument(
+        "--shard_large_mappings",
+        action="store_true",
+        default=False,
+        help="Split the largest mappings (compositions) into shards sized by their row count, each of them running "
+             "concurrently end to end (SQL query, mapping and output file) and retried on failure"
+    )
+
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=False,
+        help="Start each mapping as soon as its query results are ready, and load each output file into the RDF "
+             "datastore as soon as it is written, instead of running every stage after the previous one. Only applies "
+             "to the 'rml' engine with RMLMapper, and not to incremental deltas"
+    )
+
+    parser.add_argument(
+        "--cost_based_engine",
+        action="store_true",
+        default=False,
+        help="Choose RMLMapper or RMLStreamer and the JVM heap of every RML job from the number of triples it is "
+             "predicted to generate (rows returned by its queries times their po entries), instead of "
+             "--use_rmlstreamer and half of the system's RAM"
+    )
+
+    parser.add_argument(
+        "--canonical_output",
+        action="store_true",
+        default=False,
+        help="Write the materialized triples as a single N-Triples file, sorted by subject and without duplicates, "
+             "via an external merge sort bounded in memory. Not compatible with --pipelined"
+    )
+
+    parser.add_argument(
+        "--delta_upload",
+        action="store_true",
+        default=False,
+        help="Instead of clearing the RDF datastore and loading the whole output, apply only the differences to the "
+             "output of the previous run (kept in materialization/incremental_state). Implies --canonical_output"
+    )
+
+    parser.add_argument(
+        "--compress_output",
+        action="store_true",
+        default=False,
+        help="Compress the materialized triples with gzip. The RDF datastore loads the compressed files directly, "
+             "reducing the disk space and I/O of the output. Not compatible with --pipelined or --delta_upload"
+    )
+
+    parser.add_argument(
+        "--stage_cache",
+        action="store_true",
+        default=False,
+        help="Skip the stages (queries, mappings, upload and postprocessing) whose inputs did not change since the last "
+             "run, reusing its results (kept in materialization/incremental_state)"
+    )
+
+    parser.add_argument(
+        "--service",
+        action="store_true",
+        default=False,
+        help="Stay resident and rebuild the KG whenever the source DB changes (see --poll_interval and --debounce), "
+             "reusing the DB connections, caches and mapping engine across runs, instead of running once"
+    )
+
+    parser.add_argument(
+        "--poll_interval",
+        type=float,
+        default=60,
+        help="With --service, seconds between checks for changes in the source DB"
+    )
+
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=30,
+        help="With --service, seconds the source DB has to stay unchanged before starting a run"
+    )
+
+    parser.add_argument(
+        "--full_rebuild_interval",
+        type=float,
+        default=86_400,
+        help="With --service and --incremental, seconds between forced full rebuilds of the KG, which get rid of the "
+             "triples of rows deleted from the DB. 0 disables them"
+    )
+
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=["rml", "python"],
+        default="rml",
+        help="Engine used to execute the mappings. 'rml' converts them to RML and runs RMLMapper (or RMLStreamer, see "
+             "--use_rmlstreamer). 'python' streams the query results straight to N-Triples in-process, without a JVM, "
+             "CSV files or RML conversion"
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only re-materialize the objects created or updated since the last incremental run, applying the resulting "
+             "delta to the KG instead of rebuilding it. Performs a full rebuild if there is no previous run"
+    )
+
 
 
     args = parser.parse_args()
 
-    serve_KG(skip_ontologies_upload=args.skip_ontologies_upload,
-             db_option=args.db_option,
-             skip_db_setup=args.skip_db_setup,
-             skip_materialization=args.skip_materialization,
-             skip_postprocessing=args.skip_postprocessing,
-             delete_materialized_triples_files=not args.do_not_delete_materialized_triples_files,
-             use_rmlstreamer=args.use_rmlstreamer)
\ No newline at end of file
+    run_parameters = dict(skip_ontologies_upload=args.skip_ontologies_upload,
+                          skip_materialization=args.skip_materialization,
+                          skip_postprocessing=args.skip_postprocessing,
+                          delete_materialized_triples_files=not args.do_not_delete_materialized_triples_files,
+                          use_rmlstreamer=args.use_rmlstreamer,
+                          incremental=args.incremental,
+                          engine=args.engine,
+                          parallel_rml=args.parallel_rml,
+                          rml_files_per_job=args.rml_files_per_job,
+                          typed_activity_mappings=args.typed_activity_mappings,
+                          shard_large_mappings=args.shard_large_mappings,
+                          pipelined=args.pipelined,
+                          cost_based_engine=args.cost_based_engine,
+                          canonical_output=args.canonical_output,
+                          delta_upload=args.delta_upload,
+                          compress_output=args.compress_output,
+                          stage_caching=args.stage_cache)
+
+    if args.service:
+        run_service(poll_interval=args.poll_interval,
+                    debounce=args.debounce,
+                    full_rebuild_interval=args.full_rebuild_interval,
+                    db_option=args.db_option,
+                    skip_db_setup=args.skip_db_setup,
+                    **run_parameters)
+    else:
+        serve_KG(db_option=args.db_option,
+                 skip_db_setup=args.skip_db_setup,
+                 **run_parameters)
@@ -0,0 +1,183 @@
+"""
+Optional output stage that canonicalizes the materialized triples: every triple is rewritten as a canonical N-Triples
+line ("<s> <p> o .", terms separated by a single space), duplicates are removed and the lines are sorted, which sorts
+the triples by subject (then predicate and object).
+
+Several mappings assert the same triples (e.g. types and names of objects shared across mappings), and the engines
+write them in no particular order. A sorted, deduplicated file is smaller, loads faster and can be compared against
+the output of another run by merging both files (see materialization.py and main.py).
+
+The outputs of all engines are line-based (RMLMapper and RMLStreamer write N-Quads without graph terms, the Python
+engine writes N-Triples), so no full RDF parsing is needed. The outputs may be larger than the available memory, so
+they are sorted via an external merge sort:
+    1. The input lines are canonicalized and gathered into chunks of up to SORT_MEMORY_LIMIT_BYTES, which are sorted,
+       deduplicated and spilled to temporary run files
+    2. The run files are merged (SORT_MERGE_FAN_IN at a time, in several passes if needed), dropping the duplicates
+       found across runs
+"""
+import heapq
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Approximate memory used to sort each run, including the overhead of the Python objects holding its lines
+SORT_MEMORY_LIMIT_BYTES = 512 * 1024 ** 2
+# Approximate overhead of each line kept in memory, in bytes
+LINE_OVERHEAD_BYTES = 64
+# Maximum number of run files merged at once
+SORT_MERGE_FAN_IN = 64
+# Buffer size of the run files
+RUN_FILE_BUFFER_BYTES = 1024 * 1024
+
+_iri = rb'<[^<>"\s]*>'
+_blank_node = rb'_:\S+'
+_literal = rb'"(?:[^"\\]|\\.)*"(?:\^\^' + _iri + rb'|@[A-Za-z]+(?:-[A-Za-z0-9]+)*)?'
+
+statement_pattern = re.compile(
+    rb'^[ \t]*(' + _iri + rb'|' + _blank_node + rb')'
+    rb'[ \t]+(' + _iri + rb')'
+    rb'[ \t]+(' + _iri + rb'|' + _blank_node + rb'|' + _literal + rb')'
+    rb'[ \t]*(' + _iri + rb'|' + _blank_node + rb')?'
+    rb'[ \t]*\.[ \t]*\r?$'
+)
+
+
+def canonicalize_line(line: bytes) -> bytes | None:
+    """
+    Returns the canonical N-Triples form of an N-Triples/N-Quads line (with its line break), or None if it is empty or
+    a comment
+
+    :raises ValueError: If the line is not a valid statement, or belongs to a named graph
+    """
+    stripped_line = line.strip()
+    if stripped_line == b"" or stripped_line.startswith(b"#"):
+        return None
+
+    match = statement_pattern.match(line.rstrip(b"\n"))
+    if match is None:
+        raise ValueError(f"Not an N-Triples/N-Quads statement: {line[:200]!r}")
+    if match.group(4) is not None:
+        raise ValueError(f"Statements in named graphs cannot be canonicalized to N-Triples: {line[:200]!r}")
+
+    return b"%s %s %s .\n" % (match.group(1), match.group(2), match.group(3))
+
+
+def write_run(lines: list[bytes], temp_dir: str) -> str:
+    """
+    Sorts and deduplicates a chunk of lines, and writes it to a new run file in temp_dir
+
+    :returns: The path of the run file
+    """
+    lines.sort()
+
+    (fd, run_path) = tempfile.mkstemp(suffix=".run", dir=temp_dir)
+    with os.fdopen(fd, 'wb', buffering=RUN_FILE_BUFFER_BYTES) as f:
+        previous_line = None
+        for line in lines:
+            if line != previous_line:
+                f.write(line)
+                previous_line = line
+
+    return run_path
+
+
+def merge_runs(run_paths: list[str], output_file_path: str) -> int:
+    """
+    Merges sorted run files into output_file_path, dropping duplicates
+
+    :returns: Number of lines written
+    """
+    run_files = [open(run_path, 'rb', buffering=RUN_FILE_BUFFER_BYTES) for run_path in run_paths]
+    try:
+        written_lines = 0
+        with open(output_file_path, 'wb', buffering=RUN_FILE_BUFFER_BYTES) as f:
+            previous_line = None
+            for line in heapq.merge(*run_files):
+                if line != previous_line:
+                    f.write(line)
+                    written_lines += 1
+                    previous_line = line
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+    return written_lines
+
+
+def canonicalize_triples(input_file_paths: list[str],
+                         output_file_path: str,
+                         memory_limit: int = SORT_MEMORY_LIMIT_BYTES,
+                         temp_dir: str | None = None) -> dict[str, int]:
+    """
+    Writes the triples of all input files to output_file_path as canonical N-Triples, sorted and deduplicated (see the
+    module's documentation). The output file may be one of the input files, which is then replaced
+
+    :param memory_limit: Approximate memory (in bytes) used to sort each run
+    :param temp_dir: Folder to spill the run files to. Defaults to a temporary folder next to the output file, as runs
+                     take as much space as the output
+
+    :returns: Dict of {"input_triples": triples read, "output_triples": triples written, "runs": run files spilled}
+    """
+    temp_dir = tempfile.mkdtemp(prefix="canonical_output_", dir=temp_dir or os.path.dirname(output_file_path))
+    try:
+        run_paths = []
+        input_triples = 0
+
+        lines = []
+        chunk_bytes = 0
+        for input_file_path in input_file_paths:
+            with open(input_file_path, 'rb', buffering=RUN_FILE_BUFFER_BYTES) as f:
+                for line_number, line in enumerate(f, start=1):
+                    try:
+                        canonical_line = canonicalize_line(line)
+                    except ValueError as e:
+                        raise ValueError(f"{input_file_path}, line {line_number}: {e}") from None
+                    if canonical_line is None:
+                        continue
+
+                    input_triples += 1
+                    lines.append(canonical_line)
+                    chunk_bytes += len(canonical_line) + LINE_OVERHEAD_BYTES
+
+                    if chunk_bytes >= memory_limit:
+                        run_paths.append(write_run(lines, temp_dir))
+                        lines = []
+                        chunk_bytes = 0
+
+        if len(lines) > 0 or len(run_paths) == 0:
+            run_paths.append(write_run(lines, temp_dir))
+        del lines
+        number_of_runs = len(run_paths)
+
+        # Intermediate passes, until all runs can be merged at once
+        while len(run_paths) > SORT_MERGE_FAN_IN:
+            merged_run_paths = []
+            for i in range(0, len(run_paths), SORT_MERGE_FAN_IN):
+                (fd, merged_run_path) = tempfile.mkstemp(suffix=".run", dir=temp_dir)
+                os.close(fd)
+                merge_runs(run_paths[i:i + SORT_MERGE_FAN_IN], merged_run_path)
+                for run_path in run_paths[i:i + SORT_MERGE_FAN_IN]:
+                    os.remove(run_path)
+                merged_run_paths.append(merged_run_path)
+            run_paths = merged_run_paths
+
+        # The output may be one of the inputs, so it is only replaced once complete
+        merged_output_file_path = os.path.join(temp_dir, "output.nt")
+        output_triples = merge_runs(run_paths, merged_output_file_path)
+        os.replace(merged_output_file_path, output_file_path)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    logging.info(f" Triples canonicalized: {input_triples} read, {output_triples} after removing duplicates ({number_of_runs} sorted runs)")
+
+    return {"input_triples": input_triples, "output_triples": output_triples, "runs": number_of_runs}
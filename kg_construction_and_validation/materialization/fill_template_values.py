@@ -3,8 +3,8 @@ Module used to fill the query and other optional parameters in a YARRRML mapping
 """
 import os
 import uuid
+from functools import cache
 
-from datastores.sql.sql_db import MSSQLDB
 from .validate_mappings_consistency import validate_mapping
 
 module_dir = os.path.dirname(__file__)
@@ -28,31 +28,37 @@ csv_source = """
     referenceFormulation: csv
 """
 
+@cache
+def read_template(file_name: str) -> str:
+    """
+    Returns the contents of a template (templated YARRRML file or SQL query). They are kept in memory, as long-running
+    processes (see the service mode in main.py) fill them on every run
+    """
+    with open(file_name, 'r') as f:
+        return f.read()
+
+
 def get_sql_query(file_name,
                   custom_sql_template: dict[str, list[str]] | None,
-                  replacement_i: int | None,
-                  replace_with_view=True) -> str | tuple[str, str]:
+                  replacement_i: int | None) -> str:
     """
     Retrieves the corresponding SQL query file for a YARRRML mapping file path, and returns it as a string.
 
     It optionally accepts a custom_sql_template parameter, composed of replacement keys and corresponding lists of possible replacement values.
     If so, replacement_i must dictate the index of the list to pick the replacement value from.
     These two parameters are currently used to generate SQL queries discriminating against different type IDs in the RDMS
+
+    References to staging tables ({staging.name}) are kept, they are resolved once the run creates them (see staging_tables.py)
     """
-    with open(file_name.replace("_templated", "").replace(".yml", ".sql"), 'r') as f:
-        lines = f.readlines()
+    lines = read_template(file_name.replace("_templated", "").replace(".yml", ".sql")).splitlines(keepends=True)
 
-        query = lines[0] + ''.join('          ' + line if line.strip() else line for line in lines[1:])
+    query = lines[0] + ''.join('          ' + line if line.strip() else line for line in lines[1:])
 
-        if custom_sql_template is not None:
-            for key, val in custom_sql_template.items():
-                query = query.replace(key, val[replacement_i])
+    if custom_sql_template is not None:
+        for key, val in custom_sql_template.items():
+            query = query.replace(key, val[replacement_i])
 
-        if replace_with_view:
-            # Transform it into a view beforehand, to avoid launching a very complex query multiple times needlessly
-            return MSSQLDB().create_view_for_query(query)
-        else:
-            return query
+    return query
 
 
 def create_untemplated_yarrrml_file(content: str,
@@ -114,8 +120,7 @@ def fill_template_values(templated_yml: str,
               If convert_to_csv = True, returns a list of (untemplated YARRRML file path, SQL query to execute, CSV file path to store the SQL query results in)
               The SQL queries are then to be executed inside the materialization job.
     """
-    with open(templated_yml, 'r') as f:
-        content = f.read()
+    content = read_template(templated_yml)
 
     if convert_to_csv:
         output_file_names: list[tuple[str, str, str]] = []
@@ -134,8 +139,7 @@ def fill_template_values(templated_yml: str,
         for replacement_i in range(number_of_replacements):
             query = get_sql_query(templated_yml,
                                   custom_sql_template,
-                                  replacement_i,
-                                  replace_with_view=False)
+                                  replacement_i)
             if convert_to_csv:
                 csv_file = output_file_name.replace(".yml", f"_{replacement_i}.csv")
             else:
@@ -143,11 +147,12 @@ def fill_template_values(templated_yml: str,
             csv_files_to_create.append((query, csv_file))
 
         for replacement_i, (query, csv_file) in enumerate(csv_files_to_create):
-            source_identifier = uuid.uuid4().hex # One identifier for each copy
+            # One identifier for each copy. Deterministic, so that their RML conversions can be cached (see create_rml_file)
+            source_identifier = uuid.uuid5(uuid.NAMESPACE_URL, output_file_name.replace(".yml", f"_{replacement_i}.yml")).hex
 
             content_copy = content.replace("{i}", source_identifier).replace("sql_source", source_identifier)
 
-            # Without SQL views, only used to validate the mappings consistency
+            # Only used to validate the mappings consistency
             sources_for_validation = mssql_source.replace('{query}', query)
 
             # Validate it
@@ -185,15 +190,14 @@ def fill_template_values(templated_yml: str,
                 output_file_names.append(new_output_file_name)
 
     else: # It's a single .yml
-        source_identifier = uuid.uuid4().hex
+        source_identifier = uuid.uuid5(uuid.NAMESPACE_URL, output_file_name).hex
         content_copy = content.replace("{i}", source_identifier).replace("sql_source", source_identifier)
 
         query = get_sql_query(templated_yml,
                               custom_sql_template,
-                              None,
-                              replace_with_view=False)
+                              None)
 
-        # Without SQL views, only used to validate the mappings consistency
+        # Only used to validate the mappings consistency
         sources_for_validation = mssql_source.replace('{query}', query)
 
         # Validate it
@@ -0,0 +1,492 @@
+"""
+Module that handles incremental materializations of the KG, driven by the `_created`/`_updated` columns of the RDMS tables.
+
+Each run persists a high-water mark of `_created`/`_updated` per table. The next run:
+    1. Fetches the ObjectIds of every row created or updated since the last watermarks
+    2. Expands them with their dependents, following the samples they belong to (e.g. a new handover changes to which
+       handover every measurement of its sample is attached to, so all of them have to be re-mapped)
+    3. Restricts every mapping query to the rows that reference any of the affected ObjectIds. Mappings that do not
+       reference any ObjectId (users and projects) are small and are always re-run in full
+    4. The resulting triples are a delta for the datastore: all triples of the entities owned by the affected objects
+       (whether the delta contains them again or not, e.g. for a removed link) and of the handover groups created for
+       them during the postprocessing are deleted, and the delta is then loaded
+
+The object owning an entity is given by the subject templates of the mappings, e.g. the HandoverId in
+activity:EDX_activity_for_handover_$(HandoverId) (see get_owned_subject_patterns).
+
+If there are no previous watermarks, or too many objects changed for restricting the queries to be worth it, a full
+rebuild is performed instead.
+
+Note: rows deleted from the RDMS leave no watermark behind. A full rebuild (e.g. deleting WATERMARKS_FILE_PATH, see
+discard_watermarks) should be performed periodically to get rid of their triples. main.run_service does so every
+--full_rebuild_interval s.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from functools import cache
+from pathlib import Path
+
+from datastores.rdf import rdf_datastore_client
+from datastores.rdf.rdf_datastore import MAIN_GRAPH_IRI
+from datastores.sql.sql_db import MSSQLDB
+from .python_engine import expand_prefix
+from .validate_mappings_consistency import extract_select_names
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+WATERMARKS_FILE_PATH = os.path.join(module_dir, 'incremental_state/watermarks.json')
+
+# Above this number of affected objects, the IN (...) lists get too large for MSSQL and a full rebuild is cheaper
+MAX_AFFECTED_OBJECTS = 5_000
+
+# Subjects deleted per SPARQL update
+DELETION_BATCH_SIZE = 500
+
+# Tables with _created/_updated columns, alongside the columns containing the ObjectIds their rows refer to
+watermarked_tables: dict[str, list[str]] = {
+    "vro.vroObjectInfo": ["ObjectId"],
+    "vro.vroObjectLinkObject": ["ObjectId", "LinkedObjectId"],
+    "vro.vroPropertyInt": ["ObjectId"],
+    "vro.vroPropertyFloat": ["ObjectId"],
+}
+
+# Columns of the mapping queries that contain RDMS ObjectIds, used to restrict them to the affected objects
+object_id_columns = {
+    "ObjectId",
+    "SampleId",
+    "MLId",
+    "SubstrateObjectId",
+    "HandoverId",
+    "NextHandoverId",
+    "MeasurementId",
+    "OriginalMeasurementId",
+    "CompositionId",
+    "SourceObjectId",
+    "TargetObjectId",
+}
+
+# Tables (or views) of the RDMS referenced by a query, e.g. vro.vroComposition
+table_reference_pattern = re.compile(r"\b(?:vro|dbo)\.\w+\b", re.IGNORECASE)
+
+crc_namespace = "https://crc1625.mdi.ruhr-uni-bochum.de/"
+
+mappings_dir = os.path.join(module_dir, 'mappings')
+
+# Subject templates of the templated YARRRML files (e.g. measurement_area:ma_for_ML_$(MLId)_in_MA_$(MeasurementArea)),
+# alongside their column references and template placeholders (e.g. {measurement_name})
+subject_template_pattern = re.compile(r"^\s+s:\s*(\S+)\s*$", re.MULTILINE)
+template_reference_pattern = re.compile(r"\$\((\w+)\)|\{\w+\}")
+
+# Values of references other than the owner (percent-encoded, so within a single IRI segment). Subject patterns are
+# used both in Python and in SPARQL REGEX filters, so they only use syntax common to both
+OTHER_VALUE_PATTERN = r"[^/?#<>\s]+"
+
+# Namespaces whose mappings are always re-run in full, and thus can always be replaced
+fully_rematerialized_namespaces = [crc_namespace + "user/", crc_namespace + "project/"]
+
+# Handover groups are created during the postprocessing, they are deleted via delete_handover_groups instead
+handover_group_prefix = crc_namespace + "handover/handovers_in_project_"
+
+dependent_objects_query = open(os.path.join(module_dir, 'incremental_queries/dependent_objects.sql')).read()
+delete_subjects_query = open(os.path.join(module_dir, 'incremental_queries/delete_subjects.sparql')).read()
+delete_handover_groups_query = open(os.path.join(module_dir, 'incremental_queries/delete_handover_groups.sparql')).read()
+select_owned_subjects_query = open(os.path.join(module_dir, 'incremental_queries/select_owned_subjects.sparql')).read()
+
+
+@dataclass
+class IncrementalRun:
+    """
+    Scope of an incremental materialization
+
+    :param watermarks: Watermarks read before running the mappings, to be saved once the delta has been applied
+    :param affected_object_ids: ObjectIds whose entities have to be re-materialized
+    :param is_full_rebuild: Whether the whole KG has to be rebuilt instead
+    """
+    watermarks: dict[str, dict[str, str | None]]
+    affected_object_ids: set[int] = field(default_factory=set)
+    is_full_rebuild: bool = False
+
+    def is_up_to_date(self) -> bool:
+        return not self.is_full_rebuild and len(self.affected_object_ids) == 0
+
+
+def load_watermarks() -> dict[str, dict[str, str | None]] | None:
+    """
+    Returns the watermarks saved by the last successful run, or None if there are none
+    """
+    if not os.path.exists(WATERMARKS_FILE_PATH):
+        return None
+
+    with open(WATERMARKS_FILE_PATH, 'r') as f:
+        return json.load(f)
+
+
+def save_watermarks(watermarks: dict[str, dict[str, str | None]]):
+    """
+    Persists the watermarks of a run. It should only be called once its triples have been loaded into the datastore
+    """
+    os.makedirs(os.path.dirname(WATERMARKS_FILE_PATH), exist_ok=True)
+
+    with open(WATERMARKS_FILE_PATH, 'w') as f:
+        json.dump(watermarks, f, indent=4)
+
+
+def get_watermarks(db: MSSQLDB) -> dict[str, dict[str, str | None]]:
+    """
+    Returns table -> {"_created": max_created, "_updated": max_updated}, with the dates as ISO 8601 strings
+    """
+    watermarks = dict()
+
+    for table in watermarked_tables.keys():
+        [record] = db.query_to_records(f"""
+            SELECT CONVERT(VARCHAR(33), MAX(_created), 126) AS maxCreated,
+                   CONVERT(VARCHAR(33), MAX(_updated), 126) AS maxUpdated
+            FROM {table}
+        """)
+        watermarks[table] = {
+            "_created": record["maxCreated"],
+            "_updated": record["maxUpdated"]
+        }
+
+    return watermarks
+
+
+def get_change_fingerprint(db: MSSQLDB) -> dict[str, dict[str, str | int | None]]:
+    """
+    Returns a cheap fingerprint of the RDMS contents: its watermarks (see get_watermarks), alongside the number of rows of
+    every watermarked table, taken from the table metadata instead of counting them. The vro tables are views without
+    partitions of their own, so the rows of the tables they read are taken instead. Any insertion, update or deletion
+    changes it
+
+    :returns: Dict of table -> {"_created": max_created, "_updated": max_updated, "rows": number of rows}
+    """
+    fingerprint = get_watermarks(db)
+
+    for table in watermarked_tables.keys():
+        [record] = db.query_to_records(f"""
+            SELECT COALESCE(SUM(rows), 0) AS numberOfRows
+            FROM sys.partitions
+            WHERE index_id IN (0, 1)
+              AND object_id IN (
+                  SELECT OBJECT_ID('{table}')
+                  UNION
+                  SELECT referenced_id
+                  FROM sys.sql_expression_dependencies
+                  WHERE referencing_id = OBJECT_ID('{table}') AND referenced_id IS NOT NULL
+              )
+        """)
+        fingerprint[table]["rows"] = int(record["numberOfRows"])
+
+    return fingerprint
+
+
+def get_referenced_tables(queries: list[str]) -> list[str]:
+    """
+    Returns the tables (or views) of the RDMS referenced by any of the queries, lowercased (their names are
+    case-insensitive) and sorted
+    """
+    referenced_tables = set()
+    for query in queries:
+        referenced_tables.update(table.lower() for table in table_reference_pattern.findall(query))
+
+    return sorted(referenced_tables)
+
+
+def get_table_fingerprints(db: MSSQLDB, tables: list[str]) -> dict[str, dict[str, str | int | None]]:
+    """
+    Returns a fingerprint of the contents of every table (or view): its number of rows, alongside
+        - the maximum of its _created and _updated columns (as in get_watermarks), if it has them
+        - otherwise, CHECKSUM_AGG(BINARY_CHECKSUM(*)) over all of its rows, which changes with almost any update.
+          Columns of noncomparable types (e.g. text or xml) are ignored by BINARY_CHECKSUM
+    Each table is read once (a full scan for checksums), which is still far cheaper than running the queries reading it.
+    Rows are counted instead of being taken from sys.partitions, as the vro tables are views over the dbo ones
+
+    :returns: Dict of table -> {"rows": number of rows, "_created": ..., "_updated": ...} or {"rows": ..., "checksum": ...}
+    """
+    fingerprints = dict()
+
+    for table in tables:
+        [columns] = db.query_to_records(f"""
+            SELECT COL_LENGTH('{table}', '_created') AS createdLength,
+                   COL_LENGTH('{table}', '_updated') AS updatedLength
+        """)
+
+        if columns["createdLength"] is not None and columns["updatedLength"] is not None:
+            [record] = db.query_to_records(f"""
+                SELECT COUNT_BIG(*) AS numberOfRows,
+                       CONVERT(VARCHAR(33), MAX(_created), 126) AS maxCreated,
+                       CONVERT(VARCHAR(33), MAX(_updated), 126) AS maxUpdated
+                FROM {table}
+            """)
+            fingerprints[table] = {
+                "rows": int(record["numberOfRows"]),
+                "_created": record["maxCreated"],
+                "_updated": record["maxUpdated"]
+            }
+        else:
+            [record] = db.query_to_records(f"""
+                SELECT COUNT_BIG(*) AS numberOfRows,
+                       CHECKSUM_AGG(BINARY_CHECKSUM(*)) AS checksum
+                FROM {table}
+            """)
+            fingerprints[table] = {
+                "rows": int(record["numberOfRows"]),
+                "checksum": None if record["checksum"] is None else int(record["checksum"])
+            }
+
+    return fingerprints
+
+
+def has_deleted_rows(previous_fingerprint: dict[str, dict[str, str | int | None]],
+                     fingerprint: dict[str, dict[str, str | int | None]]) -> bool:
+    """
+    Returns whether any watermarked table lost rows between two fingerprints (see get_change_fingerprint). Deletions
+    leave no watermark behind, so only a full rebuild gets rid of their triples. Deletions offset by as many insertions
+    are not detected
+    """
+    return any(fingerprint[table]["rows"] < previous_fingerprint[table]["rows"]
+               for table in watermarked_tables.keys()
+               if table in previous_fingerprint and table in fingerprint)
+
+
+def discard_watermarks():
+    """
+    Forgets the watermarks of the last run, so that the next incremental run performs a full rebuild
+    """
+    if os.path.exists(WATERMARKS_FILE_PATH):
+        os.remove(WATERMARKS_FILE_PATH)
+
+
+def format_object_ids(object_ids: set[int]) -> str:
+    return ", ".join(str(object_id) for object_id in sorted(object_ids))
+
+
+def get_changed_object_ids(db: MSSQLDB, watermarks: dict[str, dict[str, str | None]]) -> set[int]:
+    """
+    Returns the ObjectIds referenced by every row created or updated since the given watermarks.
+
+    Rows with the same date as the watermark are included too, as rows written in the same instant may have been
+    committed after the watermark was read. Re-materializing them twice is harmless.
+    """
+    subqueries = []
+    for table, id_columns in watermarked_tables.items():
+        conditions = []
+        for date_column in ["_created", "_updated"]:
+            watermark = watermarks.get(table, {}).get(date_column)
+            if watermark is None: # Empty table on the last run
+                conditions.append(f"{date_column} IS NOT NULL")
+            else:
+                conditions.append(f"{date_column} >= '{watermark}'")
+
+        for id_column in id_columns:
+            subqueries.append(f"SELECT {id_column} AS ObjectId FROM {table} WHERE {' OR '.join(conditions)}")
+
+    records = db.query_to_records("\nUNION\n".join(subqueries))
+
+    return {int(record["ObjectId"]) for record in records if record["ObjectId"] is not None}
+
+
+def get_dependent_object_ids(db: MSSQLDB, object_ids: set[int]) -> set[int]:
+    """
+    Returns the objects whose triples depend on the given ones (see incremental_queries/dependent_objects.sql)
+    """
+    if len(object_ids) == 0:
+        return set()
+
+    records = db.query_to_records(dependent_objects_query.replace("{object_ids}", format_object_ids(object_ids)))
+
+    return {int(record["ObjectId"]) for record in records if record["ObjectId"] is not None}
+
+
+def prepare_incremental_run(db: MSSQLDB) -> IncrementalRun:
+    """
+    Reads the current watermarks and computes which objects have to be re-materialized since the last successful run
+    """
+    # Read them first: anything written while the mappings run will be picked up by the next run
+    watermarks = get_watermarks(db)
+    previous_watermarks = load_watermarks()
+
+    if previous_watermarks is None:
+        logging.info("No previous watermarks found, a full rebuild of the KG will be performed")
+        return IncrementalRun(watermarks, is_full_rebuild=True)
+
+    changed_object_ids = get_changed_object_ids(db, previous_watermarks)
+    if len(changed_object_ids) > MAX_AFFECTED_OBJECTS:
+        logging.info(f"{len(changed_object_ids)} objects changed since the last run, a full rebuild of the KG will be performed")
+        return IncrementalRun(watermarks, is_full_rebuild=True)
+
+    affected_object_ids = changed_object_ids | get_dependent_object_ids(db, changed_object_ids)
+    if len(affected_object_ids) > MAX_AFFECTED_OBJECTS:
+        logging.info(f"{len(affected_object_ids)} objects affected since the last run, a full rebuild of the KG will be performed")
+        return IncrementalRun(watermarks, is_full_rebuild=True)
+
+    logging.info(f"Objects changed since the last run: {len(changed_object_ids)}. Objects to re-materialize: {len(affected_object_ids)}")
+    return IncrementalRun(watermarks, affected_object_ids=affected_object_ids)
+
+
+def restrict_query_to_objects(query: str, object_ids: set[int]) -> str | None:
+    """
+    Wraps a mapping query so that it only returns rows referencing any of the given ObjectIds in any of its ObjectId
+    columns (see object_id_columns)
+
+    Returns None if the query has no ObjectId columns, in which case it has to be run in full
+    """
+    id_columns = sorted(set(extract_select_names(query)) & object_id_columns)
+    if len(id_columns) == 0:
+        return None
+
+    formatted_object_ids = format_object_ids(object_ids)
+    conditions = " OR ".join(f"incrementalQuery.{column} IN ({formatted_object_ids})" for column in id_columns)
+
+    return f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) incrementalQuery WHERE {conditions}"
+
+
+def restrict_jobs_to_affected_objects(untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]],
+                                      incremental_run: IncrementalRun) -> list[tuple[str, str, str]]:
+    """
+    Restricts the SQL query of every (untemplated YARRRML file path, SQL query, CSV file path) job obtained via
+    `prepare_YARRRML_files()` to the objects affected in the incremental run
+    """
+    restricted_jobs = []
+    for (yarrrml_file, query, csv_file) in untemplated_yarrrml_file_names_and_jobs:
+        restricted_query = restrict_query_to_objects(query, incremental_run.affected_object_ids)
+        if restricted_query is None:
+            restricted_query = query
+
+        restricted_jobs.append((yarrrml_file, restricted_query, csv_file))
+
+    return restricted_jobs
+
+
+def escape_regex(value: str) -> str:
+    """
+    Escapes the metacharacters of a string for both Python and SPARQL (XPath) regexes
+    """
+    return re.sub(r"([\\.?*+(){}|\[\]^$-])", r"\\\1", value)
+
+
+@cache
+def get_owned_subject_patterns() -> list[tuple[str, str]]:
+    """
+    Returns the regexes matching the IRIs of the entities that belong to an RDMS object, taken from the subject templates
+    of the mappings. The owner is the first ObjectId column referenced by the template (see object_id_columns), e.g. the
+    MLId in measurement_area:ma_for_ML_$(MLId)_in_MA_$(MeasurementArea).
+
+    :returns: List of (regex preceding the owner's ObjectId, regex following it)
+    """
+    subject_templates = set()
+    for templated_yml in sorted(Path(mappings_dir).rglob("*_templated.yml")):
+        subject_templates.update(subject_template_pattern.findall(open(templated_yml).read()))
+
+    patterns = set()
+    for subject_template in sorted(subject_templates):
+        # Constant strings alternate with references, whose column is None for placeholders
+        split_template = template_reference_pattern.split(expand_prefix(subject_template))
+        constants, references = [escape_regex(constant) for constant in split_template[::2]], split_template[1::2]
+
+        owner_i = next((i for i, column in enumerate(references) if column in object_id_columns), None)
+        if owner_i is None:
+            continue
+
+        head = constants[0] + "".join(OTHER_VALUE_PATTERN + constant for constant in constants[1:owner_i + 1])
+        tail = "".join(OTHER_VALUE_PATTERN + constant for constant in constants[owner_i + 2:])
+        patterns.add((head, constants[owner_i + 1] + tail))
+
+    return sorted(patterns)
+
+
+def get_owner_object_id(subject_iri: str) -> int | None:
+    """
+    Returns the ObjectId of the RDMS object an entity of the KG belongs to, or None if its IRI does not match any subject
+    template owned by an object (see get_owned_subject_patterns)
+    """
+    for (head, tail) in get_owned_subject_patterns():
+        match = re.fullmatch(f"{head}(\\d+){tail}", subject_iri)
+        if match:
+            return int(match.group(1))
+
+    return None
+
+
+def get_stored_subjects_to_replace(incremental_run: IncrementalRun, graph_iri: str = MAIN_GRAPH_IRI) -> set[str]:
+    """
+    Returns the subjects in the datastore that belong to any of the affected objects. They have to be deleted even if
+    the delta does not contain them again (e.g. the activity of a handover no measurement is attached to anymore)
+    """
+    subjects = set()
+    object_ids = sorted(incremental_run.affected_object_ids)
+
+    for i in range(0, len(object_ids), DELETION_BATCH_SIZE):
+        formatted_object_ids = "|".join(str(object_id) for object_id in object_ids[i:i + DELETION_BATCH_SIZE])
+        pattern = "^(" + "|".join(f"{head}({formatted_object_ids}){tail}" for (head, tail) in get_owned_subject_patterns()) + ")$"
+
+        query = (select_owned_subjects_query
+                 .replace("{graph_iri}", graph_iri)
+                 .replace("{pattern}", pattern.replace("\\", "\\\\")))
+        response = rdf_datastore_client.run_sync(rdf_datastore_client.launch_query(query))
+        subjects.update(binding["s"]["value"] for binding in response["results"]["bindings"])
+
+    return subjects
+
+
+def get_subjects_to_replace(materialized_files: list[str], incremental_run: IncrementalRun) -> set[str]:
+    """
+    Returns the subjects of the delta whose triples have all been re-materialized, and thus have to be deleted from the
+    datastore before loading the delta. The mappings output contains one triple per line, and may be gzip-compressed.
+    """
+    subjects = set()
+
+    for materialized_file in materialized_files:
+        opener = gzip.open if materialized_file.endswith(".gz") else open
+        with opener(materialized_file, 'rt', encoding='utf-8') as f:
+            for line in f:
+                match = re.match(r"\s*<([^>]*)>", line)
+                if not match:
+                    continue
+
+                subject = match.group(1)
+                if subject.startswith(handover_group_prefix):
+                    continue
+                elif any(subject.startswith(namespace) for namespace in fully_rematerialized_namespaces):
+                    subjects.add(subject)
+                elif get_owner_object_id(subject) in incremental_run.affected_object_ids:
+                    subjects.add(subject)
+
+    return subjects
+
+
+def delete_outdated_triples(materialized_files: list[str],
+                            incremental_run: IncrementalRun,
+                            graph_iri: str = MAIN_GRAPH_IRI):
+    """
+    Deletes from the datastore all triples of the entities re-materialized in the delta or owned by the affected
+    objects, alongside the handover groups containing any of them. The postprocessing will create their groups again.
+    """
+    subjects = sorted(get_subjects_to_replace(materialized_files, incremental_run)
+                      | get_stored_subjects_to_replace(incremental_run, graph_iri))
+    logging.info(f"Deleting the triples of {len(subjects)} re-materialized or outdated entities...")
+
+    is_virtuoso = rdf_datastore_client.run_sync(rdf_datastore_client.get_datastore_type()) == "virtuoso"
+
+    for i in range(0, len(subjects), DELETION_BATCH_SIZE):
+        formatted_subjects = " ".join(f"<{subject}>" for subject in subjects[i:i + DELETION_BATCH_SIZE])
+
+        for query_template in [delete_handover_groups_query, delete_subjects_query]:
+            query = query_template.replace("{graph_iri}", graph_iri).replace("{subjects}", formatted_subjects)
+            if is_virtuoso:
+                # Prevents OOMs from writing transactions to memory if there are many affected triples
+                query = "DEFINE sql:log-enable 3\n" + query
+
+            rdf_datastore_client.run_sync(rdf_datastore_client.launch_update(query))
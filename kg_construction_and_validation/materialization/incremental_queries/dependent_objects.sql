@@ -0,0 +1,35 @@
+WITH affectedSamples AS (
+    /* Changed samples and computational samples */
+    SELECT ObjectId
+    FROM vro.vroObjectInfo
+    WHERE ObjectId IN ({object_ids})
+    AND TypeId IN (6, 99)
+    UNION
+    /* Samples linking to changed objects (measurements, compositions, pieces...) */
+    SELECT linkingSamples.ObjectId
+    FROM vro.vroObjectLinkObject linkingSamples
+    JOIN vro.vroObjectInfo sampleData ON sampleData.ObjectId = linkingSamples.ObjectId
+    WHERE linkingSamples.LinkedObjectId IN ({object_ids})
+    AND sampleData.TypeId IN (6, 99)
+    UNION
+    /* Samples of changed handovers */
+    SELECT SampleObjectId
+    FROM vro.vroHandover
+    WHERE HandoverId IN ({object_ids})
+)
+SELECT ObjectId FROM affectedSamples
+UNION
+/* Everything the affected samples link to (measurements, compositions, pieces, substrates...) */
+SELECT LinkedObjectId AS ObjectId
+FROM vro.vroObjectLinkObject
+WHERE ObjectId IN (SELECT ObjectId FROM affectedSamples)
+UNION
+/* Everything linking to the affected samples (ideas, requests for synthesis, parent samples...) */
+SELECT ObjectId
+FROM vro.vroObjectLinkObject
+WHERE LinkedObjectId IN (SELECT ObjectId FROM affectedSamples)
+UNION
+/* All handovers of the affected samples, as a change may move measurements between them */
+SELECT HandoverId AS ObjectId
+FROM vro.vroHandover
+WHERE SampleObjectId IN (SELECT ObjectId FROM affectedSamples)
@@ -0,0 +1,359 @@
+"""
+Module that advises which indexes would speed up the mappings queries, so that slow mappings are found before a
+production rebuild runs into them:
+    1. Every query produced by prepare_YARRRML_files, and every staging query they reference, is executed under
+       SET STATISTICS XML ON (see MSSQLDB.query_with_actual_plans), timing it and collecting its actual execution plans
+    2. The plans are analyzed: the scans, seeks and lookups performed on each table (alongside the rows they read), and
+       the missing indexes reported by the optimizer, with their estimated impact on the cost of the query
+    3. The missing indexes are merged into covering indexes: one per table and key columns (equality columns, then
+       inequality ones), including the union of the columns of all suggestions with those keys. Indexes whose key
+       columns are a prefix of another's are merged into it. They are written to a .sql file following the format of
+       datastores/sql/additional_indexes.sql, so that they can be reviewed and added to it
+    4. Optionally, the proposed indexes are created and the queries are timed again, for a before/after report
+
+Missing indexes of the staging tables are reported but never created, as the staging tables are recreated on every
+run. Their indexes are declared in staging_tables.py instead.
+
+Note: the optimizer only reports missing indexes for the plans it considered, and its impact estimates are often
+optimistic. The proposals should be reviewed (e.g. for overlaps with existing indexes) before adding them.
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from datastores.sql.sql_db import MSSQLDB, showplan_namespace
+from .materialization import prepare_YARRRML_files
+from .staging_tables import (STAGING_TABLE_PREFIX, create_staging_tables, drop_staging_tables,
+                             get_referenced_staging_tables, get_staging_query, resolve_staging_tables)
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+# Physical operators of the plans counted as scans, seeks and lookups of a table
+SCAN_OPERATORS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+SEEK_OPERATORS = {"Clustered Index Seek", "Index Seek"}
+LOOKUP_OPERATORS = {"Key Lookup", "RID Lookup"}
+
+# Missing indexes with a lower estimated impact (in % of the cost of the query) are not proposed
+MIN_INDEX_IMPACT = 10.0
+
+# Maximum length of SQL Server identifiers
+MAX_INDEX_NAME_LENGTH = 128
+
+
+@dataclass(frozen=True)
+class MissingIndex:
+    """
+    Index reported as missing by the optimizer. Columns are listed in the order reported
+    """
+    table: str
+    equality_columns: tuple[str, ...]
+    inequality_columns: tuple[str, ...]
+    included_columns: tuple[str, ...]
+
+
+def _unquote(identifier: str | None) -> str:
+    return (identifier or "").strip("[]")
+
+
+def _get_table(element: ET.Element) -> str:
+    return f"{_unquote(element.get('Schema'))}.{_unquote(element.get('Table'))}"
+
+
+def analyze_plans(plans: list[str]) -> dict:
+    """
+    Analyzes the actual execution plans (showplan XML) of the statements of a query
+
+    :returns: Dict of {
+        "tables": table -> {"scans", "seeks", "lookups": number of operators of each kind, "rows_read": rows they read},
+        "missing_indexes": list of (MissingIndex, impact),
+        "server_elapsed_time" / "server_cpu_time": as measured by the server (in s.), or None if not reported
+    }
+    """
+    tables: dict[str, dict[str, int]] = dict()
+    missing_indexes: list[tuple[MissingIndex, float]] = []
+    elapsed_time, cpu_time = None, None
+
+    for plan in plans:
+        root = ET.fromstring(plan)
+
+        for rel_op in root.iter(f"{{{showplan_namespace['sp']}}}RelOp"):
+            physical_op = rel_op.get("PhysicalOp")
+            if physical_op in SCAN_OPERATORS:
+                kind = "scans"
+            elif physical_op in SEEK_OPERATORS:
+                kind = "seeks"
+            elif physical_op in LOOKUP_OPERATORS:
+                kind = "lookups"
+            else:
+                continue
+
+            # The object is referenced by the operator's own element, nested operators have their own RelOp
+            table_object = rel_op.find("./*/sp:Object", showplan_namespace)
+            if table_object is None:
+                continue
+
+            counters = tables.setdefault(_get_table(table_object), {"scans": 0, "seeks": 0, "lookups": 0, "rows_read": 0})
+            counters[kind] += 1
+            for thread_counters in rel_op.findall("./sp:RunTimeInformation/sp:RunTimeCountersPerThread", showplan_namespace):
+                # ActualRowsRead is only reported by recent versions, ActualRows is the closest approximation otherwise
+                counters["rows_read"] += int(thread_counters.get("ActualRowsRead", thread_counters.get("ActualRows", 0)))
+
+        for group in root.iter(f"{{{showplan_namespace['sp']}}}MissingIndexGroup"):
+            impact = float(group.get("Impact", 0))
+            for missing_index in group.findall("sp:MissingIndex", showplan_namespace):
+                columns = {"EQUALITY": (), "INEQUALITY": (), "INCLUDE": ()}
+                for column_group in missing_index.findall("sp:ColumnGroup", showplan_namespace):
+                    columns[column_group.get("Usage")] = tuple(_unquote(column.get("Name"))
+                                                               for column in column_group.findall("sp:Column", showplan_namespace))
+                missing_indexes.append((MissingIndex(_get_table(missing_index),
+                                                     columns["EQUALITY"],
+                                                     columns["INEQUALITY"],
+                                                     columns["INCLUDE"]),
+                                        impact))
+
+        for time_stats in root.iter(f"{{{showplan_namespace['sp']}}}QueryTimeStats"):
+            elapsed_time = (elapsed_time or 0) + int(time_stats.get("ElapsedTime", 0)) / 1000
+            cpu_time = (cpu_time or 0) + int(time_stats.get("CpuTime", 0)) / 1000
+
+    return {
+        "tables": tables,
+        "missing_indexes": missing_indexes,
+        "server_elapsed_time": elapsed_time,
+        "server_cpu_time": cpu_time,
+    }
+
+
+def get_advisor_queries(db: MSSQLDB, typed_activity_mappings: bool = False) -> tuple[list[tuple[str, str]], dict[str, str]]:
+    """
+    Prepares the mappings queries as a run would (see materialization.run_mappings), creating the staging tables they
+    reference
+
+    :returns: (list of (name, query), with the staging queries first, staging table replacements to drop them afterwards
+               via drop_staging_tables)
+    """
+    untemplated_yarrrml_file_names_and_jobs = prepare_YARRRML_files(typed_activity_mappings=typed_activity_mappings)
+    for (yml_file, _, _) in untemplated_yarrrml_file_names_and_jobs:
+        if os.path.exists(yml_file):
+            os.remove(yml_file)
+
+    staging_table_names = get_referenced_staging_tables([query for (_, query, _) in untemplated_yarrrml_file_names_and_jobs])
+    staging_table_replacements = create_staging_tables(db, untemplated_yarrrml_file_names_and_jobs)
+    untemplated_yarrrml_file_names_and_jobs = resolve_staging_tables(untemplated_yarrrml_file_names_and_jobs,
+                                                                     staging_table_replacements)
+
+    queries = [(f"staging_queries/{name}", get_staging_query(name)) for name in staging_table_names]
+    queries += [(Path(yml_file).stem, query) for (yml_file, query, _) in untemplated_yarrrml_file_names_and_jobs]
+
+    return queries, staging_table_replacements
+
+
+def time_queries(db: MSSQLDB,
+                 queries: list[tuple[str, str]],
+                 repetitions: int = 1,
+                 cold_cache: bool = False) -> dict[str, dict]:
+    """
+    Executes every query repetitions times, analyzing the plans of its last execution (see analyze_plans)
+
+    :param cold_cache: Whether to empty the buffer pool before every execution (see MSSQLDB.drop_clean_buffers)
+
+    :returns: Dict of query name -> {"rows", "time": fastest execution (in s.), "times", and the analysis of its plans}
+    """
+    results = dict()
+    for i, (name, query) in enumerate(queries):
+        logging.info(f"[{i + 1}/{len(queries)}] Executing {name}...")
+
+        times = []
+        for _ in range(repetitions):
+            if cold_cache:
+                db.drop_clean_buffers()
+            (rows, execution_time, plans) = db.query_with_actual_plans(query)
+            times.append(execution_time)
+
+        results[name] = {"rows": rows, "time": min(times), "times": times, **analyze_plans(plans)}
+
+    return results
+
+
+def get_index_name(table: str, key_columns: list[str], included_columns: list[str]) -> str:
+    name = f"IX_{table.split('.')[-1]}_{'_'.join(key_columns)}"
+    if len(included_columns) > 0:
+        name += f"_include_{'_'.join(included_columns)}"
+
+    if len(name) > MAX_INDEX_NAME_LENGTH:
+        name_hash = hashlib.sha256(name.encode()).hexdigest()[:8]
+        name = f"{name[:MAX_INDEX_NAME_LENGTH - len(name_hash) - 1]}_{name_hash}"
+
+    return name
+
+
+def propose_indexes(results: dict[str, dict]) -> list[dict]:
+    """
+    Merges the missing indexes reported for all queries into covering indexes, see the module's documentation
+
+    :returns: List of {"name", "table", "key_columns", "included_columns", "impact": highest impact among the merged
+              suggestions, "queries": names of the queries they were reported for, "staging_table": whether the table is
+              a staging table, "statement": statement creating the index}, sorted by descending impact
+    """
+    proposals: dict[tuple[str, tuple[str, ...]], dict] = dict()
+    for query_name, result in results.items():
+        for (missing_index, impact) in result["missing_indexes"]:
+            if impact < MIN_INDEX_IMPACT:
+                continue
+
+            key_columns = missing_index.equality_columns + missing_index.inequality_columns
+            proposal = proposals.setdefault((missing_index.table, key_columns), {
+                "table": missing_index.table,
+                "key_columns": list(key_columns),
+                "included_columns": [],
+                "impact": 0.0,
+                "queries": [],
+            })
+            proposal["included_columns"] += [column for column in missing_index.included_columns
+                                             if column not in proposal["included_columns"]]
+            proposal["impact"] = max(proposal["impact"], impact)
+            if query_name not in proposal["queries"]:
+                proposal["queries"].append(query_name)
+
+    # Indexes whose key columns are a prefix of those of another index (of the same table) are covered by it
+    merged_proposals = []
+    for proposal in sorted(proposals.values(), key=lambda p: len(p["key_columns"]), reverse=True):
+        covering_proposal = next((other for other in merged_proposals
+                                  if other["table"] == proposal["table"]
+                                  and other["key_columns"][:len(proposal["key_columns"])] == proposal["key_columns"]),
+                                 None)
+        if covering_proposal is None:
+            merged_proposals.append(proposal)
+            continue
+
+        covering_proposal["included_columns"] += [column for column in proposal["included_columns"]
+                                                  if column not in covering_proposal["included_columns"]
+                                                  and column not in covering_proposal["key_columns"]]
+        covering_proposal["impact"] = max(covering_proposal["impact"], proposal["impact"])
+        covering_proposal["queries"] += [query for query in proposal["queries"] if query not in covering_proposal["queries"]]
+
+    for proposal in merged_proposals:
+        proposal["name"] = get_index_name(proposal["table"], proposal["key_columns"], proposal["included_columns"])
+        proposal["staging_table"] = proposal["table"].split(".")[-1].startswith(STAGING_TABLE_PREFIX)
+        proposal["statement"] = get_index_statement(proposal)
+
+    return sorted(merged_proposals, key=lambda p: p["impact"], reverse=True)
+
+
+def get_index_statement(proposal: dict) -> str:
+    """
+    Returns the statement creating a proposed index unless it exists, in the format of additional_indexes.sql
+    """
+    key_columns = ", ".join(f"[{column}]" for column in proposal["key_columns"])
+    statement = (f"-- Missing index of {', '.join(proposal['queries'])} (impact: {proposal['impact']:.1f}%)\n"
+                 f"IF NOT EXISTS (\n"
+                 f"    SELECT 1 FROM sys.indexes\n"
+                 f"    WHERE name = '{proposal['name']}'\n"
+                 f"      AND object_id = OBJECT_ID('{proposal['table']}')\n"
+                 f")\n"
+                 f"BEGIN\n"
+                 f"    CREATE INDEX {proposal['name']}\n"
+                 f"        ON {proposal['table']} ({key_columns})")
+    if len(proposal["included_columns"]) > 0:
+        statement += f"\n        INCLUDE ({', '.join(f'[{column}]' for column in proposal['included_columns'])})"
+    return statement + ";\nEND;\n"
+
+
+def compare_times(before: dict[str, dict], after: dict[str, dict]) -> dict[str, dict[str, float]]:
+    """
+    :returns: Dict of query name -> {"time_before", "time_after", "speedup"}
+    """
+    return {name: {"time_before": before[name]["time"],
+                   "time_after": after[name]["time"],
+                   "speedup": before[name]["time"] / after[name]["time"] if after[name]["time"] > 0 else None}
+            for name in before.keys() & after.keys()}
+
+
+def _serializable(results: dict[str, dict]) -> dict[str, dict]:
+    return {name: {**result, "missing_indexes": [{**asdict(missing_index), "impact": impact}
+                                                 for (missing_index, impact) in result["missing_indexes"]]}
+            for name, result in results.items()}
+
+
+def run_index_advisor(db: MSSQLDB,
+                      report_file_path: str,
+                      proposals_file_path: str,
+                      create_indexes: bool = False,
+                      repetitions: int = 1,
+                      cold_cache: bool = False,
+                      typed_activity_mappings: bool = False) -> dict:
+    """
+    Analyzes the mappings queries and proposes indexes for them (see the module's documentation), writing the report
+    to report_file_path (.json) and the proposed indexes to proposals_file_path (.sql)
+
+    :param create_indexes: Whether to create the proposed indexes (except those of staging tables) and time the queries
+                           again afterwards
+    :param repetitions: Times every query is executed, the fastest execution is reported
+    :param cold_cache: Whether to empty the buffer pool before every execution
+
+    :returns: The report, as a dict of {"before": query name -> results (see time_queries), "proposed_indexes" (see
+              propose_indexes), "after": results after creating the indexes or None, "comparison" (see compare_times)
+              or None}
+    """
+    if db.is_remote:
+        raise RuntimeError("The index advisor can only be run on local DBs deployed as docker containers")
+
+    queries, staging_table_replacements = get_advisor_queries(db, typed_activity_mappings)
+    try:
+        logging.info(f"Timing {len(queries)} queries and collecting their execution plans...")
+        before = time_queries(db, queries, repetitions, cold_cache)
+
+        proposals = propose_indexes(before)
+        logging.info(f"Indexes proposed: {len(proposals)} "
+                     f"({sum(proposal['staging_table'] for proposal in proposals)} of staging tables)")
+        with open(proposals_file_path, "w") as f:
+            f.write("-- Indexes proposed by the index advisor (see materialization/index_advisor.py)\n\n")
+            f.write("\n".join(proposal["statement"] for proposal in proposals if not proposal["staging_table"]))
+            if any(proposal["staging_table"] for proposal in proposals):
+                f.write("\n-- Indexes of staging tables, to be declared in materialization/staging_tables.py instead\n\n")
+                for proposal in proposals:
+                    if proposal["staging_table"]:
+                        f.write("".join(f"-- {line}\n" for line in proposal["statement"].splitlines()) + "\n")
+
+        after, comparison = None, None
+        indexes_to_create = [proposal for proposal in proposals if not proposal["staging_table"]]
+        if create_indexes and len(indexes_to_create) > 0:
+            for proposal in indexes_to_create:
+                logging.info(f"Creating index {proposal['name']}...")
+                db._execute_query(proposal["statement"])
+
+            logging.info("Timing the queries again...")
+            after = time_queries(db, queries, repetitions, cold_cache)
+            comparison = compare_times(before, after)
+    finally:
+        drop_staging_tables(db, staging_table_replacements)
+
+    report = {
+        "before": _serializable(before),
+        "proposed_indexes": proposals,
+        "after": _serializable(after) if after is not None else None,
+        "comparison": comparison,
+    }
+    with open(report_file_path, "w") as f:
+        json.dump(report, f, indent=4)
+
+    logging.info("Slowest queries:")
+    for name, result in sorted(before.items(), key=lambda item: item[1]["time"], reverse=True)[:10]:
+        time_after = f", {after[name]['time']:.2f} s. after creating the indexes" if after is not None else ""
+        logging.info(f"    {name}: {result['time']:.2f} s.{time_after}")
+    logging.info(f"Total time: {sum(result['time'] for result in before.values()):.2f} s." +
+                 (f", {sum(result['time'] for result in after.values()):.2f} s. after creating the indexes"
+                  if after is not None else ""))
+
+    return report
@@ -1,4 +1,4 @@
-SELECT compositionInfo.ObjectId AS CompositionId,
+SELECT edxCompositions.CompositionId,
     CASE
         WHEN compositionMetadata.propertyname = 'x' THEN 'x_position'
         WHEN compositionMetadata.propertyname = 'y' THEN 'y_position'
@@ -7,22 +7,9 @@ SELECT compositionInfo.ObjectId AS CompositionId,
         ELSE compositionMetadata.propertyname
     END AS propertyname,
 FORMAT(compositionMetadata.value, '0.0000') AS value, /* Fixed to a string with 4 decimal places, to avoid weird formatting errors */
-compositionLocation.value  AS MeasurementArea
-FROM vro.vroObjectLinkObject
-/* The original measurement the composition has been parsed from points to the composition's object */
-JOIN vro.vroObjectLinkObject originalMeasurement ON originalMeasurement.linkedobjectid = vro.vroObjectLinkObject.LinkedObjectId
-/* Original measurement's information */
-JOIN vro.vroObjectinfo originalMeasurementInfo ON originalMeasurement.ObjectId = originalMeasurementInfo.ObjectId
-/* Composition information */
-JOIN vro.vroObjectinfo compositionInfo ON compositionInfo.ObjectId = vro.vroObjectLinkObject.LinkedObjectId
-/* ML information */
-JOIN vro.vroObjectinfo MLInfo ON MLInfo.ObjectId = vro.vroObjectLinkObject.ObjectId
+edxCompositions.MeasurementArea
+/* Compositions of MLs parsed from EDX measurements, alongside their location */
+FROM {staging.edx_compositions} edxCompositions
 /* Composition's extra metadata (R, tolerance, tool's x,y positions...) */
-JOIN vro.vroPropertyFloat compositionMetadata ON compositionMetadata.ObjectId = vro.vroObjectLinkObject.LinkedObjectId
-/* Composition's location */
-JOIN vro.vroPropertyInt compositionLocation ON compositionLocation.ObjectId = vro.vroObjectlinkobject.LinkedObjectId
-WHERE  MLInfo.TypeId = 6 /* Sample  */
-AND compositionInfo.TypeId = 8 /* Composition */
-AND originalMeasurementInfo.TypeId IN ( 13, 15, 19, 53, 78, 79 ) /* EDX */
-AND compositionLocation.propertyName IN ('Measurement Area', 'MeasurementArea')
-AND compositionMetadata.propertyName IN ('x', 'y', 'R', 'Tolerance')
\ No newline at end of file
+JOIN vro.vroPropertyFloat compositionMetadata ON compositionMetadata.ObjectId = edxCompositions.CompositionId
+WHERE compositionMetadata.propertyName IN ('x', 'y', 'R', 'Tolerance')
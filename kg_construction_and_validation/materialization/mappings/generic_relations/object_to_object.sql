@@ -36,7 +36,11 @@ END AS relation,
             WHEN target.TypeId = -1 THEN 'handover/'
             ELSE 'measurement/'
         END
-    + CONVERT(VARCHAR, target.ObjectId)) AS targetIRI
+    + CONVERT(VARCHAR, target.ObjectId)) AS targetIRI,
+
+/* Not used in the mappings, required to restrict the query during incremental materializations */
+source.ObjectId AS SourceObjectId,
+target.ObjectId AS TargetObjectId
 
 FROM vro.vroObjectLinkObject
 JOIN vro.vroObjectInfo source on vro.vroObjectLinkObject.ObjectId = source.ObjectId
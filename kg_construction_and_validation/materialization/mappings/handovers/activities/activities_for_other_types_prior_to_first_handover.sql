@@ -11,24 +11,11 @@ FROM vro.vroObjectLinkObject linkingMLs
 JOIN vro.vroObjectInfo measurementData ON measurementData.ObjectId = linkingMLs.LinkedObjectId
 JOIN vro.vroObjectInfo sampleData ON sampleData.ObjectId = linkingMLs.ObjectId
 /* First Handover related to a ML, including also MLs that have *no* handovers */
-JOIN (
-    SELECT H.HandoverId, O._created, H.SampleObjectId
-    FROM vro.vroHandover H
-    /* ObjectInfo of the handover */
-    JOIN vro.vroObjectInfo O ON H.HandoverId = O.ObjectId
-    /* Handover with the earliest creation date for each ML */
-    JOIN (
-        SELECT SampleObjectId, MIN(_created) AS min_created
-        FROM vro.vroHandover
-        JOIN vro.vroObjectInfo ON vro.vroHandover.HandoverId = vro.vroObjectInfo.ObjectId
-        GROUP BY SampleObjectId
-    ) MinH ON H.SampleObjectId = MinH.SampleObjectId AND O._created = MinH.min_created
-) InitialHandover ON linkingMLs.ObjectId = InitialHandover.SampleObjectId
+JOIN {staging.handover_chains} InitialHandover ON linkingMLs.ObjectId = InitialHandover.SampleObjectId AND InitialHandover.ChainPosition = 1
 WHERE NOT EXISTS ( /* Exclude measurements that are already linked to a handover */
     SELECT 1
-    FROM vro.vroObjectLinkObject
-    JOIN vro.vroObjectInfo s on vro.vroObjectLinkObject.ObjectId = s.ObjectId
-    WHERE s.TypeId = -1 AND vro.vroObjectLinkObject.LinkedObjectId = measurementData.ObjectId
+    FROM {staging.measurements_linked_to_handovers} linkedMeasurements
+    WHERE linkedMeasurements.MeasurementId = measurementData.ObjectId
 )
 AND measurementData.TypeId NOT IN (12) /* Photo */
 AND measurementData.TypeId NOT IN (13, 15, 19, 53, 78, 79) /* EDX */
@@ -58,4 +45,4 @@ AND measurementData.TypeId NOT IN (
 AND sampleData.TypeId = 6
 /* Either the measurement has an earlier creation date than the first handover,
    or there are no handovers at all */
-AND measurementData._created < InitialHandover._created
\ No newline at end of file
+AND measurementData._created < InitialHandover.HandoverDate
\ No newline at end of file
@@ -1,9 +1,13 @@
 SELECT
 linkingMLs.ObjectId AS MLId,
-measurementData.ObjectId AS MeasurementId
+measurementData.ObjectId AS MeasurementId,
+measurementTypes.MeasurementName,
+measurementTypes.MeasurementClassName
 FROM vro.vroObjectLinkObject linkingMLs
 JOIN vro.vroObjectInfo measurementData ON measurementData.ObjectId = linkingMLs.LinkedObjectId
 JOIN vro.vroObjectInfo sampleData ON sampleData.ObjectId = linkingMLs.ObjectId
+/* Names and classes of the measurement types, see measurement_types in materialization.py */
+JOIN {measurement_types} measurementTypes (TypeId, MeasurementName, MeasurementClassName) ON measurementTypes.TypeId = measurementData.TypeId
 LEFT JOIN (
     SELECT H.HandoverId, H.SampleObjectId
     FROM vro.vroHandover H
@@ -1,12 +1,16 @@
 SELECT
 measurementData.ObjectId AS MeasurementId,
-handoverData.ObjectId AS HandoverId
+handoverData.ObjectId AS HandoverId,
+measurementTypes.MeasurementName,
+measurementTypes.MeasurementClassName
 
 FROM vro.vroObjectLinkObject linkingMLs
 
 /* MLs or samples linking to measurements */
 JOIN vro.vroObjectInfo measurementData ON measurementData.ObjectId = linkingMLs.LinkedObjectId
 JOIN vro.vroObjectInfo sampleData ON sampleData.ObjectId = linkingMLs.ObjectId
+/* Names and classes of the measurement types, see measurement_types in materialization.py */
+JOIN {measurement_types} measurementTypes (TypeId, MeasurementName, MeasurementClassName) ON measurementTypes.TypeId = measurementData.TypeId
 
 /* Where there is an explicit handover -> measurement link */
 JOIN vro.vroObjectLinkObject linkingHandovers ON linkingHandovers.LinkedObjectId = measurementData.ObjectId
@@ -18,11 +18,23 @@ How to add a new mapping:
 How to run:
     - Call the run_mappings function
 """
+import gzip
+import hashlib
+import json
 import logging
-import multiprocessing
+import math
+import queue
+import re
+import shutil
 import sys
+import threading
 import time
+import uuid
+import xml.etree.ElementTree as ET
 from concurrent.futures import as_completed, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import cache
 from pathlib import Path
 from typing import final
 
@@ -32,8 +44,17 @@ from tqdm import tqdm
 import os
 import subprocess
 
-from datastores.sql.sql_db import MSSQLDB
-from .fill_template_values import fill_template_values
+from datastores.rdf import rdf_datastore_client
+from datastores.sql.sql_db import MSSQLDB, showplan_namespace
+from monitoring.resource_sampler import MonitoredService, ResourceSampler
+from . import stage_cache
+from .canonical_output import canonicalize_triples
+from .fill_template_values import fill_template_values, read_template
+from .incremental_materialization import (IncrementalRun, get_referenced_tables, get_table_fingerprints,
+                                          restrict_jobs_to_affected_objects)
+from .python_engine import compile_mappings, run_python_engine
+from .staging_tables import (create_staging_tables, drop_staging_tables, get_referenced_staging_tables,
+                             get_staging_query, resolve_staging_tables)
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -66,6 +87,53 @@ ontology_files = [
 
 
 
+# Measurement types with their own characterization activity classes, as (name, TypeIds in the RDMS, class in the ontology)
+measurement_types: list[tuple[str, str, str]] = [
+    ("Photo", "12", "PhotoProcess"),
+    ("EDX", "13, 15, 19, 53, 78, 79", "EDXMicroscopyProcess"),
+    ("XRD", "17, 31, 44, 55, 56, 97", "XRDProcess"),
+    ("XPS", "30", "XPSProcess"),
+    ("Annealing", "18", "AnnealingProcess"),
+    ("LEIS", "48", "LEISProcess"),
+    ("Thickness", "27, 38, 39, 40", "ThicknessProcess"),
+    ("SEM", "24", "SEMProcess"),
+    ("Resistance", "14, 16, 33", "ResistanceProcess"),
+    ("Bandgap", "41, 80, 81, 82", "BandgapProcess"),
+    ("APT", "20", "APTProcess"),
+    ("TEM", "26", "TEMProcess"),
+    ("SDC", "57, 58, 85", "SDCProcess"),
+    ("SECCM", "50, 59, 60, 86, 87", "SECCMProcess"),
+    ("FIM", "47", "FIMProcess"),
+    ("PSM", "147", "PSMProcess"),
+    ("Report", "96, 98, 107, 139", "ReportProcess"),
+]
+
+# TypeId -> (name, class) lookup, as an SQL derived table joined by the activity mappings queries
+measurement_types_lookup = "(VALUES " + ", ".join(f"({type_id}, '{name}', '{class_name}')"
+                                                   for (name, type_ids, class_name) in measurement_types
+                                                   for type_id in type_ids.split(", ")) + ")"
+
+# Templates replicating the activity mappings for each measurement type
+measurement_type_sql_templates = {
+    "{measurement_ids}": [type_ids for (_, type_ids, _) in measurement_types],
+    "{measurement_types}": [measurement_types_lookup] * len(measurement_types)
+}
+measurement_type_yml_templates = {
+    "{measurement_name}": [name for (name, _, _) in measurement_types],
+    "{measurement_class_name}": [class_name for (_, _, class_name) in measurement_types]
+}
+
+# Templates for running each activity mapping only once for all measurement types, taking their names and classes from
+# the lookup instead (see prepare_YARRRML_files)
+typed_measurement_type_sql_templates = {
+    "{measurement_ids}": [", ".join(type_ids for (_, type_ids, _) in measurement_types)],
+    "{measurement_types}": [measurement_types_lookup]
+}
+typed_measurement_type_yml_templates = {
+    "{measurement_name}": ["$(MeasurementName)"],
+    "{measurement_class_name}": ["$(MeasurementClassName)"]
+}
+
 # List of mappings to execute
 # Each entry consists of either of the two:
 #   - A simple mapping, indicated as a tuple of (path_to_untemplated_file, use_rmlstreamer)
@@ -103,267 +171,13 @@ templated_file_names : list[tuple[str, bool]] | list[tuple[str, dict[str, str],
                             (os.path.join(module_dir, "mappings/handovers/initial_work_handover_to_first_handover_templated.yml"), False),
 
                             (os.path.join(module_dir, "mappings/handovers/activities/activities_templated.yml"),
-
-                            # SQL templates
-                            {
-                                "{measurement_ids}": [
-                                    "12",
-                                    "13, 15, 19, 53, 78, 79",
-                                    "17, 31, 44, 55, 56, 97",
-                                    "30",
-                                    "18",
-                                    "48",
-                                    "27, 38, 39, 40",
-                                    "24",
-                                    "14, 16, 33",
-                                    "41, 80, 81, 82",
-                                    "20",
-                                    "26",
-                                    "57, 58, 85",
-                                    "50, 59, 60, 86, 87",
-                                    "47",
-                                    "147",
-                                    "96, 98, 107, 139"
-                                ]
-                            },
-
-                            # Additional YARRRML templates
-                            {
-                                "{measurement_name}": [
-                                    "Photo",
-                                    "EDX",
-                                    "XRD",
-                                    "XPS",
-                                    "Annealing",
-                                    "LEIS",
-                                    "Thickness",
-                                    "SEM",
-                                    "Resistance",
-                                    "Bandgap",
-                                    "APT",
-                                    "TEM",
-                                    "SDC",
-                                    "SECCM",
-                                    "FIM",
-                                    "PSM",
-                                    "Report"
-                                ],
-                                "{measurement_class_name}": [
-                                    "PhotoProcess",
-                                    "EDXMicroscopyProcess",
-                                    "XRDProcess",
-                                    "XPSProcess",
-                                    "AnnealingProcess",
-                                    "LEISProcess",
-                                    "ThicknessProcess",
-                                    "SEMProcess",
-                                    "ResistanceProcess",
-                                    "BandgapProcess",
-                                    "APTProcess",
-                                    "TEMProcess",
-                                    "SDCProcess",
-                                    "SECCMProcess",
-                                    "FIMProcess",
-                                    "PSMProcess",
-                                    "ReportProcess"
-                                ]
-                            }, False),
+                             measurement_type_sql_templates, measurement_type_yml_templates, False),
                             (os.path.join(module_dir, "mappings/handovers/activities/activities_prior_to_first_handover_templated.yml"),
-                            # SQL templates
-                            {
-                                "{measurement_ids}": [
-                                    "12",
-                                    "13, 15, 19, 53, 78, 79",
-                                    "17, 31, 44, 55, 56, 97",
-                                    "30",
-                                    "18",
-                                    "48",
-                                    "27, 38, 39, 40",
-                                    "24",
-                                    "14, 16, 33",
-                                    "41, 80, 81, 82",
-                                    "20",
-                                    "26",
-                                    "57, 58, 85",
-                                    "50, 59, 60, 86, 87",
-                                    "47",
-                                    "147",
-                                    "96, 98, 107, 139"
-                                ]
-                            },
-
-                            # Additional YARRRML templates
-                            {
-                                "{measurement_name}": [
-                                    "Photo",
-                                    "EDX",
-                                    "XRD",
-                                    "XPS",
-                                    "Annealing",
-                                    "LEIS",
-                                    "Thickness",
-                                    "SEM",
-                                    "Resistance",
-                                    "Bandgap",
-                                    "APT",
-                                    "TEM",
-                                    "SDC",
-                                    "SECCM",
-                                    "FIM",
-                                    "PSM",
-                                    "Report"
-                                ],
-                                "{measurement_class_name}": [
-                                    "PhotoProcess",
-                                    "EDXMicroscopyProcess",
-                                    "XRDProcess",
-                                    "XPSProcess",
-                                    "AnnealingProcess",
-                                    "LEISProcess",
-                                    "ThicknessProcess",
-                                    "SEMProcess",
-                                    "ResistanceProcess",
-                                    "BandgapProcess",
-                                    "APTProcess",
-                                    "TEMProcess",
-                                    "SDCProcess",
-                                    "SECCMProcess",
-                                    "FIMProcess",
-                                    "PSMProcess",
-                                    "ReportProcess"
-                                ]
-                            }, False),
+                             measurement_type_sql_templates, measurement_type_yml_templates, False),
                             (os.path.join(module_dir, "mappings/handovers/activities/activities_with_no_handovers_templated.yml"),
-                            # SQL templates
-                            {
-                                "{measurement_ids}": [
-                                    "12",
-                                    "13, 15, 19, 53, 78, 79",
-                                    "17, 31, 44, 55, 56, 97",
-                                    "30",
-                                    "18",
-                                    "48",
-                                    "27, 38, 39, 40",
-                                    "24",
-                                    "14, 16, 33",
-                                    "41, 80, 81, 82",
-                                    "20",
-                                    "26",
-                                    "57, 58, 85",
-                                    "50, 59, 60, 86, 87",
-                                    "47",
-                                    "147",
-                                    "96, 98, 107, 139"
-                                ]
-                            },
-
-                            # Additional YARRRML templates
-                            {
-                                "{measurement_name}": [
-                                    "Photo",
-                                    "EDX",
-                                    "XRD",
-                                    "XPS",
-                                    "Annealing",
-                                    "LEIS",
-                                    "Thickness",
-                                    "SEM",
-                                    "Resistance",
-                                    "Bandgap",
-                                    "APT",
-                                    "TEM",
-                                    "SDC",
-                                    "SECCM",
-                                    "FIM",
-                                    "PSM",
-                                    "Report"
-                                ],
-                                "{measurement_class_name}": [
-                                    "PhotoProcess",
-                                    "EDXMicroscopyProcess",
-                                    "XRDProcess",
-                                    "XPSProcess",
-                                    "AnnealingProcess",
-                                    "LEISProcess",
-                                    "ThicknessProcess",
-                                    "SEMProcess",
-                                    "ResistanceProcess",
-                                    "BandgapProcess",
-                                    "APTProcess",
-                                    "TEMProcess",
-                                    "SDCProcess",
-                                    "SECCMProcess",
-                                    "FIMProcess",
-                                    "PSMProcess",
-                                    "ReportProcess"
-                                ]
-                            }, False),
-
+                             measurement_type_sql_templates, measurement_type_yml_templates, False),
                             (os.path.join(module_dir, "mappings/handovers/activities/measurements_with_explicit_links_to_handovers_templated.yml"),
-                            # SQL templates
-                            {
-                                "{measurement_ids}": [
-                                    "12",
-                                    "13, 15, 19, 53, 78, 79",
-                                    "17, 31, 44, 55, 56, 97",
-                                    "30",
-                                    "18",
-                                    "48",
-                                    "27, 38, 39, 40",
-                                    "24",
-                                    "14, 16, 33",
-                                    "41, 80, 81, 82",
-                                    "20",
-                                    "26",
-                                    "57, 58, 85",
-                                    "50, 59, 60, 86, 87",
-                                    "47",
-                                    "147",
-                                    "96, 98, 107, 139"
-                                ]
-                            },
-
-                            # Additional YARRRML templates
-                            {
-                                "{measurement_name}": [
-                                    "Photo",
-                                    "EDX",
-                                    "XRD",
-                                    "XPS",
-                                    "Annealing",
-                                    "LEIS",
-                                    "Thickness",
-                                    "SEM",
-                                    "Resistance",
-                                    "Bandgap",
-                                    "APT",
-                                    "TEM",
-                                    "SDC",
-                                    "SECCM",
-                                    "FIM",
-                                    "PSM",
-                                    "Report"
-                                ],
-                                "{measurement_class_name}": [
-                                    "PhotoProcess",
-                                    "EDXMicroscopyProcess",
-                                    "XRDProcess",
-                                    "XPSProcess",
-                                    "AnnealingProcess",
-                                    "LEISProcess",
-                                    "ThicknessProcess",
-                                    "SEMProcess",
-                                    "ResistanceProcess",
-                                    "BandgapProcess",
-                                    "APTProcess",
-                                    "TEMProcess",
-                                    "SDCProcess",
-                                    "SECCMProcess",
-                                    "FIMProcess",
-                                    "PSMProcess",
-                                    "ReportProcess"
-                                ]
-                            }, False),
+                             measurement_type_sql_templates, measurement_type_yml_templates, False),
 
                             (os.path.join(module_dir, "mappings/handovers/activities/activities_for_other_types_templated.yml"), False),
                             (os.path.join(module_dir, "mappings/handovers/activities/activities_for_other_types_prior_to_first_handover_templated.yml"), False),
@@ -383,41 +197,60 @@ templated_file_names : list[tuple[str, bool]] | list[tuple[str, dict[str, str],
 # RML file all the YARRRML mappings must coalesce to
 final_RML_file_path = os.path.join(module_dir, 'mappings/final_RML_file.rml')
 materialized_triples_file_path = os.path.join(module_dir, 'materialized_triples/materialized_triples.ttl')
-rmlstreamer_path = os.path.join(module_dir, 'materialized_triples')
-
-
-def resource_usage_job(stop_event, resource_usage):
-    while not stop_event.is_set():
-        cpu = psutil.cpu_percent(interval=1)
-        psutil.cpu_stats()
-
-        used_mem = {
-            "used_mem_per_file": {},
-            "sql_server": 0
-        }
-        for proc in psutil.process_iter(['cmdline', 'memory_info']):
-            try:
-                cmd = proc.info['cmdline']
-                if not cmd:
-                    continue
-                elif "sqlservr" in " ".join(cmd):
-                    used_mem["sql_server"] = proc.info['memory_info'].rss
-
-                elif "rmlmapper.jar" in " ".join(cmd):
-                    out_idx = cmd.index("-o") + 1
-                    output_file = cmd[out_idx]
-                    used_mem["used_mem_per_file"][Path(output_file).stem] = proc.info['memory_info'].rss
-
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-
-        resource_usage.append((cpu, used_mem))
-
-
-def prepare_YARRRML_files() -> list[tuple[str, str, str]]:
+# Subject and predicate of a line of RMLMapper/RMLStreamer output (see attribute_output_to_mappings)
+output_triple_pattern = re.compile(rb"^<([^>]*)>\s+<([^>]*)>")
+
+# Cache of YARRRML to RML conversions, see create_rml_file
+rml_cache_path = os.path.join(module_dir, 'mappings/rml_cache')
+CSV_SOURCE_PLACEHOLDER = "__csv_source_{i}__"
+csv_access_pattern = re.compile(r"^(\s*access:\s*)(\S+\.csv)\s*$", re.MULTILINE)
+
+# Parallel RMLMapper execution: minimum heap each RMLMapper job should have, which bounds the number of parallel jobs
+# together with the number of cores
+MIN_HEAP_PER_RML_JOB_GB = 2
+
+# Cost-based choice of engine and heap for each RML job (see plan_rml_job). RMLMapper keeps every generated triple in
+# memory to deduplicate them, so its heap grows with the number of triples. Jobs predicted to generate more triples than
+# RMLSTREAMER_MIN_TRIPLES, or not fitting in the heap available, are run with RMLStreamer instead
+RMLMAPPER_HEAP_BYTES_PER_TRIPLE = 1024
+RMLSTREAMER_MIN_TRIPLES = 50_000_000
+RMLSTREAMER_HEAP_GB = 4
+
+# Mappings whose queries may be split into independent shards (see shard_jobs), alongside the ObjectId column used to
+# assign each row to a shard. They produce the bulk of the triples, so splitting them lets them scale with the cores
+sharded_mappings: dict[str, str] = {
+    os.path.join(module_dir, "mappings/compositions/compositions_metadata.yml"): "CompositionId",
+    os.path.join(module_dir, "mappings/compositions/activities_for_compositions.yml"): "CompositionId",
+    os.path.join(module_dir, "mappings/compositions/activities_for_compositions_prior_to_first_handover.yml"): "CompositionId",
+    os.path.join(module_dir, "mappings/compositions/activities_for_compositions_with_no_handovers.yml"): "CompositionId",
+    os.path.join(module_dir, "mappings/compositions/properties_of_compositions.yml"): "CompositionId",
+}
+
+# Pipelined execution (see execute_mappings_pipelined): maximum number of finished CSV files or output files waiting
+# for the next stage, which bounds the disk usage, and maximum number of output files loaded into the datastore at once
+PIPELINE_QUEUE_SIZE = 8
+PIPELINE_UPLOAD_BATCH_SIZE = 8
+
+# gzip level of the compressed output files. Low levels are several times faster than the default one, and compress
+# the (very repetitive) triples almost as much
+OUTPUT_COMPRESSION_LEVEL = 3
+
+# Rows each shard of a sharded mapping should roughly contain
+ROWS_PER_SHARD = 250_000
+# A failed shard (query, conversion or materialization) is retried from scratch up to this number of attempts
+SHARD_MAX_ATTEMPTS = 3
+
+
+def prepare_YARRRML_files(add_prefixes_to_all_files: bool = False,
+                          typed_activity_mappings: bool = False) -> list[tuple[str, str, str]]:
     """
     Fills and writes all untemplated YARRRML files
 
+    :param add_prefixes_to_all_files: Whether every YARRRML file should contain the prefixes, instead of only the first one.
+                                      Required if the files are not coalesced into one single RML file
+    :param typed_activity_mappings: Instead of replicating the activity mappings for each measurement type, run each of
+                                    them once for all types, taking their names and classes from the TypeId lookup
+
     Returns a list of (untemplated YARRRML file path, SQL query to execute, CSV file path to store the SQL query results in)
     """
     untemplated_yarrrml_file_names_and_jobs = []
@@ -430,6 +263,10 @@ def prepare_YARRRML_files() -> list[tuple[str, str, str]]:
         else:
             (templated_yarrrml_file, custom_sql_template, custom_yml_template, use_rmlstreamer) = mapping
 
+            if typed_activity_mappings and custom_sql_template is measurement_type_sql_templates:
+                custom_sql_template = typed_measurement_type_sql_templates
+                custom_yml_template = typed_measurement_type_yml_templates
+
         untemplated_base_yarrrml_file = templated_yarrrml_file.replace("_templated", "")
         untemplated_yarrrml_file_names_and_jobs += fill_template_values(templated_yml=templated_yarrrml_file,
                                                                         output_file_name=untemplated_base_yarrrml_file,
@@ -437,18 +274,149 @@ def prepare_YARRRML_files() -> list[tuple[str, str, str]]:
                                                                         custom_yml_template=custom_yml_template,
                                                                         convert_to_csv=True,
                                                                         # We only add prefixes to the first mapping
-                                                                        add_prefixes= i == 0)
+                                                                        add_prefixes= i == 0 or add_prefixes_to_all_files)
 
     return untemplated_yarrrml_file_names_and_jobs
 
 
-def create_rml_file(untemplated_yarrrml_file_paths: list[str]):
+def get_templating_fingerprint(add_prefixes_to_all_files: bool = False,
+                               typed_activity_mappings: bool = False) -> str:
+    """
+    Returns a fingerprint of the inputs of prepare_YARRRML_files: the templated YARRRML files, their SQL queries,
+    prefixes.yml and the template replacements (see stage_cache.py)
+    """
+    parts = [read_template(os.path.join(module_dir, 'prefixes.yml')),
+             json.dumps([add_prefixes_to_all_files, typed_activity_mappings])]
+    for mapping in templated_file_names:
+        templated_yarrrml_file = mapping[0]
+        parts += [read_template(templated_yarrrml_file),
+                  read_template(templated_yarrrml_file.replace("_templated", "").replace(".yml", ".sql")),
+                  json.dumps(mapping[1:], sort_keys=True)]
+    parts.append(json.dumps([measurement_type_sql_templates, measurement_type_yml_templates,
+                             typed_measurement_type_sql_templates, typed_measurement_type_yml_templates], sort_keys=True))
+
+    return stage_cache.fingerprint(*parts)
+
+
+def get_sql_fingerprint(db: MSSQLDB,
+                        templating_fingerprint: str,
+                        untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]],
+                        run_parameters: str) -> str:
+    """
+    Returns a fingerprint of the inputs of the queries: the queries themselves, the staging queries they reference and
+    the contents of every table they read (see incremental_materialization.get_table_fingerprints and stage_cache.py)
+    """
+    queries = [query for (_, query, _) in untemplated_yarrrml_file_names_and_jobs]
+    staging_queries = [get_staging_query(name) for name in get_referenced_staging_tables(queries)]
+    table_fingerprints = get_table_fingerprints(db, get_referenced_tables(queries + staging_queries))
+
+    return stage_cache.fingerprint(templating_fingerprint,
+                                   run_parameters,
+                                   *queries,
+                                   *staging_queries,
+                                   json.dumps(table_fingerprints, sort_keys=True))
+
+
+def get_mapping_fingerprint(templating_fingerprint: str,
+                            yarrrml_and_csv_files: list[tuple[str, str]],
+                            run_parameters: str) -> str:
+    """
+    Returns a fingerprint of the inputs of the mappings: the YARRRML files (and thus their RML conversion), the version
+    of the YARRRML parser and the CSV files the queries yielded (see stage_cache.py)
+
+    :param yarrrml_and_csv_files: List of (YARRRML file path, CSV file path) of the mappings to execute
+    """
+    parts = []
+    for (yarrrml_file, csv_file) in sorted(yarrrml_and_csv_files):
+        with open(yarrrml_file, 'r') as f:
+            parts.append(f.read())
+        parts.append(stage_cache.hash_file(csv_file))
+
+    return stage_cache.fingerprint(templating_fingerprint, run_parameters, get_yarrrml_parser_version(), *parts)
+
+
+@cache
+def get_yarrrml_parser_version() -> str:
+    """
+    Returns an identifier of the YARRRML parser in use: the image ID of the Docker image, or the version of the npm package
+    """
+    if os.environ.get('IN_DOCKER_DEPLOYMENT', False):
+        cmd = ["yarrrml-parser", "--version"]
+    else:
+        cmd = ["docker", "image", "inspect", "--format", "{{.Id}}", "rmlio/yarrrml-parser:latest"]
+
+    try:
+        return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        # E.g. the image has not been pulled yet. It will be once the parser runs, so it should not be cached
+        return ""
+
+
+def create_rml_file(untemplated_yarrrml_file_paths: list[str],
+                    rml_file_path: str = final_RML_file_path):
     """
     Coalesces a list of valid YARRRML file paths into a single RML file
 
-    The result will be written to `final_RML_file_path`
+    The result will be written to `rml_file_path`, which must be located inside the mappings folder
+
+    Conversions are cached in `rml_cache_path`, keyed by the content of the YARRRML files and the version of the parser.
+    The paths of the CSV sources are replaced by placeholders before converting them, so that they do not invalidate
+    the cache, and filled into the cached RML file afterwards
     """
+    csv_sources = []
+
+    def replace_csv_source(match: re.Match) -> str:
+        csv_sources.append(match.group(2))
+        return f"{match.group(1)}{CSV_SOURCE_PLACEHOLDER.replace('{i}', str(len(csv_sources) - 1))}"
 
+    normalized_yarrrml_contents = []
+    for f in untemplated_yarrrml_file_paths:
+        with open(f, 'r') as yarrrml_file:
+            normalized_yarrrml_contents.append(csv_access_pattern.sub(replace_csv_source, yarrrml_file.read()))
+
+    parser_version = get_yarrrml_parser_version()
+
+    content_hash = hashlib.sha256(parser_version.encode())
+    for content in normalized_yarrrml_contents:
+        content_hash.update(content.encode())
+    cached_rml_file_path = os.path.join(rml_cache_path, f"{content_hash.hexdigest()}.rml")
+
+    if not os.path.exists(cached_rml_file_path) or parser_version == "":
+        logging.info("YARRRML mappings not found in the RML cache, converting them...")
+        os.makedirs(rml_cache_path, exist_ok=True)
+
+        normalized_yarrrml_file_paths = []
+        for f, content in zip(untemplated_yarrrml_file_paths, normalized_yarrrml_contents):
+            normalized_yarrrml_file_path = f.replace(".yml", "_normalized.yml")
+            with open(normalized_yarrrml_file_path, 'w') as normalized_yarrrml_file:
+                normalized_yarrrml_file.write(content)
+            normalized_yarrrml_file_paths.append(normalized_yarrrml_file_path)
+
+        # Parallel jobs may convert the same files at the same time, only complete conversions are moved to the cache
+        temporary_rml_file_path = cached_rml_file_path.replace(".rml", f"_{uuid.uuid4().hex}.rml")
+        try:
+            convert_yarrrml_to_rml(normalized_yarrrml_file_paths, temporary_rml_file_path)
+            os.replace(temporary_rml_file_path, cached_rml_file_path)
+        finally:
+            for normalized_yarrrml_file_path in normalized_yarrrml_file_paths:
+                os.remove(normalized_yarrrml_file_path)
+
+    with open(cached_rml_file_path, 'r') as cached_rml_file:
+        rml = cached_rml_file.read()
+
+    for i, csv_source in enumerate(csv_sources):
+        rml = rml.replace(CSV_SOURCE_PLACEHOLDER.replace('{i}', str(i)), csv_source)
+
+    with open(rml_file_path, 'w') as f:
+        f.write(rml)
+
+
+def convert_yarrrml_to_rml(untemplated_yarrrml_file_paths: list[str],
+                           rml_file_path: str):
+    """
+    Runs the YARRRML parser over a list of YARRRML files, writing the resulting RML file to `rml_file_path`. Both must
+    be located inside the mappings folder
+    """
     if os.environ.get('IN_DOCKER_DEPLOYMENT', False):
         # If we are in a docker deployment, assume we have it installed via npm (npm i -g @rmlio/yarrrml-parser)
         yarrrml_to_rml_cmd = [
@@ -457,7 +425,7 @@ def create_rml_file(untemplated_yarrrml_file_paths: list[str]):
 
         for f in untemplated_yarrrml_file_paths:
             yarrrml_to_rml_cmd += ["-i", f]
-        yarrrml_to_rml_cmd += ["-o", final_RML_file_path]
+        yarrrml_to_rml_cmd += ["-o", rml_file_path]
     else:
         yarrrml_to_rml_cmd = [
             "docker", "run", "--rm",
@@ -468,7 +436,7 @@ def create_rml_file(untemplated_yarrrml_file_paths: list[str]):
 
         for f in untemplated_yarrrml_file_paths:
             yarrrml_to_rml_cmd += ["-i", f.replace(os.path.join(module_dir, 'mappings/'), "/data/")]
-        yarrrml_to_rml_cmd += ["-o", final_RML_file_path.replace(os.path.join(module_dir, 'mappings/'), "/data/")]
+        yarrrml_to_rml_cmd += ["-o", rml_file_path.replace(os.path.join(module_dir, 'mappings/'), "/data/")]
 
     try:
         subprocess.run(yarrrml_to_rml_cmd,
@@ -482,84 +450,811 @@ def create_rml_file(untemplated_yarrrml_file_paths: list[str]):
 
 
 def run_mappings_queries(db: MSSQLDB,
-                         untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]]):
+                         untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]]) -> tuple[list[str],
+                                                                                                   dict[str, dict[str, int]],
+                                                                                                   dict[str, float]]:
     """
     Runs the SQL queries corresponding to each mapping in parallel, and saves the results to CSV files
 
     :param db: DB instance to run the queries against
     :param untemplated_yarrrml_file_names_and_jobs: List of (_, SQL query to execute, CSV file path to store the SQL query results in), obtained via `prepare_YARRRML_files()`.
-    """
-    sql_query_jobs = [(query, output_csv_file_path) for (_, query, output_csv_file_path) in untemplated_yarrrml_file_names_and_jobs]
 
-    # To keep track of which query was being executed by the (unordered) finishing jobs
-    sql_query_to_yarrrml_file_path = {query: f for (f, query, _) in untemplated_yarrrml_file_names_and_jobs}
+    :return: Tuple containing:
+                - The YARRRML files whose queries yielded results
+                - A dict of CSV file name -> {"rows": rows written, "bytes": bytes written}, for the queries that yielded results
+                - A dict of YARRRML file name -> time spent executing its query and writing its CSV file (in s.)
+    """
+    def timed_query_to_csv(yarrrml_file: str, query: str, output_csv_file_path: str):
+        start = time.perf_counter()
+        result = db.query_to_csv(query, output_csv_file_path)
+        return yarrrml_file, result, time.perf_counter() - start
 
     yarrrml_files_to_convert = []
+    csv_export_sizes = dict()
+    query_times = dict()
 
     with ThreadPoolExecutor(os.cpu_count()) as executor:
         futures = []
 
-        for (query, output_csv_file_path) in sql_query_jobs:
-            futures.append(executor.submit(db.query_to_csv, query, output_csv_file_path))
+        for (yarrrml_file, query, output_csv_file_path) in untemplated_yarrrml_file_names_and_jobs:
+            futures.append(executor.submit(timed_query_to_csv, yarrrml_file, query, output_csv_file_path))
 
         with tqdm(total=len(futures), desc="SQL queries executed", leave=True) as pbar:
             for future in as_completed(futures):
-                (yielded_results, query) = future.result()
+                (yarrrml_file, (yielded_results, _, rows_written, bytes_written), query_time) = future.result()
+                query_times[Path(yarrrml_file).stem] = query_time
                 if yielded_results:
-                    yarrrml_files_to_convert.append(sql_query_to_yarrrml_file_path[query])
+                    yarrrml_files_to_convert.append(yarrrml_file)
+                    csv_export_sizes[Path(yarrrml_file).stem] = {"rows": rows_written, "bytes": bytes_written}
                 # Else: we don't do anything for that mapping
 
                 pbar.update(1)
 
-    return yarrrml_files_to_convert
+    return yarrrml_files_to_convert, csv_export_sizes, query_times
 
 
-def execute_mappings(use_rmlstreamer: bool = False):
+def execute_mappings(use_rmlstreamer: bool = False,
+                     rml_file_path: str = final_RML_file_path,
+                     output_file_path: str = materialized_triples_file_path,
+                     max_heap: int | None = None):
     """
-    Runs RMLMapper or RMLStreamer over `final_RML_file_path`, writing the results to `materialized_triples_file_path`
+    Runs RMLMapper or RMLStreamer over `rml_file_path`, writing the results to `output_file_path`
+
+    :param max_heap: Maximum heap of the JVM, in GB. Defaults to half of the system's RAM
     """
-    # Let's be generous and offer it half of the system's RAM
-    max_heap = int(psutil.virtual_memory().total * 0.5 / (1024 ** 3))
+    if max_heap is None:
+        # Let's be generous and offer it half of the system's RAM
+        max_heap = get_total_rml_heap()
 
     if not use_rmlstreamer:
         cmd = [
             "java",
             f"-Xmx{max_heap}g",
             "-cp", f"{os.path.join(module_dir, 'rmlmapper.jar:sqljdbc')}", "be.ugent.rml.cli.Main",
-            "-m", final_RML_file_path,
-            "-o", materialized_triples_file_path
+            "-m", rml_file_path,
+            "-o", output_file_path
         ]
 
     else:
+        # RMLStreamer writes one file per task into a folder, coalesced into output_file_path afterwards
+        rmlstreamer_output_path = output_file_path.replace(".ttl", "_rmlstreamer")
         cmd = [
-            "java", "-jar", os.path.join(module_dir, 'RMLStreamer.jar'), "toFile",
-            "-m", final_RML_file_path,
-            "-o", rmlstreamer_path
+            "java",
+            f"-Xmx{max_heap}g",
+            "-jar", os.path.join(module_dir, 'RMLStreamer.jar'), "toFile",
+            "-m", rml_file_path,
+            "-o", rmlstreamer_output_path
         ]
 
-        with open(materialized_triples_file_path, 'wb') as outfile:
-            for filename in sorted(os.listdir(rmlstreamer_path)):
-                file_path = os.path.join(rmlstreamer_path, filename)
-
-                if os.path.isfile(file_path) and file_path != os.path.abspath(materialized_triples_file_path):
-                    with open(file_path, 'rb') as infile:
-                        outfile.write(infile.read())
-                    os.remove(file_path)
-
-
     try:
         subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, text=True).check_returncode()
     except subprocess.CalledProcessError as e:
-        logging.error(f"RMLMapper materialization process failed with return code {e.returncode}")
+        logging.error(f"{"RMLStreamer" if use_rmlstreamer else "RMLMapper"} materialization process failed with return code {e.returncode}")
         logging.error(f"Error output:\n{e.stderr}")
         raise
 
+    if use_rmlstreamer:
+        if os.path.isdir(rmlstreamer_output_path):
+            with open(output_file_path, 'wb') as outfile:
+                for filename in sorted(os.listdir(rmlstreamer_output_path)):
+                    file_path = os.path.join(rmlstreamer_output_path, filename)
+
+                    if os.path.isfile(file_path):
+                        with open(file_path, 'rb') as infile:
+                            shutil.copyfileobj(infile, outfile)
+            shutil.rmtree(rmlstreamer_output_path)
+        else:
+            os.replace(rmlstreamer_output_path, output_file_path)
+
+
+def count_triples(output_file_path: str) -> int:
+    """
+    Returns the number of triples of an output file. Both RMLMapper and RMLStreamer write N-Quads, one per line
+    """
+    number_of_triples = 0
+    with open(output_file_path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            number_of_triples += chunk.count(b"\n")
+    return number_of_triples
+
+
+def attribute_output_to_mappings(untemplated_yarrrml_file_paths: list[str],
+                                 output_file_path: str = materialized_triples_file_path) -> dict[str, dict[str, float]]:
+    """
+    Attributes the triples of an RML job that ran several mappings to each of them, by matching the subject and
+    predicate of every line of its output against the subject and predicate templates of the mappings. Triples matching
+    several mappings (e.g. replicas of the same templated mapping) are split evenly among them
+
+    :returns: dict of YARRRML file name -> {"triples": triples attributed to it, "output_bytes": bytes of those triples}
+    """
+    # (file name, subject pattern, constant predicates, predicate patterns) of every YARRRML mapping
+    compiled_mappings = []
+    for yarrrml_file in untemplated_yarrrml_file_paths:
+        for (subject_template, predicate_objects) in compile_mappings(yarrrml_file):
+            constant_predicates, predicate_patterns = set(), []
+            for (predicate_template, _, _) in predicate_objects:
+                if any(is_reference for (is_reference, _) in predicate_template.parts):
+                    predicate_patterns.append(predicate_template.pattern())
+                else:
+                    constant_predicates.add(predicate_template.fill(dict()))
+            compiled_mappings.append((Path(yarrrml_file).stem, subject_template.pattern(), constant_predicates, predicate_patterns))
+
+    attributed = {Path(yarrrml_file).stem: {"triples": 0.0, "output_bytes": 0.0} for yarrrml_file in untemplated_yarrrml_file_paths}
+
+    # Mappings write every triple of a subject together, so the mappings matching the last subject are reused
+    last_subject, subject_mappings = None, []
+    with open(output_file_path, 'rb') as f:
+        for line in f:
+            match = output_triple_pattern.match(line)
+            if match is None:
+                continue
+
+            subject, predicate = match.group(1).decode("utf-8"), match.group(2).decode("utf-8")
+            if subject != last_subject:
+                last_subject = subject
+                subject_mappings = [(name, constant_predicates, predicate_patterns)
+                                    for (name, subject_pattern, constant_predicates, predicate_patterns) in compiled_mappings
+                                    if subject_pattern.fullmatch(subject)]
+
+            names = {name for (name, constant_predicates, predicate_patterns) in subject_mappings
+                     if predicate in constant_predicates or any(pattern.fullmatch(predicate) for pattern in predicate_patterns)}
+            for name in names:
+                attributed[name]["triples"] += 1 / len(names)
+                attributed[name]["output_bytes"] += len(line) / len(names)
+
+    return {name: {"triples": round(sizes["triples"]), "output_bytes": round(sizes["output_bytes"])}
+            for name, sizes in attributed.items()}
+
+
+def run_rml_job(job_id: int | str,
+                untemplated_yarrrml_file_paths: list[str],
+                max_heap: int,
+                use_rmlstreamer: bool = False) -> tuple[str, dict[str, float]]:
+    """
+    Converts a group of YARRRML files to their own RML file and executes it with RMLMapper (or RMLStreamer), writing
+    its triples to its own output shard
+
+    :returns: (output shard path, dict of time_measurement_identifier -> time measurement (in s.), alongside the
+               "triples" and "output_bytes" of the output shard)
+    """
+    times = dict()
+    rml_file_path = final_RML_file_path.replace(".rml", f"_{job_id}.rml")
+    output_file_path = materialized_triples_file_path.replace(".ttl", f"_{job_id}.ttl")
+
+    start = time.perf_counter()
+    create_rml_file(untemplated_yarrrml_file_paths, rml_file_path)
+    times["yarrrml_to_rml_conversion"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    execute_mappings(use_rmlstreamer, rml_file_path=rml_file_path, output_file_path=output_file_path, max_heap=max_heap)
+    times["materialization"] = time.perf_counter() - start
+
+    times["triples"] = count_triples(output_file_path)
+    times["output_bytes"] = os.path.getsize(output_file_path)
+
+    os.remove(rml_file_path)
+
+    return output_file_path, times
+
+
+def get_total_rml_heap() -> int:
+    """
+    Heap (in GB) available to all RML jobs together: half of the system's RAM
+    """
+    return max(1, int(psutil.virtual_memory().total * 0.5 / (1024 ** 3)))
+
+
+@dataclass
+class RMLJobPlan:
+    """
+    Engine and heap chosen for an RML job, based on the number of triples it is predicted to generate (see plan_rml_job)
+    """
+    number_of_rows: int
+    predicted_triples: int
+    use_rmlstreamer: bool
+    max_heap: int
+
+
+class HeapBudget:
+    """
+    Heap (in GB) shared by the RML jobs running at the same time. Each job reserves the heap planned for it, waiting
+    until enough of it is free, so that many small jobs can run at the same time while large ones still fit
+    """
+    def __init__(self, total_heap: int):
+        self.total_heap = total_heap
+        self.available_heap = total_heap
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, heap: int):
+        heap = min(heap, self.total_heap)
+        with self._condition:
+            self._condition.wait_for(lambda: self.available_heap >= heap)
+            self.available_heap -= heap
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.available_heap += heap
+                self._condition.notify_all()
+
+
+@cache
+def count_predicate_objects(untemplated_yarrrml_file_path: str) -> int:
+    """
+    Returns the number of triples a row of the mapping's source generates at most (i.e. its number of po entries)
+    """
+    return sum(len(predicate_objects) for (_, predicate_objects) in compile_mappings(untemplated_yarrrml_file_path))
+
+
+def plan_rml_job(untemplated_yarrrml_file_paths: list[str],
+                 csv_export_sizes: dict[str, dict[str, int]],
+                 total_heap: int) -> RMLJobPlan:
+    """
+    Predicts the number of triples an RML job will generate from the rows exported for each of its mappings and their
+    number of po entries, and chooses its engine and heap accordingly:
+        - RMLMapper, with a heap of MIN_HEAP_PER_RML_JOB_GB plus RMLMAPPER_HEAP_BYTES_PER_TRIPLE per predicted triple
+        - RMLStreamer, with a heap of RMLSTREAMER_HEAP_GB, if it exceeds RMLSTREAMER_MIN_TRIPLES or that heap would
+          not fit in total_heap
+
+    :param csv_export_sizes: Dict of YARRRML file name -> {"rows": rows written, ...}, as returned by run_mappings_queries
+    :param total_heap: Heap (in GB) available to all jobs
+    """
+    number_of_rows = 0
+    predicted_triples = 0
+    for yarrrml_file in untemplated_yarrrml_file_paths:
+        rows = csv_export_sizes.get(Path(yarrrml_file).stem, {}).get("rows", 0)
+        number_of_rows += rows
+        predicted_triples += rows * count_predicate_objects(yarrrml_file)
+
+    rmlmapper_heap = MIN_HEAP_PER_RML_JOB_GB + math.ceil(predicted_triples * RMLMAPPER_HEAP_BYTES_PER_TRIPLE / (1024 ** 3))
+
+    if predicted_triples > RMLSTREAMER_MIN_TRIPLES or rmlmapper_heap > total_heap:
+        return RMLJobPlan(number_of_rows, predicted_triples, True, min(RMLSTREAMER_HEAP_GB, total_heap))
+    return RMLJobPlan(number_of_rows, predicted_triples, False, rmlmapper_heap)
+
+
+def run_planned_rml_job(job_id: int | str,
+                        untemplated_yarrrml_file_paths: list[str],
+                        csv_export_sizes: dict[str, dict[str, int]],
+                        heap_budget: HeapBudget) -> tuple[str, dict[str, float], RMLJobPlan]:
+    """
+    Same as run_rml_job, but choosing the engine and heap of the job via plan_rml_job, and waiting for its heap to be
+    available in heap_budget
+
+    :returns: (output shard path, dict of time_measurement_identifier -> time measurement (in s.), plan of the job)
+    """
+    plan = plan_rml_job(untemplated_yarrrml_file_paths, csv_export_sizes, heap_budget.total_heap)
+
+    with heap_budget.reserve(plan.max_heap):
+        output_file_path, times = run_rml_job(job_id, untemplated_yarrrml_file_paths, plan.max_heap, plan.use_rmlstreamer)
+
+    return output_file_path, times, plan
+
+
+def get_rml_workers_and_heap(number_of_jobs: int, total_heap: int | None = None) -> tuple[int, int]:
+    """
+    Returns the number of RMLMapper jobs to run in parallel, bounded by both the number of cores and the memory available
+    (see MIN_HEAP_PER_RML_JOB_GB), and the heap (in GB) of each of them. Half of the system's RAM is split between them,
+    as in the monolithic execution
+
+    :param total_heap: Heap (in GB) to split between the jobs instead of half of the system's RAM
+    """
+    if total_heap is None:
+        total_heap = get_total_rml_heap()
+    max_workers = max(1, min(os.cpu_count(), number_of_jobs, int(total_heap // MIN_HEAP_PER_RML_JOB_GB)))
+    max_heap_per_job = max(1, int(total_heap / max_workers))
+
+    return max_workers, max_heap_per_job
+
+
+def execute_mappings_in_parallel(untemplated_yarrrml_file_paths: list[str],
+                                 files_per_job: int = 1,
+                                 csv_export_sizes: dict[str, dict[str, int]] | None = None,
+                                 total_heap: int | None = None) -> tuple[list[str],
+                                                                                                    dict[str, dict[str, float]],
+                                                                                                    dict[str, RMLJobPlan]]:
+    """
+    Runs one RMLMapper job for every group of files_per_job YARRRML files, on a pool of workers bounded by both the
+    number of cores and the memory available (see MIN_HEAP_PER_RML_JOB_GB). Half of the system's RAM is split between
+    the workers, as in the monolithic execution
+
+    :param csv_export_sizes: If provided, the engine and heap of each job are chosen from its predicted number of triples
+                             instead (see plan_rml_job), and jobs run as long as their heaps fit in half of the system's RAM
+    :param total_heap: Heap (in GB) available to all jobs instead of half of the system's RAM
+
+    :returns: (list of output shard paths,
+               dict of job name -> time_measurement_identifier -> time measurement (in s.),
+               dict of job name -> plan of its job, if csv_export_sizes was provided).
+              Jobs are named after their YARRRML file if files_per_job is 1, or numbered otherwise
+    """
+    groups = [untemplated_yarrrml_file_paths[i:i + files_per_job]
+              for i in range(0, len(untemplated_yarrrml_file_paths), files_per_job)]
+    if len(groups) == 0:
+        return [], dict(), dict()
+
+    if total_heap is None:
+        total_heap = get_total_rml_heap()
+
+    if csv_export_sizes is not None:
+        heap_budget = HeapBudget(total_heap)
+        max_workers = min(os.cpu_count(), len(groups))
+        logging.info(f"Running {len(groups)} RML jobs, up to {max_workers} at a time within {heap_budget.total_heap}GB of heap...")
+    else:
+        max_workers, max_heap_per_job = get_rml_workers_and_heap(len(groups), total_heap)
+        logging.info(f"Running {len(groups)} RMLMapper jobs, {max_workers} at a time with {max_heap_per_job}GB of heap each...")
+
+    # Jobs of a single file are named after it, so that their measurements can be told apart per mapping
+    job_ids = [Path(group[0]).stem if len(group) == 1 else job_id for (job_id, group) in enumerate(groups)]
+
+    output_file_paths = []
+    times_per_job = dict()
+    plans = dict()
+    with ThreadPoolExecutor(max_workers) as executor:
+        if csv_export_sizes is not None:
+            futures = {executor.submit(run_planned_rml_job, job_id, group, csv_export_sizes, heap_budget): job_id
+                       for (job_id, group) in zip(job_ids, groups)}
+        else:
+            futures = {executor.submit(run_rml_job, job_id, group, max_heap_per_job): job_id
+                       for (job_id, group) in zip(job_ids, groups)}
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="RMLMapper jobs executed", leave=True):
+            if csv_export_sizes is not None:
+                output_file_path, times, plan = future.result()
+                plans[str(futures[future])] = plan
+            else:
+                output_file_path, times = future.result()
+            output_file_paths.append(output_file_path)
+            times_per_job[str(futures[future])] = times
+
+    return sorted(output_file_paths), times_per_job, plans
+
+
+def estimate_row_count(db: MSSQLDB, query: str) -> int:
+    """
+    Returns the number of rows the optimizer estimates a query to yield (StatementEstRows of its last statement, see
+    MSSQLDB.get_estimated_plans). The query is only compiled: shards just need to be roughly sized, and counting its
+    rows would execute it one more time.
+
+    The remote DB cannot return execution plans, so its rows are counted instead
+    """
+    if db.is_remote:
+        return int(db.query_to_records(f"SELECT COUNT_BIG(*) AS numberOfRows FROM (\n{query}\n) countedQuery")[0]["numberOfRows"])
+
+    estimated_rows = 0.0
+    for plan in db.get_estimated_plans(query):
+        for statement in ET.fromstring(plan).iter(f"{{{showplan_namespace['sp']}}}StmtSimple"):
+            if statement.get("StatementEstRows") is not None:
+                estimated_rows = float(statement.get("StatementEstRows"))
+    return math.ceil(estimated_rows)
+
+
+def shard_jobs(db: MSSQLDB,
+               untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]]) -> tuple[list[tuple[str, str, str]],
+                                                                                         list[tuple[str, str, str]]]:
+    """
+    Splits the jobs of the mappings in sharded_mappings into shards of roughly ROWS_PER_SHARD rows (at most one per
+    core), based on the row count the optimizer estimates for their queries (see estimate_row_count). Each shard restricts
+    the query to the rows whose shard column modulo the number of shards equals its index, and gets its own copy of the
+    YARRRML file and CSV file, so that shards are independent of each other.
+
+    The YARRRML files must contain the prefixes (see prepare_YARRRML_files), as each shard is converted on its own.
+
+    :returns: (jobs that are not sharded, jobs of all shards), both as lists of (untemplated YARRRML file path, SQL query to execute, CSV file path)
+    """
+    unsharded_jobs = []
+    shards = []
+
+    for (yarrrml_file, query, csv_file) in untemplated_yarrrml_file_names_and_jobs:
+        shard_column = sharded_mappings.get(yarrrml_file)
+        if shard_column is None:
+            unsharded_jobs.append((yarrrml_file, query, csv_file))
+            continue
+
+        number_of_rows = estimate_row_count(db, query)
+        number_of_shards = min(os.cpu_count(), math.ceil(number_of_rows / ROWS_PER_SHARD))
+        if number_of_shards <= 1:
+            unsharded_jobs.append((yarrrml_file, query, csv_file))
+            continue
+
+        logging.info(f" Splitting {Path(yarrrml_file).stem} ({number_of_rows} rows) into {number_of_shards} shards")
+
+        with open(yarrrml_file, 'r') as f:
+            content = f.read()
+
+        for shard_i in range(number_of_shards):
+            shard_yarrrml_file = yarrrml_file.replace(".yml", f"_shard_{shard_i}.yml")
+            shard_csv_file = csv_file.replace(".csv", f"_shard_{shard_i}.csv")
+            shard_query = (f"SELECT * FROM (\n{query}\n) shardedQuery "
+                           f"WHERE ABS(shardedQuery.{shard_column} % {number_of_shards}) = {shard_i}")
+
+            with open(shard_yarrrml_file, 'w') as f:
+                f.write(content.replace(csv_file, shard_csv_file))
+
+            shards.append((shard_yarrrml_file, shard_query, shard_csv_file))
+
+        os.remove(yarrrml_file)
+
+    return unsharded_jobs, shards
+
+
+def run_shard_job(db: MSSQLDB,
+                  shard: tuple[str, str, str],
+                  max_heap: int,
+                  heap_budget: HeapBudget | None = None) -> tuple[str | None,
+                                                                  dict[str, int],
+                                                                  dict[str, float],
+                                                                  RMLJobPlan | None]:
+    """
+    Runs a shard end to end (SQL query -> CSV file -> RML conversion -> RMLMapper -> output file). If any step fails,
+    the whole shard is retried, up to SHARD_MAX_ATTEMPTS attempts
+
+    :param heap_budget: If provided, the engine and heap of the shard are chosen via plan_rml_job instead of using
+                        RMLMapper with max_heap
+
+    :returns: (output file path or None if the query yielded no results,
+               {"rows": rows written, "bytes": bytes written} of its CSV file,
+               dict of time_measurement_identifier -> time measurement (in s.),
+               plan of the RML job, if heap_budget was provided and the query yielded results)
+    """
+    (yarrrml_file, query, csv_file) = shard
+
+    for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+        try:
+            start = time.perf_counter()
+            (yielded_results, _, rows_written, bytes_written) = db.query_to_csv(query, csv_file)
+            query_execution_time = time.perf_counter() - start
+
+            if not yielded_results:
+                return None, {"rows": 0, "bytes": 0}, {"query_execution": query_execution_time}, None
+
+            csv_export_size = {"rows": rows_written, "bytes": bytes_written}
+            plan = None
+            if heap_budget is not None:
+                output_file_path, times, plan = run_planned_rml_job(Path(yarrrml_file).stem,
+                                                                    [yarrrml_file],
+                                                                    {Path(yarrrml_file).stem: csv_export_size},
+                                                                    heap_budget)
+            else:
+                output_file_path, times = run_rml_job(Path(yarrrml_file).stem, [yarrrml_file], max_heap)
+            times["query_execution"] = query_execution_time
+            times["attempts"] = attempt
+
+            return output_file_path, csv_export_size, times, plan
+
+        except Exception as e:
+            if attempt == SHARD_MAX_ATTEMPTS:
+                raise
+            logging.warning(f"Shard {Path(yarrrml_file).stem} failed (attempt {attempt}/{SHARD_MAX_ATTEMPTS}), retrying: {e}")
+
+
+def execute_sharded_mappings(db: MSSQLDB,
+                             shards: list[tuple[str, str, str]],
+                             cost_based_engine: bool = False,
+                             total_heap: int | None = None) -> tuple[list[str],
+                                                                       dict[str, dict[str, int]],
+                                                                       dict[str, dict[str, float]],
+                                                                       dict[str, RMLJobPlan]]:
+    """
+    Runs all shards concurrently, each of them end to end (see run_shard_job), on a pool of workers bounded as in
+    execute_mappings_in_parallel
+
+    :param cost_based_engine: Choose the engine and heap of each shard via plan_rml_job
+    :param total_heap: Heap (in GB) available to all shards instead of half of the system's RAM, e.g. if other mappings
+                       run at the same time
+
+    :returns: (list of output file paths,
+               dict of shard name -> {"rows": rows written, "bytes": bytes written} for the shards that yielded results,
+               dict of shard name -> time_measurement_identifier -> time measurement (in s.),
+               dict of shard name -> plan of its RML job, if cost_based_engine)
+    """
+    if len(shards) == 0:
+        return [], dict(), dict(), dict()
+
+    if total_heap is None:
+        total_heap = get_total_rml_heap()
+
+    heap_budget = None
+    if cost_based_engine:
+        heap_budget = HeapBudget(total_heap)
+        max_workers, max_heap_per_job = min(os.cpu_count(), len(shards)), None
+        logging.info(f"Running {len(shards)} shards, up to {max_workers} at a time within {heap_budget.total_heap}GB of heap...")
+    else:
+        max_workers, max_heap_per_job = get_rml_workers_and_heap(len(shards), total_heap)
+        logging.info(f"Running {len(shards)} shards, {max_workers} at a time with {max_heap_per_job}GB of heap each...")
+
+    output_file_paths = []
+    csv_export_sizes = dict()
+    times_per_shard = dict()
+    plans = dict()
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = {executor.submit(run_shard_job, db, shard, max_heap_per_job, heap_budget): Path(shard[0]).stem
+                   for shard in shards}
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Shards executed", leave=True):
+            output_file_path, csv_export_size, times, plan = future.result()
+            if output_file_path is not None:
+                output_file_paths.append(output_file_path)
+                csv_export_sizes[futures[future]] = csv_export_size
+            times_per_shard[futures[future]] = times
+            if plan is not None:
+                plans[futures[future]] = plan
+
+    return sorted(output_file_paths), csv_export_sizes, times_per_shard, plans
+
+
+def put_unless_failed(q: queue.Queue, item, failed: threading.Event):
+    """
+    Puts an item into a bounded queue, waiting for a free slot unless another stage of the pipeline fails meanwhile
+    """
+    while not failed.is_set():
+        try:
+            q.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+
+def get_unless_failed(q: queue.Queue, failed: threading.Event):
+    """
+    Gets an item from a queue, waiting for one unless another stage of the pipeline fails meanwhile (returning None)
+    """
+    while not failed.is_set():
+        try:
+            return q.get(timeout=1)
+        except queue.Empty:
+            continue
+    return None
+
+
+def execute_mappings_pipelined(db: MSSQLDB,
+                               untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]],
+                               delete_materialized_triples_files: bool = True,
+                               cost_based_engine: bool = False) -> tuple[list[str],
+                                                                         dict[str, dict[str, int]],
+                                                                         dict[str, dict[str, float]],
+                                                                         float,
+                                                                         dict[str, RMLJobPlan]]:
+    """
+    Runs the mappings as a pipeline of three concurrent stages connected by bounded queues (see PIPELINE_QUEUE_SIZE):
+        1. SQL queries, in os.cpu_count() threads, each writing its own CSV file
+        2. RMLMapper jobs (see run_rml_job), one per mapping whose query yielded results, started as soon as its CSV
+           file is ready. Bounded as in execute_mappings_in_parallel
+        3. Bulk loading of the output files into the RDF datastore, as soon as they are closed, in batches of up to
+           PIPELINE_UPLOAD_BATCH_SIZE files
+
+    A full stage blocks the previous one, so the wall-clock time approaches that of the slowest stage instead of the sum
+    of all of them. If any stage fails, the others stop and its exception is raised.
+
+    As triples are loaded while mapping, the datastore must have already been cleared.
+
+    :param delete_materialized_triples_files: Whether to delete the output files once loaded
+    :param cost_based_engine: Choose the engine and heap of each mapping job via plan_rml_job
+
+    :returns: (list of output file paths, already loaded into the datastore,
+               dict of YARRRML file name -> {"rows": rows written, "bytes": bytes written} for the queries that yielded results,
+               dict of YARRRML file name -> time_measurement_identifier -> time measurement (in s.),
+               time spent loading files into the datastore (in s.),
+               dict of YARRRML file name -> plan of its RML job, if cost_based_engine)
+    """
+    csv_files_ready = queue.Queue(PIPELINE_QUEUE_SIZE)
+    output_files_ready = queue.Queue(PIPELINE_QUEUE_SIZE)
+    failed = threading.Event()
+    errors = []
+
+    heap_budget = None
+    if cost_based_engine:
+        heap_budget = HeapBudget(get_total_rml_heap())
+        max_mapping_workers = min(os.cpu_count(), len(untemplated_yarrrml_file_names_and_jobs))
+        logging.info(f"Running {len(untemplated_yarrrml_file_names_and_jobs)} mappings as a pipeline, with up to "
+                     f"{max_mapping_workers} RML jobs at a time within {heap_budget.total_heap}GB of heap...")
+    else:
+        max_mapping_workers, max_heap_per_job = get_rml_workers_and_heap(len(untemplated_yarrrml_file_names_and_jobs))
+        logging.info(f"Running {len(untemplated_yarrrml_file_names_and_jobs)} mappings as a pipeline, with "
+                     f"{max_mapping_workers} RMLMapper jobs at a time with {max_heap_per_job}GB of heap each...")
+
+    output_file_paths = []
+    csv_export_sizes = dict()
+    times_per_mapping = dict()
+    plans = dict()
+    upload_time = 0.0
+    lock = threading.Lock()
+
+    def stop_pipeline_on_error(stage):
+        def run_and_propagate_errors(*args):
+            try:
+                stage(*args)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+        return run_and_propagate_errors
+
+    @stop_pipeline_on_error
+    def run_query(job: tuple[str, str, str]):
+        (yarrrml_file, query, csv_file) = job
+
+        start = time.perf_counter()
+        (yielded_results, _, rows_written, bytes_written) = db.query_to_csv(query, csv_file)
+        with lock:
+            times_per_mapping[Path(yarrrml_file).stem] = {"query_execution": time.perf_counter() - start}
+
+        if yielded_results:
+            with lock:
+                csv_export_sizes[Path(yarrrml_file).stem] = {"rows": rows_written, "bytes": bytes_written}
+            put_unless_failed(csv_files_ready, yarrrml_file, failed)
+
+    @stop_pipeline_on_error
+    def run_mapping_worker():
+        while (yarrrml_file := get_unless_failed(csv_files_ready, failed)) is not None:
+            if heap_budget is not None:
+                with lock:
+                    csv_export_size = {Path(yarrrml_file).stem: csv_export_sizes[Path(yarrrml_file).stem]}
+                output_file_path, times, plan = run_planned_rml_job(Path(yarrrml_file).stem, [yarrrml_file], csv_export_size, heap_budget)
+                with lock:
+                    plans[Path(yarrrml_file).stem] = plan
+            else:
+                output_file_path, times = run_rml_job(Path(yarrrml_file).stem, [yarrrml_file], max_heap_per_job)
+            with lock:
+                times_per_mapping[Path(yarrrml_file).stem].update(times)
+            put_unless_failed(output_files_ready, output_file_path, failed)
+
+    @stop_pipeline_on_error
+    def run_upload_worker():
+        nonlocal upload_time
+        finished = False
+        while not finished:
+            first_file = get_unless_failed(output_files_ready, failed)
+            if first_file is None:
+                return
+            batch = [first_file]
+
+            # Take every other file that is already waiting, to load them together
+            while len(batch) < PIPELINE_UPLOAD_BATCH_SIZE:
+                try:
+                    batch.append(output_files_ready.get_nowait())
+                except queue.Empty:
+                    break
+
+            # An empty string signals the end of the pipeline
+            finished = "" in batch
+            batch = [f for f in batch if f != ""]
+            if len(batch) > 0:
+                start = time.perf_counter()
+                rdf_datastore_client.run_sync(rdf_datastore_client.bulk_file_load(batch, delete_materialized_triples_files))
+                upload_time += time.perf_counter() - start
+                output_file_paths.extend(batch)
+
+    mapping_workers = [threading.Thread(target=run_mapping_worker) for _ in range(max_mapping_workers)]
+    upload_worker = threading.Thread(target=run_upload_worker)
+    for worker in mapping_workers + [upload_worker]:
+        worker.start()
+
+    with ThreadPoolExecutor(os.cpu_count()) as executor:
+        futures = [executor.submit(run_query, job) for job in untemplated_yarrrml_file_names_and_jobs]
+        for _ in tqdm(as_completed(futures), total=len(futures), desc="SQL queries executed", leave=True):
+            pass
+
+    # No more CSV files will come, stop the mapping workers once they are done
+    for _ in mapping_workers:
+        put_unless_failed(csv_files_ready, None, failed)
+    for worker in mapping_workers:
+        worker.join()
+
+    put_unless_failed(output_files_ready, "", failed)
+    upload_worker.join()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+    return sorted(output_file_paths), csv_export_sizes, times_per_mapping, upload_time, plans
+
+
+def compress_output_file(output_file_path: str) -> str:
+    """
+    Compresses an output file with gzip, replacing it
+
+    :returns: The path of the compressed file, i.e. {output_file_path}.gz
+    """
+    compressed_output_file_path = output_file_path + ".gz"
+    with (open(output_file_path, 'rb') as infile,
+          gzip.open(compressed_output_file_path, 'wb', compresslevel=OUTPUT_COMPRESSION_LEVEL) as outfile):
+        shutil.copyfileobj(infile, outfile, 1024 * 1024)
+    os.remove(output_file_path)
+
+    return compressed_output_file_path
+
+
+def compress_output_files(output_file_paths: list[str]) -> list[str]:
+    """
+    Compresses all output files in parallel (see compress_output_file), returning their new paths
+    """
+    with ThreadPoolExecutor(max(1, min(os.cpu_count(), len(output_file_paths)))) as executor:
+        return list(executor.map(compress_output_file, output_file_paths))
+
+
+def merge_per_mapping_times(per_mapping_times: dict[str, dict[str, float]], new_times: dict[str, dict[str, float]]):
+    """
+    Adds the measurements in new_times to those already taken for each mapping in per_mapping_times
+    """
+    for name, times in new_times.items():
+        per_mapping_times.setdefault(name, dict()).update(times)
+
+
+def get_per_mapping_metrics(untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]],
+                            csv_export_sizes: dict[str, dict[str, int]],
+                            per_mapping_times: dict[str, dict[str, float]]) -> dict[str, dict[str, str | int | float | None]]:
+    """
+    Gathers the measurements taken for every untemplated mapping (i.e. every replica of a templated mapping, or shard)
+    into a dict of YARRRML file name -> {
+        "mapping": templated mapping it comes from, relative to the mappings folder,
+        "sql_time": time spent executing its query and writing its CSV file (in s.),
+        "rows": rows returned by its query,
+        "csv_bytes": bytes of its CSV file,
+        "mapping_time": time spent converting and executing it (in s.),
+        "triples": triples it generated,
+        "output_bytes": bytes of its output file
+    }
+
+    When all mappings run in the same RML job, their triples and output bytes are attributed from the job's output, and
+    its time is split among them proportionally to their triples (see attribute_output_to_mappings). Measurements that
+    cannot be attributed to a single mapping are None, e.g. the SQL time of the Python engine, which runs the queries
+    while mapping
+    """
+    metrics = dict()
+    for (yarrrml_file, _, _) in untemplated_yarrrml_file_names_and_jobs:
+        name = Path(yarrrml_file).stem
+        times = per_mapping_times.get(name, dict())
+
+        if name in csv_export_sizes:
+            rows, csv_bytes = csv_export_sizes[name]["rows"], csv_export_sizes[name]["bytes"]
+        elif "query_execution" in times:
+            # The query yielded no results, so the mapping was not executed
+            rows, csv_bytes = 0, 0
+        else:
+            rows, csv_bytes = times.get("rows"), None
+
+        if rows == 0:
+            mapping_time, triples, output_bytes = 0.0, 0, 0
+        else:
+            mapping_time = None
+            if "materialization" in times:
+                mapping_time = times.get("yarrrml_to_rml_conversion", 0.0) + times["materialization"]
+            triples, output_bytes = times.get("triples"), times.get("output_bytes")
+
+        # Replicas (and shards) share the name of their templated mapping, plus a numeric suffix
+        base_name = re.sub(r"(_\d+)?(_shard_\d+)?$", "", name)
+        mapping = os.path.relpath(os.path.join(os.path.dirname(yarrrml_file), base_name), os.path.join(module_dir, "mappings"))
+
+        metrics[name] = {
+            "mapping": mapping,
+            "sql_time": times.get("query_execution"),
+            "rows": rows,
+            "csv_bytes": csv_bytes,
+            "mapping_time": mapping_time,
+            "triples": triples,
+            "output_bytes": output_bytes
+        }
+
+    return metrics
+
 
 def run_mappings(db: MSSQLDB,
                  skip_materialization: bool = False,
-                 use_rmlstreamer: bool = False) -> (list[str],
-                                                    dict[str, dict[str, float]],
-                                                    list[(float, float)]):
+                 use_rmlstreamer: bool = False,
+                 incremental_run: IncrementalRun | None = None,
+                 engine: str = "rml",
+                 parallel_rml: bool = False,
+                 rml_files_per_job: int = 1,
+                 typed_activity_mappings: bool = False,
+                 shard_large_mappings: bool = False,
+                 pipelined: bool = False,
+                 delete_materialized_triples_files: bool = True,
+                 cost_based_engine: bool = False,
+                 canonical_output: bool = False,
+                 compress_output: bool = False,
+                 stage_caching: bool = False) -> (list[str],
+                                                     dict[str, dict[str, float]],
+                                                     dict[str, list]):
     """
     Executes the complete pipeline of templated YARRRML file parsing -> YARRRML to RML files conversion -> mappings execution
     (See the module's documentation for how to include/extend the mappings)
@@ -567,54 +1262,309 @@ def run_mappings(db: MSSQLDB,
     :param db: DB instance to run the queries against
     :param skip_materialization: Avoids running the entire pipeline (query execution, preparation and conversion of YARRRML files and execution of mappings).
                                  It will return a list of materialized file paths, but assuming they are already present
+    :param incremental_run: If provided (and not a full rebuild), the mappings queries will be restricted to the objects
+                            affected since the last run, yielding only the delta of the KG (see incremental_materialization.py)
+    :param engine: "rml" to convert the mappings to RML and execute them via RMLMapper/RMLStreamer, or "python" to
+                   execute them in-process, streaming the query results directly to N-Triples (see python_engine.py)
+    :param parallel_rml: Instead of coalescing all mappings into one RML file, convert and run each group of
+                         rml_files_per_job YARRRML files as its own RMLMapper job, in parallel. Each job writes its own
+                         output file. Not compatible with use_rmlstreamer
+    :param typed_activity_mappings: Run each activity mapping once for all measurement types instead of once per
+                                    measurement type (see prepare_YARRRML_files)
+    :param shard_large_mappings: Split the mappings in sharded_mappings into shards sized by their row count, which
+                                 are run concurrently end to end, each writing its own output file (see shard_jobs).
+                                 With the "rml" engine, they run alongside the other mappings, with half of the heap
+    :param pipelined: Overlap the queries, the mappings and the loading of their output files into the RDF datastore
+                      (see execute_mappings_pipelined). The returned files will be already loaded, and the datastore
+                      must have been cleared beforehand. Only applies to the "rml" engine without use_rmlstreamer
+    :param delete_materialized_triples_files: Whether to delete the output files once loaded, if pipelined
+    :param cost_based_engine: Choose RMLMapper or RMLStreamer and the heap of every RML job from the number of triples it
+                              is predicted to generate (see plan_rml_job), instead of use_rmlstreamer and half of the
+                              system's RAM. The predictions and choices are logged in the performance log
+    :param canonical_output: Rewrite all output files into a single file of canonical N-Triples, sorted by subject and
+                             without duplicates (see canonical_output.py). Not compatible with pipelined, whose files
+                             are loaded while mapping
+    :param compress_output: Compress the output files with gzip (as .ttl.gz files), which the RDF datastore loads
+                            directly. Not compatible with pipelined, whose files are loaded while mapping
+    :param stage_caching: Skip the queries and/or the mappings if their inputs did not change since the last run,
+                          reusing its output files instead (see stage_cache.py). Ignored if pipelined or if the run is
+                          an incremental delta
 
     :return: Tuple containing:
-                - A list of file paths containing the materialized triples in turtle format (For now, it's only one)
+                - A list of file paths containing the materialized triples in turtle format (only one, except with
+                  parallel_rml, shard_large_mappings or pipelined, unless canonical_output), gzip-compressed if
+                  compress_output
                 - A dict of file path -> time_measurement_identifier -> time measurement (in s.), containing execution time
-                  logs for the different phases of the pipeline
-                - A list of pairs of (cpu_percent_usage, bytes_of_memory_used) taken every second for the duration of this function
+                  logs for the different phases of the pipeline. Its "per_mapping_metrics" entry holds the measurements
+                  of every untemplated mapping (see get_per_mapping_metrics)
+                - The resource usage of the pipeline and the DB for the duration of this function, as a columnar time
+                  series tagged with the stage being executed (see monitoring/resource_sampler.py)
     """
-    manager = multiprocessing.Manager()
-    resource_usage = manager.list()
-    stop_event = multiprocessing.Event()
-
-    resource_usage_tracker = multiprocessing.Process(
-        target=resource_usage_job,
-        args=(stop_event, resource_usage)
-    )
-    resource_usage_tracker.start()
+    resource_sampler = ResourceSampler({"sql_server": MonitoredService(db.get_docker_container_id(), "sqlservr")}
+                                       if not db.is_remote else None)
+    resource_sampler.start()
 
     performance_log: dict[str: float | dict[str: float]] = dict()
     performance_log["per_mapping_times"] = {}
+    performance_log["rml_job_plans"] = {}
 
     if skip_materialization:
         logging.info("Skipping materialization. Note that the system will assume the materialized files already exist.")
-        return [materialized_triples_file_path], performance_log, list(resource_usage)
+        if not os.path.exists(materialized_triples_file_path) and os.path.exists(materialized_triples_file_path + ".gz"):
+            return [materialized_triples_file_path + ".gz"], performance_log, resource_sampler.stop()
+        return [materialized_triples_file_path], performance_log, resource_sampler.stop()
 
     logging.info("Filling the templated YARRRML mappings...")
-    untemplated_yarrrml_file_names_and_jobs = prepare_YARRRML_files()
+    resource_sampler.set_stage("yarrrml_preparation")
+    # Files converted on their own (parallel jobs, shards or pipelined mappings) need their prefixes too
+    converted_separately = parallel_rml or shard_large_mappings or pipelined
+    untemplated_yarrrml_file_names_and_jobs = prepare_YARRRML_files(add_prefixes_to_all_files=converted_separately,
+                                                                    typed_activity_mappings=typed_activity_mappings)
     logging.info(f"YARRRML files created: {len(untemplated_yarrrml_file_names_and_jobs)}")
 
-    logging.info("Executing SQL queries...")
-    time_query_execution_start = time.perf_counter()
-    yarrrml_files_to_convert = run_mappings_queries(db, untemplated_yarrrml_file_names_and_jobs)
-    performance_log["query_execution"] = time.perf_counter() - time_query_execution_start
-    logging.info(f" YARRRML files whose queries yielded results: {len(yarrrml_files_to_convert)} / {len(untemplated_yarrrml_file_names_and_jobs)}")
-
-    logging.info("Converting YARRRML mappings to RML...")
-    time_yarrrml_to_rml_conversion_start = time.perf_counter()
-    create_rml_file(yarrrml_files_to_convert)
-    performance_log["yarrrml_to_rml_conversion_real_time"] = time.perf_counter() - time_yarrrml_to_rml_conversion_start
-
+    if incremental_run is not None and not incremental_run.is_full_rebuild:
+        logging.info(f"Restricting the mappings to the {len(incremental_run.affected_object_ids)} objects affected since the last run...")
+        untemplated_yarrrml_file_names_and_jobs = restrict_jobs_to_affected_objects(untemplated_yarrrml_file_names_and_jobs,
+                                                                                    incremental_run)
+
+    # Outputs of pipelined runs are already loaded, and those of incremental deltas depend on the previous run
+    stage_caching = stage_caching and not pipelined and (incremental_run is None or incremental_run.is_full_rebuild)
+    stage_fingerprints = dict()
+    restored_output = False
+    if stage_caching:
+        previous_stage_fingerprints = stage_cache.load_fingerprints()
+        run_parameters = json.dumps([engine, use_rmlstreamer, parallel_rml, rml_files_per_job, shard_large_mappings,
+                                     cost_based_engine, canonical_output, compress_output])
+        stage_fingerprints["templating"] = get_templating_fingerprint(converted_separately, typed_activity_mappings)
+        stage_fingerprints["sql"] = get_sql_fingerprint(db,
+                                                        stage_fingerprints["templating"],
+                                                        untemplated_yarrrml_file_names_and_jobs,
+                                                        run_parameters)
+        performance_log["stage_cache_hits"] = {stage: previous_stage_fingerprints.get(stage) == fingerprint
+                                               for stage, fingerprint in stage_fingerprints.items()}
+
+        if performance_log["stage_cache_hits"]["sql"]:
+            materialized_files = stage_cache.restore_output_files()
+            if materialized_files is not None:
+                logging.info("The queries and the DB did not change since the last run, reusing its materialized triples")
+                stage_cache.save_fingerprints(stage_fingerprints)
+
+                for (yml_file, _, _) in untemplated_yarrrml_file_names_and_jobs:
+                    if os.path.exists(yml_file):
+                        os.remove(yml_file)
+
+                return materialized_files, performance_log, resource_sampler.stop()
+
+    resource_sampler.set_stage("staging_tables_creation")
+    time_staging_tables_creation_start = time.perf_counter()
+    staging_table_replacements = create_staging_tables(db, untemplated_yarrrml_file_names_and_jobs)
+    performance_log["staging_tables_creation"] = time.perf_counter() - time_staging_tables_creation_start
+    untemplated_yarrrml_file_names_and_jobs = resolve_staging_tables(untemplated_yarrrml_file_names_and_jobs,
+                                                                     staging_table_replacements)
+
+    materialized_files = [materialized_triples_file_path]
+
+    shards_executor = None
+    try:
+        shards = []
+        if shard_large_mappings:
+            logging.info("Sharding the largest mappings...")
+            resource_sampler.set_stage("sharding")
+            untemplated_yarrrml_file_names_and_jobs, shards = shard_jobs(db, untemplated_yarrrml_file_names_and_jobs)
+
+        if engine == "python":
+            # Shards are just independent jobs for the Python engine, which already runs each of them end to end
+            untemplated_yarrrml_file_names_and_jobs += shards
+            shards = []
+
+            # Queries are executed while materializing, so both phases are measured together
+            logging.info("Materializing the triples via the Python engine...")
+            resource_sampler.set_stage("materialization")
+            time_materialization_start = time.perf_counter()
+            yarrrml_files_with_results, performance_log["per_mapping_times"] = run_python_engine(db,
+                                                                                                 untemplated_yarrrml_file_names_and_jobs,
+                                                                                                 materialized_triples_file_path)
+            performance_log["materialization_real_time"] = time.perf_counter() - time_materialization_start
+            logging.info(f" YARRRML files whose queries yielded results: {len(yarrrml_files_with_results)} / {len(untemplated_yarrrml_file_names_and_jobs)}")
+
+        elif pipelined and not use_rmlstreamer:
+            # Shards are just independent mappings for the pipeline
+            untemplated_yarrrml_file_names_and_jobs += shards
+            shards = []
+
+            # Queries, materialization and upload overlap, so they are measured together
+            logging.info("Executing and loading the mappings as a pipeline...")
+            resource_sampler.set_stage("pipelined_materialization")
+            time_materialization_start = time.perf_counter()
+            (materialized_files,
+             performance_log["csv_export_sizes"],
+             performance_log["per_mapping_times"],
+             performance_log["pipelined_upload_time"],
+             plans) = execute_mappings_pipelined(db,
+                                                 untemplated_yarrrml_file_names_and_jobs,
+                                                 delete_materialized_triples_files,
+                                                 cost_based_engine)
+            performance_log["rml_job_plans"].update({name: asdict(plan) for name, plan in plans.items()})
+            performance_log["materialization_real_time"] = time.perf_counter() - time_materialization_start
+            logging.info(f" YARRRML files whose queries yielded results: {len(performance_log["csv_export_sizes"])} / {len(untemplated_yarrrml_file_names_and_jobs)}")
 
-    logging.info(f"Materializing the triples via {"RMLStreamer" if use_rmlstreamer else "RMLMapper"}...")
-    time_materialization_start = time.perf_counter()
-    execute_mappings(use_rmlstreamer)
-    performance_log["materialization_real_time"] = time.perf_counter() - time_materialization_start
+        else:
+            # Shards run in the background alongside the other mappings (from their queries on), so half of the heap of
+            # the RML jobs is set aside for them
+            rml_heap = get_total_rml_heap()
+            if len(shards) > 0:
+                shards_heap = max(1, rml_heap // 2)
+                rml_heap = max(1, rml_heap - shards_heap)
+
+                def run_shards():
+                    start = time.perf_counter()
+                    return execute_sharded_mappings(db, shards, cost_based_engine, shards_heap), time.perf_counter() - start
+
+                logging.info("Executing the shards of the largest mappings in the background...")
+                shards_executor = ThreadPoolExecutor(1)
+                shards_future = shards_executor.submit(run_shards)
+
+            logging.info("Executing SQL queries...")
+            resource_sampler.set_stage("query_execution")
+            time_query_execution_start = time.perf_counter()
+            (yarrrml_files_to_convert,
+             performance_log["csv_export_sizes"],
+             query_times) = run_mappings_queries(db, untemplated_yarrrml_file_names_and_jobs)
+            performance_log["query_execution"] = time.perf_counter() - time_query_execution_start
+            merge_per_mapping_times(performance_log["per_mapping_times"],
+                                    {name: {"query_execution": query_time} for name, query_time in query_times.items()})
+            logging.info(f" YARRRML files whose queries yielded results: {len(yarrrml_files_to_convert)} / {len(untemplated_yarrrml_file_names_and_jobs)}")
+            logging.info(f" Rows written to CSV files: {sum(size["rows"] for size in performance_log["csv_export_sizes"].values())} "
+                         f"({sum(size["bytes"] for size in performance_log["csv_export_sizes"].values()) / (1024 ** 2):.2f} MB)")
+
+            # Shards run their own queries, so their inputs are not known yet
+            if stage_caching and len(shards) == 0:
+                csv_files = {yml_file: csv_file for (yml_file, _, csv_file) in untemplated_yarrrml_file_names_and_jobs}
+                stage_fingerprints["mapping"] = get_mapping_fingerprint(stage_fingerprints["templating"],
+                                                                        [(yml_file, csv_files[yml_file]) for yml_file in yarrrml_files_to_convert],
+                                                                        run_parameters)
+                performance_log["stage_cache_hits"]["mapping"] = previous_stage_fingerprints.get("mapping") == stage_fingerprints["mapping"]
+
+            restored_files = None
+            if stage_caching and performance_log["stage_cache_hits"].get("mapping", False):
+                restored_files = stage_cache.restore_output_files()
+
+            if restored_files is not None:
+                logging.info("The query results did not change since the last run, reusing its materialized triples")
+                materialized_files = restored_files
+                restored_output = True
+
+            elif parallel_rml and not use_rmlstreamer:
+                # Keep the order of the mappings, so that jobs group the same files across runs
+                mappings_order = [yml_file for (yml_file, _, _) in untemplated_yarrrml_file_names_and_jobs]
+                yarrrml_files_to_convert.sort(key=mappings_order.index)
+
+                # Each job converts and materializes its own files, so both phases are measured together
+                logging.info("Converting and materializing the mappings via parallel RMLMapper jobs...")
+                resource_sampler.set_stage("materialization")
+                time_materialization_start = time.perf_counter()
+                (materialized_files,
+                 times_per_job,
+                 plans) = execute_mappings_in_parallel(yarrrml_files_to_convert,
+                                                       rml_files_per_job,
+                                                       performance_log["csv_export_sizes"] if cost_based_engine else None,
+                                                       rml_heap)
+                merge_per_mapping_times(performance_log["per_mapping_times"], times_per_job)
+                performance_log["rml_job_plans"].update({name: asdict(plan) for name, plan in plans.items()})
+                performance_log["materialization_real_time"] = time.perf_counter() - time_materialization_start
+
+            else:
+                logging.info("Converting YARRRML mappings to RML...")
+                resource_sampler.set_stage("yarrrml_to_rml_conversion")
+                time_yarrrml_to_rml_conversion_start = time.perf_counter()
+                create_rml_file(yarrrml_files_to_convert)
+                performance_log["yarrrml_to_rml_conversion_real_time"] = time.perf_counter() - time_yarrrml_to_rml_conversion_start
+
+
+                max_heap = rml_heap
+                if cost_based_engine:
+                    plan = plan_rml_job(yarrrml_files_to_convert, performance_log["csv_export_sizes"], rml_heap)
+                    performance_log["rml_job_plans"][Path(materialized_triples_file_path).stem] = asdict(plan)
+                    use_rmlstreamer, max_heap = plan.use_rmlstreamer, plan.max_heap
+                    logging.info(f" Predicted triples: {plan.predicted_triples}")
+
+                logging.info(f"Materializing the triples via {"RMLStreamer" if use_rmlstreamer else "RMLMapper"}...")
+                resource_sampler.set_stage("materialization")
+                time_materialization_start = time.perf_counter()
+                execute_mappings(use_rmlstreamer, max_heap=max_heap)
+                performance_log["materialization_real_time"] = time.perf_counter() - time_materialization_start
+
+                # All mappings ran in the same job, so their share of its output and time is attributed afterwards
+                logging.info("Attributing the materialized triples to their mappings...")
+                resource_sampler.set_stage("output_attribution")
+                time_output_attribution_start = time.perf_counter()
+                attributed_output = attribute_output_to_mappings(yarrrml_files_to_convert)
+                total_triples = max(1, sum(sizes["triples"] for sizes in attributed_output.values()))
+                merge_per_mapping_times(performance_log["per_mapping_times"],
+                                        {name: sizes | {"yarrrml_to_rml_conversion": performance_log["yarrrml_to_rml_conversion_real_time"] * sizes["triples"] / total_triples,
+                                                        "materialization": performance_log["materialization_real_time"] * sizes["triples"] / total_triples}
+                                         for name, sizes in attributed_output.items()})
+                performance_log["output_attribution_real_time"] = time.perf_counter() - time_output_attribution_start
+
+            if shards_executor is not None:
+                logging.info("Waiting for the shards of the largest mappings...")
+                resource_sampler.set_stage("sharded_materialization")
+                time_shards_wait_start = time.perf_counter()
+                ((sharded_files,
+                  shards_csv_export_sizes,
+                  shards_times,
+                  plans),
+                 performance_log["sharded_mappings_real_time"]) = shards_future.result()
+                performance_log["sharded_mappings_wait_time"] = time.perf_counter() - time_shards_wait_start
+
+                materialized_files = materialized_files + sharded_files
+                performance_log["csv_export_sizes"].update(shards_csv_export_sizes)
+                merge_per_mapping_times(performance_log["per_mapping_times"], shards_times)
+                performance_log["rml_job_plans"].update({name: asdict(plan) for name, plan in plans.items()})
+
+                untemplated_yarrrml_file_names_and_jobs += shards
+    finally:
+        # Shards read the staging tables, so they have to finish (e.g. if the other mappings failed) before dropping them
+        if shards_executor is not None:
+            shards_executor.shutdown(wait=True, cancel_futures=True)
+
+        resource_sampler.set_stage("staging_tables_cleanup")
+        drop_staging_tables(db, staging_table_replacements)
+
+    # Restored output files are already canonicalized and compressed
+    if canonical_output and not pipelined and not restored_output:
+        logging.info("Sorting and deduplicating the materialized triples...")
+        resource_sampler.set_stage("canonicalization")
+        time_canonicalization_start = time.perf_counter()
+        performance_log["canonical_output"] = canonicalize_triples(materialized_files, materialized_triples_file_path)
+        performance_log["canonicalization_real_time"] = time.perf_counter() - time_canonicalization_start
+
+        for materialized_file in materialized_files:
+            if materialized_file != materialized_triples_file_path:
+                os.remove(materialized_file)
+        materialized_files = [materialized_triples_file_path]
+
+    if compress_output and not pipelined and not restored_output:
+        logging.info("Compressing the materialized triples...")
+        resource_sampler.set_stage("compression")
+        time_compression_start = time.perf_counter()
+        materialized_files = compress_output_files(materialized_files)
+        performance_log["compression_real_time"] = time.perf_counter() - time_compression_start
+
+    if stage_caching:
+        if not restored_output:
+            stage_cache.store_output_files(materialized_files)
+        # The mapping stage is not fingerprinted with the Python engine or shards, its last fingerprint no longer
+        # corresponds to the stored output files
+        stage_cache.save_fingerprints({"mapping": None} | stage_fingerprints)
+
+    performance_log["per_mapping_metrics"] = get_per_mapping_metrics(untemplated_yarrrml_file_names_and_jobs,
+                                                                      performance_log.get("csv_export_sizes", dict()),
+                                                                      performance_log["per_mapping_times"])
+    performance_log["sql_connection_pool"] = db.get_pool_metrics()
 
     # Stop the resource logging
-    stop_event.set()
-    resource_usage_tracker.join()
+    resource_usage = resource_sampler.stop()
 
     logging.info("Cleaning up temporary files...")
     for (yml_file, _, csv_file) in untemplated_yarrrml_file_names_and_jobs:
@@ -624,4 +1574,4 @@ def run_mappings(db: MSSQLDB,
         if os.path.exists(csv_file):
             os.remove(csv_file)
 
-    return [materialized_triples_file_path], performance_log, list(resource_usage)
\ No newline at end of file
+    return materialized_files, performance_log, resource_usage
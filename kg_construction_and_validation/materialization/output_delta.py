@@ -0,0 +1,336 @@
+"""
+Module that updates the datastore with the differences between the canonical outputs (see canonical_output.py) of two
+consecutive materializations, instead of clearing it and loading the whole output again.
+
+Each run keeps its canonical output in PREVIOUS_OUTPUT_FILE_PATH. The next run:
+    1. Merges its sorted output with the previous one, streaming both files, into a file of removed triples and a
+       file of added triples
+    2. Rewrites both files as the postprocessing rewrote the datastore: the entity IRIs it replaces (see
+       postprocessing.replace_entity_iris) are replaced in them too, so that the removed triples match those held by
+       the datastore
+    3. Deletes the handover groups created by the postprocessing that contain any handover whose triples changed. The
+       postprocessing will create them again, as in incremental runs (see incremental_materialization.py)
+    4. Deletes the ChEBI elements (crc:element) of the subjects that lost any temporary element triple, and adds all
+       their current temporary element triples to the added ones, so that the postprocessing links them again
+    5. Deletes the removed triples via DELETE DATA updates, and inserts the added ones via INSERT DATA updates or, if
+       there are many of them, a bulk load of the file of added triples
+If there is no previous output, or most of the triples changed, the datastore is cleared and fully loaded instead.
+
+The datastore is never empty between the clear and the reload, and the time spent loading and re-indexing is
+proportional to the number of changed triples.
+
+Note: the previous output is only valid as long as the datastore is not modified by other means. Runs that do not use
+delta uploads discard it (see discard_previous_output), so that the next delta upload performs a full load. Only the
+triples derived by the postprocessing listed above (handover groups, replaced entity IRIs and ChEBI elements) are kept
+in sync, any new postprocessing step has to be accounted for here as well. Deleting PREVIOUS_OUTPUT_FILE_PATH forces a
+full load.
+"""
+import logging
+import os
+import re
+import sys
+
+from datastores.rdf import rdf_datastore_client
+from datastores.rdf.rdf_datastore import MAIN_GRAPH_IRI, UpdateType
+from postprocessing.postprocessing import get_entity_replacement_iris
+from .incremental_materialization import crc_namespace, delete_handover_groups_query, handover_group_prefix
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+PREVIOUS_OUTPUT_FILE_PATH = os.path.join(module_dir, 'incremental_state/previous_output.nt')
+
+# Triples deleted or inserted per SPARQL update
+DELTA_BATCH_SIZE = 1_000
+# SPARQL updates sent to the datastore API per request
+DELTA_UPDATES_PER_REQUEST = 20
+# Above this number of added triples, they are bulk loaded instead of inserted via SPARQL updates
+DELTA_BULK_LOAD_MIN_TRIPLES = 100_000
+# Above this fraction of changed triples (removed and added, relative to the new output), a full load is cheaper
+DELTA_MAX_CHANGED_FRACTION = 0.5
+
+handover_namespace = crc_namespace + "handover/"
+# Element labels asserted by the mappings, which the postprocessing replaces by links to ChEBI elements
+temporary_element_property = crc_namespace + "temporaryDatatypeProperty"
+element_property = crc_namespace + "element"
+
+iri_pattern = re.compile(r"<[^<>\"\s]*>")
+
+delete_elements_query = """
+DELETE {
+  GRAPH <{graph_iri}> {
+    ?s <{element_property}> ?element .
+  }
+}
+WHERE {
+  GRAPH <{graph_iri}> {
+    VALUES ?s { {subjects} }
+    ?s <{element_property}> ?element .
+  }
+}
+"""
+
+
+def discard_previous_output():
+    """
+    Forgets the previous output, e.g. because the datastore was cleared or modified by other means
+    """
+    if os.path.exists(PREVIOUS_OUTPUT_FILE_PATH):
+        os.remove(PREVIOUS_OUTPUT_FILE_PATH)
+
+
+def diff_canonical_outputs(previous_output_file_path: str,
+                           current_output_file_path: str,
+                           removed_triples_file_path: str,
+                           added_triples_file_path: str) -> tuple[int, int, int]:
+    """
+    Merges two canonical (sorted and deduplicated) outputs, writing the triples only present in the previous one to
+    removed_triples_file_path, and those only present in the current one to added_triples_file_path
+
+    :returns: (number of removed triples, number of added triples, number of triples of the current output)
+    """
+    removed_triples, added_triples, current_triples = 0, 0, 0
+
+    with (open(previous_output_file_path, 'rb') as previous_output,
+          open(current_output_file_path, 'rb') as current_output,
+          open(removed_triples_file_path, 'wb') as removed_output,
+          open(added_triples_file_path, 'wb') as added_output):
+        previous_line = next(previous_output, None)
+        current_line = next(current_output, None)
+
+        while previous_line is not None or current_line is not None:
+            if current_line is None or (previous_line is not None and previous_line < current_line):
+                removed_output.write(previous_line)
+                removed_triples += 1
+                previous_line = next(previous_output, None)
+            elif previous_line is None or current_line < previous_line:
+                added_output.write(current_line)
+                added_triples += 1
+                current_triples += 1
+                current_line = next(current_output, None)
+            else:
+                current_triples += 1
+                previous_line = next(previous_output, None)
+                current_line = next(current_output, None)
+
+    return removed_triples, added_triples, current_triples
+
+
+def replace_entity_iris(triples_file_path: str, replacements: dict[str, str]):
+    """
+    Replaces the IRIs of a file of triples (in place) as the postprocessing replaces them in the datastore
+    """
+    def replace_iri(match: re.Match) -> str:
+        iri = match.group(0)[1:-1]
+        return f"<{replacements.get(iri, iri)}>"
+
+    replaced_file_path = triples_file_path + ".replaced"
+    with (open(triples_file_path, 'r', encoding='utf-8') as f,
+          open(replaced_file_path, 'w', encoding='utf-8') as replaced_f):
+        for line in f:
+            # Literals may contain anything that looks like an IRI, only the terms before them are replaced
+            literal_start = line.find('"')
+            if literal_start == -1:
+                replaced_f.write(iri_pattern.sub(replace_iri, line))
+            else:
+                replaced_f.write(iri_pattern.sub(replace_iri, line[:literal_start]) + line[literal_start:])
+    os.replace(replaced_file_path, triples_file_path)
+
+
+def get_subjects_with_predicate(triples_file_path: str, predicate: str) -> set[str]:
+    """
+    Returns the subjects (as N-Triples terms) of the triples of a canonical output with the given predicate
+    """
+    subjects = set()
+    predicate_term = f" <{predicate}> "
+    with open(triples_file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if predicate_term in line:
+                (subject, predicate_and_object) = line.split(" ", 1)
+                if predicate_and_object.startswith(predicate_term[1:]):
+                    subjects.add(subject)
+    return subjects
+
+
+def append_triples_of_subjects(source_file_path: str,
+                               target_file_path: str,
+                               subjects: set[str],
+                               predicate: str) -> int:
+    """
+    Appends the triples of source_file_path with one of the subjects and the given predicate to target_file_path
+
+    :returns: The number of appended triples
+    """
+    appended_triples = 0
+    predicate_term = f"<{predicate}> "
+    with (open(source_file_path, 'r', encoding='utf-8') as source,
+          open(target_file_path, 'a', encoding='utf-8') as target):
+        for line in source:
+            (subject, predicate_and_object) = line.split(" ", 1)
+            if subject in subjects and predicate_and_object.startswith(predicate_term):
+                target.write(line)
+                appended_triples += 1
+    return appended_triples
+
+
+def get_changed_handovers(triples_file_paths: list[str]) -> set[str]:
+    """
+    Returns the IRIs of the handovers that are the subject of any of the triples
+    """
+    handovers = set()
+    for triples_file_path in triples_file_paths:
+        with open(triples_file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                subject = line[1:line.index(">")] if line.startswith("<") else ""
+                if subject.startswith(handover_namespace) and not subject.startswith(handover_group_prefix):
+                    handovers.add(subject)
+    return handovers
+
+
+def run_updates(queries: list[str]):
+    """
+    Sends SPARQL updates to the datastore, DELTA_UPDATES_PER_REQUEST at a time
+    """
+    for i in range(0, len(queries), DELTA_UPDATES_PER_REQUEST):
+        actions = [(query, UpdateType.query) for query in queries[i:i + DELTA_UPDATES_PER_REQUEST]]
+        rdf_datastore_client.run_sync(rdf_datastore_client.launch_updates(actions))
+
+
+def run_data_updates(operation: str, triples_file_path: str, graph_iri: str, is_virtuoso: bool):
+    """
+    Runs the triples of a file as {operation} DATA updates (i.e. DELETE DATA or INSERT DATA) of DELTA_BATCH_SIZE
+    triples. Canonical outputs are N-Triples, which is valid SPARQL data syntax
+    """
+    queries = []
+    batch = []
+
+    def add_batch_query():
+        query = f"{operation} DATA {{\n  GRAPH <{graph_iri}> {{\n{"".join(batch)}  }}\n}}"
+        if is_virtuoso:
+            # Prevents OOMs from writing transactions to memory if there are many affected triples
+            query = "DEFINE sql:log-enable 3\n" + query
+        queries.append(query)
+        batch.clear()
+
+    with open(triples_file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            batch.append(line)
+            if len(batch) == DELTA_BATCH_SIZE:
+                add_batch_query()
+                if len(queries) == DELTA_UPDATES_PER_REQUEST:
+                    run_updates(queries)
+                    queries.clear()
+
+    if len(batch) > 0:
+        add_batch_query()
+    run_updates(queries)
+
+
+def full_load(output_file_path: str, graph_iri: str):
+    rdf_datastore_client.run_sync(rdf_datastore_client.clear_triples(graph_iri))
+    rdf_datastore_client.run_sync(rdf_datastore_client.bulk_file_load([output_file_path],
+                                                                      delete_files_after_upload=False,
+                                                                      graph_iri=graph_iri))
+
+
+def upload_output_delta(output_file_path: str, graph_iri: str = MAIN_GRAPH_IRI) -> dict[str, int | bool]:
+    """
+    Updates the datastore with the differences between a canonical output and the previous one (see the module's
+    documentation), and keeps it as the previous output of the next run. The output file is moved in the process
+
+    :returns: Dict of {"full_load": whether the datastore was fully loaded instead, "removed_triples", "added_triples",
+              "relinked_triples": current temporary element triples inserted again (see the module's documentation)}
+    """
+    os.makedirs(os.path.dirname(PREVIOUS_OUTPUT_FILE_PATH), exist_ok=True)
+
+    if not os.path.exists(PREVIOUS_OUTPUT_FILE_PATH):
+        logging.info("No previous output to compare with, fully loading the output...")
+        full_load(output_file_path, graph_iri)
+        os.replace(output_file_path, PREVIOUS_OUTPUT_FILE_PATH)
+        return {"full_load": True, "removed_triples": 0, "added_triples": 0, "relinked_triples": 0}
+
+    removed_triples_file_path = output_file_path.replace(".ttl", "_removed.nt")
+    added_triples_file_path = output_file_path.replace(".ttl", "_added.ttl")
+
+    try:
+        (removed_triples, added_triples, output_triples) = diff_canonical_outputs(PREVIOUS_OUTPUT_FILE_PATH,
+                                                                  output_file_path,
+                                                                  removed_triples_file_path,
+                                                                  added_triples_file_path)
+        logging.info(f"Triples removed since the previous output: {removed_triples}, added: {added_triples}")
+
+        # Nothing is known about the datastore if the update fails midway, so the next run has to fully load it
+        discard_previous_output()
+
+        if removed_triples + added_triples > DELTA_MAX_CHANGED_FRACTION * output_triples:
+            logging.info("Most of the triples changed, fully loading the output instead...")
+            full_load(output_file_path, graph_iri)
+            os.replace(output_file_path, PREVIOUS_OUTPUT_FILE_PATH)
+            return {"full_load": True, "removed_triples": removed_triples, "added_triples": added_triples,
+                    "relinked_triples": 0}
+
+        is_virtuoso = rdf_datastore_client.run_sync(rdf_datastore_client.get_datastore_type()) == "virtuoso"
+
+        handovers = sorted(get_changed_handovers([removed_triples_file_path, added_triples_file_path]))
+        if len(handovers) > 0:
+            logging.info(f"Deleting the handover groups of {len(handovers)} changed handovers...")
+            queries = []
+            for i in range(0, len(handovers), DELTA_BATCH_SIZE):
+                formatted_handovers = " ".join(f"<{handover}>" for handover in handovers[i:i + DELTA_BATCH_SIZE])
+                query = delete_handover_groups_query.replace("{graph_iri}", graph_iri).replace("{subjects}", formatted_handovers)
+                queries.append("DEFINE sql:log-enable 3\n" + query if is_virtuoso else query)
+            run_updates(queries)
+
+        # The postprocessing deletes the temporary element triples once it links them, so the links derived from removed
+        # ones are deleted with all other links of their subjects, which are then linked again from their current triples
+        subjects = sorted(subject for subject in get_subjects_with_predicate(removed_triples_file_path,
+                                                                               temporary_element_property)
+                          if subject.startswith("<"))
+        relinked_triples = 0
+        if len(subjects) > 0:
+            logging.info(f"Deleting the ChEBI elements of {len(subjects)} subjects with removed elements...")
+            queries = []
+            for i in range(0, len(subjects), DELTA_BATCH_SIZE):
+                query = (delete_elements_query.replace("{graph_iri}", graph_iri)
+                                              .replace("{element_property}", element_property)
+                                              .replace("{subjects}", " ".join(subjects[i:i + DELTA_BATCH_SIZE])))
+                queries.append("DEFINE sql:log-enable 3\n" + query if is_virtuoso else query)
+            run_updates(queries)
+
+            relinked_triples = append_triples_of_subjects(output_file_path,
+                                                          added_triples_file_path,
+                                                          set(subjects),
+                                                          temporary_element_property)
+
+        entity_replacements = get_entity_replacement_iris()
+        replace_entity_iris(removed_triples_file_path, entity_replacements)
+        replace_entity_iris(added_triples_file_path, entity_replacements)
+
+        logging.info("Deleting the removed triples...")
+        run_data_updates("DELETE", removed_triples_file_path, graph_iri, is_virtuoso)
+
+        if added_triples + relinked_triples > DELTA_BULK_LOAD_MIN_TRIPLES:
+            logging.info("Bulk loading the added triples...")
+            rdf_datastore_client.run_sync(rdf_datastore_client.bulk_file_load([added_triples_file_path],
+                                                                              delete_files_after_upload=False,
+                                                                              graph_iri=graph_iri))
+        else:
+            logging.info("Inserting the added triples...")
+            run_data_updates("INSERT", added_triples_file_path, graph_iri, is_virtuoso)
+
+        os.replace(output_file_path, PREVIOUS_OUTPUT_FILE_PATH)
+        return {"full_load": False,
+                "removed_triples": removed_triples,
+                "added_triples": added_triples,
+                "relinked_triples": relinked_triples}
+
+    finally:
+        for file_path in [removed_triples_file_path, added_triples_file_path]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
@@ -0,0 +1,270 @@
+"""
+In-process alternative to RMLMapper/RMLStreamer. It reads the untemplated YARRRML files produced by fill_template_values,
+streams the rows of their SQL queries from the DB and writes the resulting triples straight to N-Triples files, avoiding
+the JVM startup, the YARRRML to RML conversion and the intermediate CSV files.
+
+Only the subset of YARRRML used by our mappings is supported:
+    - Subjects given as templates (e.g. object:$(SampleId)) or as a single reference holding a full IRI (e.g. $(sourceIRI))
+    - po lists of [predicate, object] or [predicate, object, datatype], where objects ending in ~iri are IRIs and
+      anything else is a literal. Predicates may also be templates or references (e.g. crc:$(propertyname))
+
+Following R2RML, values inserted into IRI templates are percent-encoded, whereas single references are used as they are.
+Triples referencing a NULL or empty value are not generated, as RMLMapper does with empty CSV cells.
+
+Unlike RMLMapper, triples are not deduplicated across rows. Duplicates are harmless once loaded into the datastore.
+"""
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+from tqdm import tqdm
+
+from datastores.sql.sql_db import MSSQLDB
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+# Untemplated YARRRML files only contain the prefixes in the first mapping, so we always load them from the source
+prefixes: dict[str, str] = yaml.safe_load("prefixes:\n" + open(os.path.join(module_dir, 'prefixes.yml')).read())["prefixes"]
+
+RDF_TYPE = "http://www.w3.org/1999/02/22-rdf-syntax-ns#type"
+
+# Rows fetched from the DB at once by each worker
+FETCH_BATCH_SIZE = 10_000
+
+reference_pattern = re.compile(r"\$\((.*?)\)")
+prefixed_name_pattern = re.compile(r"^([A-Za-z][\w.-]*):(?!//)(.*)$", re.DOTALL)
+iri_safe_pattern = re.compile(r"^[A-Za-z0-9\-._~]*$")
+
+
+class Template:
+    """
+    Pre-parsed YARRRML term template, alternating constant strings and column references
+    """
+    def __init__(self, template: str, is_iri: bool):
+        self.is_iri = is_iri
+
+        if is_iri:
+            template = expand_prefix(template)
+
+        self.parts: list[tuple[bool, str]] = [] # (is_reference, constant string or column name)
+        last_end = 0
+        for match in reference_pattern.finditer(template):
+            if match.start() > last_end:
+                self.parts.append((False, template[last_end:match.start()]))
+            self.parts.append((True, match.group(1)))
+            last_end = match.end()
+        if last_end < len(template):
+            self.parts.append((False, template[last_end:]))
+
+        # A single reference, such as $(sourceIRI), is used as it is even if it is an IRI
+        self.is_single_reference = len(self.parts) == 1 and self.parts[0][0]
+
+    def fill(self, row: dict) -> str | None:
+        """
+        Returns the value of the template for a row, or None if any of the referenced values is NULL or empty
+        """
+        values = []
+        for (is_reference, part) in self.parts:
+            if not is_reference:
+                values.append(part)
+                continue
+
+            value = format_value(row.get(part))
+            if value is None:
+                return None
+
+            if self.is_iri and not self.is_single_reference:
+                value = iri_safe(value)
+            values.append(value)
+
+        return "".join(values)
+
+    def pattern(self) -> re.Pattern:
+        """
+        Returns a regex matching the values of the template for any row. Values inserted into IRI templates are
+        percent-encoded, so they cannot span several path segments
+        """
+        if self.is_single_reference:
+            return re.compile(r".+", re.DOTALL)
+
+        reference_value = r"[^/?#<>\s]+" if self.is_iri else r".+?"
+        return re.compile("".join(reference_value if is_reference else re.escape(part)
+                                  for (is_reference, part) in self.parts), re.DOTALL)
+
+
+def expand_prefix(term: str) -> str:
+    match = prefixed_name_pattern.match(term)
+    if match and match.group(1) in prefixes:
+        return prefixes[match.group(1)] + match.group(2)
+    return term
+
+
+def format_value(value) -> str | None:
+    """
+    Converts a DB value to its string representation in the KG
+    """
+    if value is None:
+        return None
+
+    # Same as query_to_csv, whose CSV writer converts values via str() (e.g. 2024-01-31 12:00:00.123000 for datetimes),
+    # so that both engines generate the same triples. Multi-line strings are flattened
+    value = re.sub(r"[\r\n]+", " ", str(value))
+
+    return value if value != "" else None
+
+
+def iri_safe(value: str) -> str:
+    """
+    Percent-encodes every character of a value to be inserted into an IRI template, except for unreserved and non-ASCII
+    characters (IRI-safe version of the value, as defined by R2RML)
+    """
+    if iri_safe_pattern.match(value):
+        return value
+
+    return "".join(c if (c.isascii() and (c.isalnum() or c in "-._~")) or ord(c) >= 0xA0
+                   else "".join(f"%{b:02X}" for b in c.encode("utf-8"))
+                   for c in value)
+
+
+def escape_literal(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def compile_mappings(yarrrml_file: str) -> list[tuple[Template, list[tuple[Template, Template, str | None]]]]:
+    """
+    Parses an untemplated YARRRML file into a list of (subject template, [(predicate template, object template, datatype IRI)])
+    """
+    with open(yarrrml_file, 'r') as f:
+        yarrrml = yaml.safe_load(f)
+
+    compiled_mappings = []
+    for mapping_name, mapping in yarrrml["mappings"].items():
+        subject = Template(str(mapping["s"]), is_iri=True)
+
+        predicate_objects = []
+        for po in mapping.get("po", []):
+            if not isinstance(po, list) or len(po) not in (2, 3):
+                raise ValueError(f"{yarrrml_file}: Unsupported po entry in mapping {mapping_name}: {po}")
+
+            predicate = RDF_TYPE if po[0] == "a" else str(po[0])
+
+            o = str(po[1])
+            is_iri = o.endswith("~iri")
+            if is_iri:
+                o = o[:-len("~iri")]
+
+            datatype = expand_prefix(str(po[2])) if len(po) == 3 else None
+
+            predicate_objects.append((Template(predicate, is_iri=True), Template(o, is_iri=is_iri), datatype))
+
+        compiled_mappings.append((subject, predicate_objects))
+
+    return compiled_mappings
+
+
+def materialize_mapping_file(db: MSSQLDB,
+                             yarrrml_file: str,
+                             query: str,
+                             output_file: str) -> tuple[str, int, int, float]:
+    """
+    Executes the query of a mapping file and writes all triples generated for its rows to output_file, in N-Triples format
+
+    :returns: (yarrrml_file, number of rows the query returned, number of triples written, time spent (in s.))
+    """
+    start = time.perf_counter()
+    compiled_mappings = compile_mappings(yarrrml_file)
+
+    number_of_rows = 0
+    number_of_triples = 0
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for row in db.iterate_query(query, FETCH_BATCH_SIZE):
+            number_of_rows += 1
+
+            triples = []
+            for (subject_template, predicate_objects) in compiled_mappings:
+                subject = subject_template.fill(row)
+                if subject is None:
+                    continue
+
+                for (predicate_template, object_template, datatype) in predicate_objects:
+                    predicate = predicate_template.fill(row)
+                    o = object_template.fill(row)
+                    if predicate is None or o is None:
+                        continue
+
+                    if object_template.is_iri:
+                        o = f"<{o}>"
+                    elif datatype is not None:
+                        o = f"\"{escape_literal(o)}\"^^<{datatype}>"
+                    else:
+                        o = f"\"{escape_literal(o)}\""
+
+                    triples.append(f"<{subject}> <{predicate}> {o} .\n")
+
+            f.writelines(triples)
+            number_of_triples += len(triples)
+
+    # db is the copy sent to this worker process, its connection pool is not reused by other jobs
+    db.close()
+
+    if number_of_rows == 0:
+        logging.warning(f'A query returned no results ({yarrrml_file}). This may happen when, e.g., mappings for specific object types that are not used.')
+
+    return yarrrml_file, number_of_rows, number_of_triples, time.perf_counter() - start
+
+
+def run_python_engine(db: MSSQLDB,
+                      untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]],
+                      output_file: str) -> tuple[list[str], dict[str, dict[str, float]]]:
+    """
+    Materializes all mappings in parallel, writing their triples to output_file in N-Triples format
+
+    :param db: DB instance to run the queries against
+    :param untemplated_yarrrml_file_names_and_jobs: List of (untemplated YARRRML file path, SQL query to execute, _), obtained via `prepare_YARRRML_files()`.
+    :param output_file: File to write the triples of all mappings to
+
+    :returns: (the YARRRML files whose queries yielded results,
+               dict of YARRRML file name -> {"rows", "triples", "output_bytes", "materialization" (time in s.)})
+    """
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    part_files = {yarrrml_file: output_file.replace(".ttl", f"_part_{i}.nt")
+                  for i, (yarrrml_file, _, _) in enumerate(untemplated_yarrrml_file_names_and_jobs)}
+
+    yarrrml_files_with_results = []
+    metrics_per_mapping = dict()
+    with ProcessPoolExecutor(os.cpu_count()) as executor:
+        futures = [executor.submit(materialize_mapping_file, db, yarrrml_file, query, part_files[yarrrml_file])
+                   for (yarrrml_file, query, _) in untemplated_yarrrml_file_names_and_jobs]
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Mappings materialized", leave=True):
+            yarrrml_file, number_of_rows, number_of_triples, materialization_time = future.result()
+            if number_of_rows > 0:
+                yarrrml_files_with_results.append(yarrrml_file)
+            metrics_per_mapping[os.path.splitext(os.path.basename(yarrrml_file))[0]] = {
+                "rows": number_of_rows,
+                "triples": number_of_triples,
+                "output_bytes": os.path.getsize(part_files[yarrrml_file]),
+                "materialization": materialization_time
+            }
+
+    # Coalesce the results of each mapping in the same order as the mappings
+    with open(output_file, 'wb') as outfile:
+        for (yarrrml_file, _, _) in untemplated_yarrrml_file_names_and_jobs:
+            with open(part_files[yarrrml_file], 'rb') as infile:
+                while chunk := infile.read(1024 * 1024):
+                    outfile.write(chunk)
+            os.remove(part_files[yarrrml_file])
+
+    return yarrrml_files_with_results, metrics_per_mapping
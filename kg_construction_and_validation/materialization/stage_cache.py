@@ -0,0 +1,146 @@
+"""
+Module that caches the results of the stages of a run, keyed by fingerprints of their inputs, so that the stages whose
+inputs did not change since the last successful run are skipped:
+    - Templating: the templated YARRRML files, their SQL queries and prefixes.yml. The templating itself is cheap and
+      always runs, its fingerprint is part of the following ones
+    - SQL: the text of the mappings and staging queries, and a fingerprint of every table they read (see
+      incremental_materialization.get_table_fingerprints). If it matches, the queries and the mappings are skipped
+    - Mapping: the YARRRML files (and thus the RML files converted from them), the YARRRML parser version and the
+      hashes of the CSV files the queries yielded. If it matches, the mappings are skipped
+    - Upload: the hash of the output files and the version of the datastore graph they were loaded into (its number of
+      triples after the postprocessing). If it matches, the datastore already holds the KG, and clearing it, loading
+      the output and the postprocessing are skipped
+The SQL and mapping stages reuse the output files of the last run, kept (hard-linked if possible) in STAGE_OUTPUTS_DIR.
+Every fingerprint also covers the parameters of the run that affect the stage's result.
+
+Note: tables without _created/_updated columns are fingerprinted with checksums, whose collisions (or updates limited
+to columns of noncomparable types) go unnoticed, as do updates to the other tables that do not bump _updated. Deleting
+STAGE_FINGERPRINTS_FILE_PATH forces a complete run.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+STAGE_FINGERPRINTS_FILE_PATH = os.path.join(module_dir, 'incremental_state/stage_fingerprints.json')
+STAGE_OUTPUTS_DIR = os.path.join(module_dir, 'incremental_state/stage_outputs')
+
+# Buffer size used to hash files
+HASH_BUFFER_BYTES = 1024 * 1024
+
+# Entry of the fingerprints file listing the original paths of the output files kept in STAGE_OUTPUTS_DIR
+OUTPUT_FILES_ENTRY = "output_files"
+
+
+def fingerprint(*parts: str) -> str:
+    """
+    Returns a fingerprint (SHA-256 hex digest) of a sequence of strings
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(HASH_BUFFER_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(file_paths: list[str]) -> str:
+    """
+    Returns a fingerprint of the contents of several files, regardless of their order and location
+    """
+    return fingerprint(*sorted(hash_file(file_path) for file_path in file_paths))
+
+
+def load_fingerprints() -> dict[str, str | list[str]]:
+    """
+    Returns the fingerprints of the last successful run of every stage, see the module's documentation
+    """
+    if not os.path.exists(STAGE_FINGERPRINTS_FILE_PATH):
+        return dict()
+
+    with open(STAGE_FINGERPRINTS_FILE_PATH, 'r') as f:
+        return json.load(f)
+
+
+def save_fingerprints(fingerprints: dict[str, str | list[str]]):
+    """
+    Persists the fingerprints of the stages that completed successfully, keeping those of the other stages
+    """
+    os.makedirs(os.path.dirname(STAGE_FINGERPRINTS_FILE_PATH), exist_ok=True)
+
+    all_fingerprints = load_fingerprints()
+    all_fingerprints.update(fingerprints)
+    with open(STAGE_FINGERPRINTS_FILE_PATH, 'w') as f:
+        json.dump(all_fingerprints, f, indent=4)
+
+
+def discard_fingerprints(stages: list[str]):
+    """
+    Forgets the fingerprints of some stages, e.g. because their results were modified by other means
+    """
+    fingerprints = load_fingerprints()
+    if any(stage in fingerprints for stage in stages):
+        with open(STAGE_FINGERPRINTS_FILE_PATH, 'w') as f:
+            json.dump({stage: value for stage, value in fingerprints.items() if stage not in stages}, f, indent=4)
+
+
+def _link_or_copy(source_path: str, target_path: str):
+    if os.path.exists(target_path):
+        os.remove(target_path)
+    try:
+        os.link(source_path, target_path)
+    except OSError:
+        shutil.copy(source_path, target_path)
+
+
+def store_output_files(output_file_paths: list[str]):
+    """
+    Keeps the output files of a run in STAGE_OUTPUTS_DIR, so that later runs can restore them (see restore_output_files)
+    """
+    shutil.rmtree(STAGE_OUTPUTS_DIR, ignore_errors=True)
+    os.makedirs(STAGE_OUTPUTS_DIR)
+
+    for i, output_file_path in enumerate(output_file_paths):
+        _link_or_copy(output_file_path, os.path.join(STAGE_OUTPUTS_DIR, f"{i}_{os.path.basename(output_file_path)}"))
+
+    save_fingerprints({OUTPUT_FILES_ENTRY: output_file_paths})
+
+
+def restore_output_files() -> list[str] | None:
+    """
+    Places the output files kept by store_output_files back into their original paths
+
+    :returns: Their paths, or None if they are not available
+    """
+    output_file_paths = load_fingerprints().get(OUTPUT_FILES_ENTRY)
+    if output_file_paths is None:
+        return None
+
+    cached_file_paths = [os.path.join(STAGE_OUTPUTS_DIR, f"{i}_{os.path.basename(output_file_path)}")
+                         for i, output_file_path in enumerate(output_file_paths)]
+    if not all(os.path.exists(cached_file_path) for cached_file_path in cached_file_paths):
+        return None
+
+    for cached_file_path, output_file_path in zip(cached_file_paths, output_file_paths):
+        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+        _link_or_copy(cached_file_path, output_file_path)
+
+    return output_file_paths
@@ -0,0 +1,22 @@
+/* Compositions of MLs, alongside the EDX measurement they have been parsed from and their measurement area */
+SELECT
+vro.vroObjectLinkObject.ObjectId AS MLId,
+compositionInfo.ObjectId AS CompositionId,
+compositionInfo._created AS CompositionDate,
+originalMeasurement.ObjectId AS OriginalMeasurementId,
+compositionLocation.Value AS MeasurementArea
+FROM vro.vroObjectLinkObject
+/* Composition information */
+JOIN vro.vroObjectInfo compositionInfo ON compositionInfo.ObjectId = vro.vroObjectLinkObject.LinkedObjectId
+/* ML information */
+JOIN vro.vroObjectInfo MLInfo ON MLInfo.ObjectId = vro.vroObjectLinkObject.ObjectId
+/* The original measurement the composition has been parsed from points to the composition's object */
+JOIN vro.vroObjectLinkObject originalMeasurement ON originalMeasurement.LinkedObjectId = vro.vroObjectLinkObject.LinkedObjectId
+/* Original measurement's information */
+JOIN vro.vroObjectInfo originalMeasurementInfo ON originalMeasurement.ObjectId = originalMeasurementInfo.ObjectId
+/* Composition's location */
+JOIN vro.vroPropertyInt compositionLocation ON compositionLocation.ObjectId = vro.vroObjectLinkObject.LinkedObjectId
+WHERE MLInfo.TypeId = 6 /* Sample */
+AND compositionInfo.TypeId = 8 /* Composition */
+AND originalMeasurementInfo.TypeId IN (13, 15, 19, 53, 78, 79) /* EDX */
+AND compositionLocation.propertyName IN ('Measurement Area', 'MeasurementArea')
@@ -0,0 +1,10 @@
+/* Handovers of each ML in order of creation, alongside their position in the chain and the handover that follows them */
+SELECT H.HandoverId,
+H.SampleObjectId,
+O._created AS HandoverDate,
+ROW_NUMBER() OVER (PARTITION BY H.SampleObjectId ORDER BY O._created, H.HandoverId) AS ChainPosition,
+LEAD(H.HandoverId) OVER (PARTITION BY H.SampleObjectId ORDER BY O._created, H.HandoverId) AS NextHandoverId
+FROM vro.vroHandover H
+/* ObjectInfo of the handover */
+JOIN vro.vroObjectInfo O ON H.HandoverId = O.ObjectId
+WHERE O.TypeId = -1
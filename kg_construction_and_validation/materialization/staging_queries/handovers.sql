@@ -0,0 +1,7 @@
+/* Handovers alongside their creation date and the ML they refer to */
+SELECT vro.vroObjectInfo.objectId AS handoverId,
+vro.vroObjectInfo._created AS handoverDate,
+vro.vroHandover.sampleObjectId AS MLId
+FROM vro.vroObjectInfo
+JOIN vro.vroHandover ON vro.vroObjectInfo.objectId = vro.vroHandover.handoverid
+WHERE vro.vroObjectInfo.typeId = -1
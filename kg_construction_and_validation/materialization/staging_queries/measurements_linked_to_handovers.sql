@@ -0,0 +1,5 @@
+/* Measurements that are directly linked to a handover */
+SELECT DISTINCT vro.vroObjectLinkObject.LinkedObjectId AS MeasurementId
+FROM vro.vroObjectLinkObject
+JOIN vro.vroObjectInfo s on vro.vroObjectLinkObject.ObjectId = s.ObjectId
+WHERE s.TypeId = -1
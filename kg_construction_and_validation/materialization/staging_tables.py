@@ -0,0 +1,123 @@
+"""
+Module that handles the staging tables shared by the mappings queries.
+
+Several mappings recompute the same expensive subqueries (e.g. the chain of handovers of each ML, or the compositions
+parsed from EDX measurements). These are declared once in staging_queries/{name}.sql and referenced from the mappings
+queries as {staging.{name}}, e.g.:
+
+    JOIN {staging.handover_chains} HandoverChain ON ...
+
+At the beginning of each run, every staging query referenced by the mappings is materialized into an indexed table,
+and the references are replaced by the table's name. The tables are dropped at the end of the run.
+
+The remote production endpoint does not allow creating tables, so there the references are replaced by the staging
+queries themselves, as derived tables.
+
+How to add a new staging table:
+    - Create a staging_queries/{name}.sql file containing its query. As with the mappings queries, inline comments
+      are not allowed
+    - Add {name} to staging_tables in this file, alongside the columns to index
+"""
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from datastores.sql.sql_db import MSSQLDB
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+STAGING_TABLE_PREFIX = "materialization_staging_"
+
+# Staging query name -> lists of columns to index, the first one being the clustered index.
+# They should cover the columns the mappings queries join on
+staging_tables: dict[str, list[list[str]]] = {
+    "handover_chains": [["SampleObjectId", "ChainPosition"], ["HandoverId"]],
+    "handovers": [["MLId", "handoverDate"]],
+    "measurements_linked_to_handovers": [["MeasurementId"]],
+    "edx_compositions": [["CompositionId"], ["MLId", "CompositionDate"]],
+}
+
+staging_reference_pattern = re.compile(r"\{staging\.(\w+)\}")
+
+
+def get_staging_query(name: str) -> str:
+    with open(os.path.join(module_dir, f'staging_queries/{name}.sql'), 'r') as f:
+        return f.read()
+
+
+def get_referenced_staging_tables(queries: list[str]) -> list[str]:
+    """
+    Returns the names of the staging tables referenced by any of the queries, in declaration order
+    """
+    referenced_names = set()
+    for query in queries:
+        referenced_names.update(staging_reference_pattern.findall(query))
+
+    unknown_names = referenced_names - staging_tables.keys()
+    if len(unknown_names) > 0:
+        raise ValueError(f"Reference to undeclared staging tables: {sorted(unknown_names)}")
+
+    return [name for name in staging_tables.keys() if name in referenced_names]
+
+
+def create_staging_tables(db: MSSQLDB,
+                          untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]]) -> dict[str, str]:
+    """
+    Materializes every staging table referenced by the mappings queries, in parallel
+
+    :param db: DB instance to create the staging tables in
+    :param untemplated_yarrrml_file_names_and_jobs: List of (_, SQL query to execute, _), obtained via `prepare_YARRRML_files()`.
+
+    :return: Dict of staging table name -> replacement for its references, to be applied via `resolve_staging_tables()`.
+             The replacement is either the name of the created table or, if the DB is remote, the staging query itself
+    """
+    names = get_referenced_staging_tables([query for (_, query, _) in untemplated_yarrrml_file_names_and_jobs])
+    if len(names) == 0:
+        return dict()
+
+    if db.is_remote:
+        logging.info("Staging tables cannot be created in the remote endpoint, their queries will be inlined instead.")
+        return {name: f"(\n{get_staging_query(name)}\n)" for name in names}
+
+    logging.info(f"Creating staging tables: {', '.join(names)}...")
+    with ThreadPoolExecutor(len(names)) as executor:
+        futures = [executor.submit(db.create_staging_table,
+                                   STAGING_TABLE_PREFIX + name,
+                                   get_staging_query(name),
+                                   staging_tables[name])
+                   for name in names]
+        for future in futures:
+            future.result()
+
+    return {name: STAGING_TABLE_PREFIX + name for name in names}
+
+
+def resolve_staging_tables(untemplated_yarrrml_file_names_and_jobs: list[tuple[str, str, str]],
+                           replacements: dict[str, str]) -> list[tuple[str, str, str]]:
+    """
+    Replaces the references to staging tables of the mappings queries, see `create_staging_tables()`
+    """
+    return [(yarrrml_file,
+             staging_reference_pattern.sub(lambda match: replacements[match.group(1)], query),
+             csv_file)
+            for (yarrrml_file, query, csv_file) in untemplated_yarrrml_file_names_and_jobs]
+
+
+def drop_staging_tables(db: MSSQLDB, replacements: dict[str, str]):
+    """
+    Drops the staging tables created by `create_staging_tables()`
+    """
+    if db.is_remote:
+        return
+
+    for table_name in replacements.values():
+        db.drop_table(table_name)
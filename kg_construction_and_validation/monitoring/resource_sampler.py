@@ -0,0 +1,386 @@
+"""
+Resource usage sampler shared by all phases of the pipeline (materialization, postprocessing...).
+
+Instead of scanning every process of the host, it only samples explicit PID trees:
+    - The pipeline itself, i.e. this process and all of its descendants (SQL query threads, Python engine workers,
+      RMLMapper/RMLStreamer JVMs...). Each JVM is also reported on its own, identified by its output file
+    - Services running alongside the pipeline (the MSSQL DB, the RDF datastore...), see MonitoredService. If they run
+      in a docker container and the host uses cgroup v2, their figures are read from the container's cgroup, which
+      also accounts for the memory of the page cache and the I/O of all of its processes. Otherwise, the process tree
+      of the container (or of the first process matching their name) is sampled instead
+
+Each sample records the CPU usage (%), the memory in use and the cumulative I/O (bytes read and written) of every
+target, the cumulative network counters of the host (or of the services' network namespace), and the stage of the
+pipeline being executed at the time (see ResourceSampler.set_stage).
+
+The samples are returned as a columnar time series, i.e. a dict of column -> list of values, one per sample:
+    {"timestamp": [...], "stage": [...], "host.cpu_percent": [...], "pipeline.rss_bytes": [...], ...}
+Columns of targets that appear later in the run (e.g. a JVM) hold None for the samples taken before.
+
+How to use it:
+    sampler = ResourceSampler({"sql_server": MonitoredService(db.get_docker_container_id(), "sqlservr")})
+    sampler.start()
+    sampler.set_stage("queries")
+    ...
+    resource_usage = sampler.stop()
+"""
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import psutil
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+# Seconds between samples
+DEFAULT_SAMPLING_INTERVAL = 1.0
+
+# Seconds between lookups of a service that was not found (e.g. its container is still starting)
+SERVICE_LOOKUP_INTERVAL = 30.0
+
+CGROUP_V2_ROOT = "/sys/fs/cgroup"
+
+# Whether the kernel lists the children of each thread in /proc
+PROC_LISTS_CHILDREN = os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+
+
+@dataclass
+class MonitoredService:
+    """
+    Service sampled alongside the pipeline
+
+    :param docker_container: Name or ID of its docker container, if it runs in one
+    :param process_name: Substring of the command line of its main process, used if it does not run in a container or
+                         the container cannot be inspected (e.g. sqlservr, virtuoso-t)
+    """
+    docker_container: str | None
+    process_name: str
+
+
+def get_descendant_pids(pid: int) -> list[int]:
+    """
+    Returns the PIDs of all descendants of a process. On Linux, they are read from /proc/{pid}/task/{tid}/children
+    instead of reading the parent of every process of the host, as psutil does
+    """
+    if not PROC_LISTS_CHILDREN:
+        try:
+            return [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return []
+
+    descendants = []
+    pending = [pid]
+    while len(pending) > 0:
+        current = pending.pop()
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children", 'r') as f:
+                    children = [int(child) for child in f.read().split()]
+                descendants += children
+                pending += children
+        except OSError:
+            # The process (or thread) finished meanwhile
+            continue
+
+    return descendants
+
+
+def inspect_docker_container(docker_container: str) -> int | None:
+    """
+    Returns the PID of the main process of a running docker container, or None if it cannot be inspected
+    """
+    try:
+        result = subprocess.run(["docker", "inspect", "--format", "{{.State.Pid}}", docker_container],
+                                capture_output=True,
+                                text=True,
+                                check=False,
+                                timeout=5)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    if result.returncode != 0 or not result.stdout.strip().isdigit() or int(result.stdout.strip()) == 0:
+        return None
+    return int(result.stdout.strip())
+
+
+def get_cgroup_v2_path(pid: int) -> str | None:
+    """
+    Returns the cgroup v2 folder of a process, or None if the host does not use cgroup v2
+    """
+    try:
+        with open(f"/proc/{pid}/cgroup", 'r') as f:
+            for line in f:
+                # cgroup v2 entries have the form 0::/path
+                if line.startswith("0::"):
+                    path = os.path.join(CGROUP_V2_ROOT, line.strip()[len("0::"):].lstrip("/"))
+                    if os.path.exists(os.path.join(path, "cpu.stat")):
+                        return path
+    except OSError:
+        pass
+    return None
+
+
+def read_network_counters(pid: int | None = None) -> tuple[int, int] | None:
+    """
+    Returns the (bytes sent, bytes received) of every interface but the loopback of the network namespace of a process,
+    or of the host if no PID is given
+    """
+    if pid is None:
+        counters = psutil.net_io_counters()
+        return counters.bytes_sent, counters.bytes_recv
+
+    try:
+        with open(f"/proc/{pid}/net/dev", 'r') as f:
+            lines = f.readlines()[2:]
+    except OSError:
+        return None
+
+    sent, received = 0, 0
+    for line in lines:
+        interface, values = line.split(":", 1)
+        if interface.strip() == "lo":
+            continue
+        values = values.split()
+        received += int(values[0])
+        sent += int(values[8])
+    return sent, received
+
+
+class ResourceSampler:
+    """
+    Samples the resource usage of the pipeline and its services in a background thread. See the module's documentation
+    """
+    def __init__(self,
+                 services: dict[str, MonitoredService] | None = None,
+                 interval: float = DEFAULT_SAMPLING_INTERVAL):
+        """
+        :param services: Dict of label -> service to sample alongside the pipeline. The label prefixes its columns
+        :param interval: Seconds between samples
+        """
+        self.services = services if services is not None else dict()
+        self.interval = interval
+
+        self.stage = ""
+        self.columns: dict[str, list] = {"timestamp": [], "stage": []}
+        self.number_of_samples = 0
+
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # Processes are kept across samples, as their CPU usage is measured since the previous call
+        self._processes: dict[int, psutil.Process] = dict()
+        self._jvm_labels: dict[int, str | None] = dict()
+
+        # Label -> (PID of the service's main process, its cgroup v2 folder or None)
+        self._service_roots: dict[str, tuple[int, str | None]] = dict()
+        self._service_lookup_times: dict[str, float] = dict()
+        # Label -> (time, CPU usage in µs.) of the previous sample of the service's cgroup
+        self._cgroup_cpu_usages: dict[str, tuple[float, int]] = dict()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def set_stage(self, stage: str):
+        """
+        Sets the stage of the pipeline the following samples are tagged with
+        """
+        self.stage = stage
+
+    def stop(self) -> dict[str, list]:
+        """
+        Takes a last sample, stops the sampler and returns the time series, see the module's documentation
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        return self.columns
+
+    def _run(self):
+        psutil.cpu_percent(interval=None)
+        while not self._stop_event.is_set():
+            self._sample_safely()
+            self._stop_event.wait(self.interval)
+
+        # Last sample, once the stage being measured has finished
+        self._sample_safely()
+
+    def _sample_safely(self):
+        try:
+            self._sample()
+        except Exception as e:
+            # Sampling must never stop the pipeline. Values recorded by the failed sample are discarded
+            logging.warning(f"Could not sample the resource usage: {e}")
+            for values in self.columns.values():
+                del values[self.number_of_samples:]
+
+    def _record(self, column: str, value):
+        values = self.columns.setdefault(column, [])
+        # Pad the samples taken before the column first appeared
+        values.extend([None] * (self.number_of_samples - len(values)))
+        values.append(value)
+
+    def _sample_processes(self, prefix: str, pids: list[int]):
+        """
+        Records the aggregated CPU, RSS and I/O of a set of processes
+        """
+        cpu_percent, rss, read_bytes, write_bytes = 0.0, 0, 0, 0
+        for pid in pids:
+            process = self._processes.get(pid)
+            try:
+                if process is None:
+                    process = psutil.Process(pid)
+                    self._processes[pid] = process
+                    # The first call only sets the reference point of the CPU usage
+                    process.cpu_percent(interval=None)
+
+                with process.oneshot():
+                    process_cpu_percent = process.cpu_percent(interval=None)
+                    process_rss = process.memory_info().rss
+                    try:
+                        io_counters = process.io_counters()
+                        process_read_bytes, process_write_bytes = io_counters.read_bytes, io_counters.write_bytes
+                    except (psutil.AccessDenied, AttributeError):
+                        process_read_bytes, process_write_bytes = 0, 0
+            except psutil.Error:
+                self._processes.pop(pid, None)
+                continue
+
+            cpu_percent += process_cpu_percent
+            rss += process_rss
+            read_bytes += process_read_bytes
+            write_bytes += process_write_bytes
+
+            if prefix == "pipeline":
+                self._sample_jvm(process, process_cpu_percent, process_rss)
+
+        self._record(f"{prefix}.cpu_percent", cpu_percent)
+        self._record(f"{prefix}.rss_bytes", rss)
+        self._record(f"{prefix}.read_bytes", read_bytes)
+        self._record(f"{prefix}.write_bytes", write_bytes)
+
+    def _sample_jvm(self, process: psutil.Process, cpu_percent: float, rss: int):
+        """
+        Records the CPU and RSS of a JVM of the pipeline on their own, labelled after their output file
+        """
+        if process.pid not in self._jvm_labels:
+            label = None
+            try:
+                if process.name() == "java":
+                    cmdline = process.cmdline()
+                    label = Path(cmdline[cmdline.index("-o") + 1]).stem if "-o" in cmdline else str(process.pid)
+            except (psutil.Error, IndexError):
+                pass
+            self._jvm_labels[process.pid] = label
+
+        label = self._jvm_labels[process.pid]
+        if label is not None:
+            self._record(f"jvm.{label}.cpu_percent", cpu_percent)
+            self._record(f"jvm.{label}.rss_bytes", rss)
+
+    def _find_service(self, label: str, service: MonitoredService) -> tuple[int, str | None] | None:
+        """
+        Returns the (PID of the main process, cgroup v2 folder or None) of a service, looking it up if needed
+        """
+        if label in self._service_roots:
+            (pid, cgroup_path) = self._service_roots[label]
+            if psutil.pid_exists(pid):
+                return pid, cgroup_path
+            del self._service_roots[label]
+
+        if time.monotonic() - self._service_lookup_times.get(label, -SERVICE_LOOKUP_INTERVAL) < SERVICE_LOOKUP_INTERVAL:
+            return None
+        self._service_lookup_times[label] = time.monotonic()
+
+        pid = None
+        if service.docker_container is not None:
+            pid = inspect_docker_container(service.docker_container)
+        if pid is None:
+            for process in psutil.process_iter(['cmdline']):
+                cmdline = process.info['cmdline']
+                if cmdline and any(service.process_name in arg for arg in cmdline):
+                    pid = process.pid
+                    break
+        if pid is None:
+            return None
+
+        cgroup_path = get_cgroup_v2_path(pid) if service.docker_container is not None else None
+        self._service_roots[label] = (pid, cgroup_path)
+        return pid, cgroup_path
+
+    def _sample_cgroup(self, label: str, cgroup_path: str):
+        """
+        Records the CPU, memory and I/O of a cgroup v2
+        """
+        with open(os.path.join(cgroup_path, "cpu.stat"), 'r') as f:
+            cpu_usage = next(int(line.split()[1]) for line in f if line.startswith("usage_usec"))
+        now = time.monotonic()
+
+        cpu_percent = 0.0
+        if label in self._cgroup_cpu_usages:
+            (previous_time, previous_cpu_usage) = self._cgroup_cpu_usages[label]
+            if now > previous_time:
+                cpu_percent = (cpu_usage - previous_cpu_usage) / ((now - previous_time) * 1_000_000) * 100
+        self._cgroup_cpu_usages[label] = (now, cpu_usage)
+
+        with open(os.path.join(cgroup_path, "memory.current"), 'r') as f:
+            memory = int(f.read())
+
+        read_bytes, write_bytes = 0, 0
+        if os.path.exists(os.path.join(cgroup_path, "io.stat")):
+            with open(os.path.join(cgroup_path, "io.stat"), 'r') as f:
+                for line in f:
+                    for entry in line.split()[1:]:
+                        key, value = entry.split("=")
+                        if key == "rbytes":
+                            read_bytes += int(value)
+                        elif key == "wbytes":
+                            write_bytes += int(value)
+
+        self._record(f"{label}.cpu_percent", cpu_percent)
+        self._record(f"{label}.rss_bytes", memory)
+        self._record(f"{label}.read_bytes", read_bytes)
+        self._record(f"{label}.write_bytes", write_bytes)
+
+    def _sample(self):
+        self._record("timestamp", time.time())
+        self._record("stage", self.stage)
+        self._record("host.cpu_percent", psutil.cpu_percent(interval=None))
+
+        (sent, received) = read_network_counters()
+        self._record("host.net_sent_bytes", sent)
+        self._record("host.net_recv_bytes", received)
+
+        own_pid = os.getpid()
+        self._sample_processes("pipeline", [own_pid] + get_descendant_pids(own_pid))
+
+        for label, service in self.services.items():
+            service_root = self._find_service(label, service)
+            if service_root is None:
+                continue
+            (pid, cgroup_path) = service_root
+
+            if cgroup_path is not None:
+                self._sample_cgroup(label, cgroup_path)
+            else:
+                self._sample_processes(label, [pid] + get_descendant_pids(pid))
+
+            if service.docker_container is not None and (network_counters := read_network_counters(pid)) is not None:
+                self._record(f"{label}.net_sent_bytes", network_counters[0])
+                self._record(f"{label}.net_recv_bytes", network_counters[1])
+
+        self.number_of_samples += 1
+        # Columns of targets that were not found in this sample (e.g. a finished JVM) are padded with None
+        for values in self.columns.values():
+            values.extend([None] * (self.number_of_samples - len(values)))
@@ -18,16 +18,16 @@ from datetime import datetime
 import json
 import logging
 import os
+import re
 import sys
 from concurrent.futures import as_completed, ProcessPoolExecutor
 
-import psutil
-import multiprocessing
 from rdflib import Graph, Literal, URIRef
 from rdflib.namespace import split_uri, Namespace
 from tqdm import tqdm
 
-from datastores.rdf import rdf_datastore_client
+from datastores.rdf import rdf_datastore_client, qlever_datastore, virtuoso_datastore
+from monitoring.resource_sampler import MonitoredService, ResourceSampler
 
 HANDOVER_GROUP_CREATION_CHUNK_SIZE = 10_000
 CROSS_GROUP_CHAIN_CREATION_CHUNK_SIZE = 10_000
@@ -98,26 +98,6 @@ def is_rdf_store_virtuoso():
     return rdf_datastore_client.run_sync(rdf_datastore_client.get_datastore_type()) == "virtuoso"
 
 
-def resource_usage_job(stop_event, resource_usage):
-    while not stop_event.is_set():
-        cpu = psutil.cpu_percent(interval=1)
-
-        if is_rdf_store_virtuoso():
-            process_name = "virtuoso-t"
-        else:
-            process_name = "oxigraph"
-
-        used_mem = 0
-        for proc in psutil.process_iter(['cmdline', 'memory_info']):
-            try:
-                if proc.info['cmdline'] and any(process_name in arg for arg in proc.info['cmdline']):
-                    used_mem += proc.info['memory_info'].rss
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
-
-        resource_usage.append((cpu, used_mem))
-
-
 def create_handover_group_triples(worker_id: int, chains_batch: list[(str, (str, str, str, str, str, str))]) -> str:
     """
     Creates handover group triples for a batch of (sample_id, (hnd_start, hnd_start_id, hnd_end, hnd_end_id, hnd_start_date, project_iri))
@@ -312,6 +292,19 @@ def create_handover_group_chains():
 
     return performance_log
 
+def get_entity_replacement_iris() -> dict[str, str]:
+    """
+    Returns the entity replacements (see entity_replacements) as full IRIs, as they appear in the materialized triples
+    """
+    namespaces = dict(re.findall(r"PREFIX\s+(\w*):\s*<([^>]*)>", prefixes))
+
+    def expand(prefixed_name: str) -> str:
+        (prefix, local_name) = prefixed_name.split(":", 1)
+        return namespaces[prefix] + local_name
+
+    return {expand(old_iri): expand(new_iri) for old_iri, new_iri in entity_replacements.items()}
+
+
 def replace_entity_iris():
     """
     Replace entity IRIs in the KG. Currently used to have clearer IRI names for measurement types
@@ -381,26 +374,28 @@ def run_postprocessing() -> (dict[str, float], list[(float, float)]):
     :return: Tuple containing:
                 - A dict of file path -> time_measurement_identifier -> time measurement (in s.), containing execution time
                   logs for the different phases of the postprocessing pipeline
-                - A list of pairs of (cpu_percent_usage, bytes_of_memory_used) taken every second for the duration of this function
+                - The resource usage of the pipeline and the RDF datastore for the duration of this function, as a
+                  columnar time series tagged with the step being executed (see monitoring/resource_sampler.py)
     """
-    manager = multiprocessing.Manager()
-    resource_usage = manager.list()
-    stop_event = multiprocessing.Event()
-
-    resource_usage_tracker = multiprocessing.Process(
-        target=resource_usage_job,
-        args=(stop_event, resource_usage)
-    )
-    resource_usage_tracker.start()
+    if is_rdf_store_virtuoso():
+        rdf_store_service = MonitoredService(virtuoso_datastore.DOCKER_CONTAINER_NAME, "virtuoso-t")
+    else:
+        rdf_store_service = MonitoredService(qlever_datastore.DOCKER_CONTAINER_NAME, "qlever")
+
+    resource_sampler = ResourceSampler({"rdf_store": rdf_store_service})
+    resource_sampler.start()
     time.sleep(1.0) # Give enough time to catch a trace of the datastore *before* running any queries
 
     performance_log = dict()
 
+    resource_sampler.set_stage("handover_chains")
     performance_log_handover_chains = create_handover_group_chains()
 
+    resource_sampler.set_stage("chebi_integration")
     performance_log_chebi_integration = integrate_with_CheBI()
 
     logging.info("Replacing temporary entity IRIs...")
+    resource_sampler.set_stage("replace_temporary_entity_iris")
     start = time.perf_counter()
     replace_entity_iris()
     performance_log["replace_temporary_entity_iris"] = time.perf_counter() - start
@@ -410,10 +405,8 @@ def run_postprocessing() -> (dict[str, float], list[(float, float)]):
     performance_log = performance_log | performance_log_chebi_integration
 
     time.sleep(1.0)  # Give enough time to catch a trace of the datastore *after* running all postprocessing queries
-    stop_event.set()
-    resource_usage_tracker.join()
 
-    return performance_log, list(resource_usage)
+    return performance_log, resource_sampler.stop()
 
 
 
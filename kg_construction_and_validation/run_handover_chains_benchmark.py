@@ -0,0 +1,193 @@
+"""
+Benchmarks the two forms of the query finding the next handover of each handover (see
+materialization/mappings/handovers/handover_chains.sql) on synthetic DBs of increasing size:
+    - Correlated subquery: the former form, which joins each handover with all later handovers of the same ML and then
+      picks the earliest one via a correlated MIN() subquery (see
+      performance_test/queries/handover_chains_correlated_subquery.sql). Quadratic in the number of handovers per ML
+    - Staging table: the handover_chains staging table, which numbers the handovers of each ML and obtains the next one
+      via LEAD() in a single pass, and the mappings query reading from it. The creation of the table is timed separately
+
+Both forms are checked to yield the same (handover, next handover) pairs. Handovers of the same ML created at the exact
+same time are chained in the order of their IDs by the staging table, whereas the correlated subquery links them to all
+handovers sharing the next creation date, so results may differ in that case.
+
+The synthetic DBs are obtained as in run_performance_test.py (restoring the backup of the same DB state, or generating
+it) from one of the run configurations. Results are saved to a .json file. Assumes no other container is running.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from datastores.sql.sql_db import MSSQLDB
+from materialization.staging_tables import STAGING_TABLE_PREFIX, get_staging_query, resolve_staging_tables, staging_tables
+from run_performance_test import (DEFAULT_RUNS_CONFIG_FILE, get_db_state_identifier, get_multiplier,
+                                  get_runs_configuration_from_file, reset_sql_db)
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+module_dir = os.path.dirname(__file__)
+
+DEFAULT_NUM_MAIN_SAMPLES = [10_000, 100_000, 1_000_000]
+DEFAULT_REPETITIONS = 3
+
+STAGING_TABLE_NAME = "handover_chains"
+
+correlated_subquery_query = open(
+    os.path.join(module_dir, './performance_test/queries/handover_chains_correlated_subquery.sql')).read()
+staging_table_query = open(
+    os.path.join(module_dir, './materialization/mappings/handovers/handover_chains.sql')).read()
+
+n_handovers_query = "SELECT COUNT(*) AS n_handovers FROM vro.vroHandover"
+
+
+def time_query_to_csv(sql_db: MSSQLDB, query: str, csv_filename: str) -> tuple[float, int]:
+    """
+    Executes a query as the mappings do (streaming its results to a CSV file)
+
+    :return: (Execution time in s., number of rows)
+    """
+    start = time.perf_counter()
+    (_, _, rows, _) = sql_db.query_to_csv(query, csv_filename)
+    return time.perf_counter() - start, rows
+
+
+def read_pairs(csv_filename: str) -> set[tuple[str, str]]:
+    if not os.path.exists(csv_filename):  # No results
+        return set()
+
+    with open(csv_filename, 'r', encoding='utf-8') as f:
+        next(f)
+        return {tuple(line.rstrip("\n").split(",")) for line in f}
+
+
+def run_handover_chains_benchmark(sql_db: MSSQLDB, repetitions: int) -> dict:
+    """
+    Times both forms of the handover chains query on the current DB, see the module's documentation
+
+    :return: Dict with the number of handovers, the times of every repetition of each form and whether their results match
+    """
+    results = {
+        "n_handovers": sql_db.query_to_records(n_handovers_query)[0]["n_handovers"],
+        "correlated_subquery": [],
+        "staging_table_creation": [],
+        "staging_table_query": [],
+    }
+
+    table_name = STAGING_TABLE_PREFIX + STAGING_TABLE_NAME
+    [(_, query, _)] = resolve_staging_tables([("", staging_table_query, "")], {STAGING_TABLE_NAME: table_name})
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        correlated_csv = os.path.join(temp_dir, "correlated_subquery.csv")
+        staging_csv = os.path.join(temp_dir, "staging_table.csv")
+
+        try:
+            for i in range(repetitions):
+                logging.info(f"Repetition {i + 1}/{repetitions}: correlated subquery...")
+                (correlated_time, correlated_rows) = time_query_to_csv(sql_db, correlated_subquery_query, correlated_csv)
+                results["correlated_subquery"].append(correlated_time)
+
+                logging.info(f"Repetition {i + 1}/{repetitions}: staging table...")
+                start = time.perf_counter()
+                sql_db.create_staging_table(table_name,
+                                            get_staging_query(STAGING_TABLE_NAME),
+                                            staging_tables[STAGING_TABLE_NAME])
+                results["staging_table_creation"].append(time.perf_counter() - start)
+
+                (staging_time, staging_rows) = time_query_to_csv(sql_db, query, staging_csv)
+                results["staging_table_query"].append(staging_time)
+
+                logging.info(f"Correlated subquery: {correlated_time:.2f} s. ({correlated_rows} rows), "
+                             f"staging table: {results['staging_table_creation'][-1]:.2f} s. creation + "
+                             f"{staging_time:.2f} s. query ({staging_rows} rows)")
+        finally:
+            sql_db.drop_table(table_name)
+
+        results["same_results"] = read_pairs(correlated_csv) == read_pairs(staging_csv)
+        if not results["same_results"]:
+            logging.warning("Both forms yielded different handover chains, see the module's documentation")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--log_file",
+        required=True,
+        help="Path of the .json file to store the results in"
+    )
+
+    parser.add_argument(
+        "--runs_configuration_file",
+        required=False,
+        default=DEFAULT_RUNS_CONFIG_FILE,
+        help="Path of the runs configuration file to generate the synthetic DBs from (see run_performance_test.py)"
+    )
+
+    parser.add_argument(
+        "--run_configuration_index",
+        required=False,
+        type=int,
+        default=0,
+        help="Index of the run configuration to generate the synthetic DBs from"
+    )
+
+    parser.add_argument(
+        "--num_main_samples",
+        required=False,
+        type=int,
+        nargs="+",
+        default=DEFAULT_NUM_MAIN_SAMPLES,
+        help="Sizes (number of main samples) of the synthetic DBs to benchmark"
+    )
+
+    parser.add_argument(
+        "--repetitions",
+        required=False,
+        type=int,
+        default=DEFAULT_REPETITIONS,
+        help="Number of times each form of the query is timed on each DB"
+    )
+
+    args = parser.parse_args()
+
+    run_config = get_runs_configuration_from_file(args.runs_configuration_file)[args.run_configuration_index]
+    multiplier = get_multiplier(run_config)
+    if multiplier is None:
+        raise ValueError(f"Run configuration {args.run_configuration_index} does not use any of the tested multipliers")
+
+    sql_db = MSSQLDB()
+    benchmark_results = []
+
+    try:
+        for num_main_samples in args.num_main_samples:
+            logging.info(f"Benchmarking the handover chains query with {num_main_samples} main samples...")
+
+            # Same DB states as the performance test, so that their backups are reused
+            backup_identifier = get_db_state_identifier(num_main_samples, multiplier)
+            # Each DB is benchmarked once, so no snapshot is kept for it
+            reset_sql_db(sql_db, run_config, num_main_samples, backup_identifier, keep_snapshot=False)
+            if not sql_db.database_backup_exists(backup_identifier):
+                logging.info("Backing up the SQL DB...")
+                sql_db.dump_database(backup_identifier)
+
+            results = run_handover_chains_benchmark(sql_db, args.repetitions)
+            results["num_main_samples"] = num_main_samples
+            benchmark_results.append(results)
+
+            with open(args.log_file, "w") as f:
+                json.dump(benchmark_results, f, indent=4)
+    finally:
+        if sql_db.get_docker_container_id() is not None:
+            sql_db.stop_DB()
@@ -0,0 +1,101 @@
+"""
+Runs the index advisor (see materialization/index_advisor.py) on a DB: executes every mappings query collecting its
+actual execution plans, proposes covering indexes from the missing indexes reported by the optimizer and, optionally,
+creates them and times the queries again.
+
+Writes a .json report with the times, scans, seeks and missing indexes of every query (before and after creating the
+indexes), and a .sql file with the proposed indexes, in the format of datastores/sql/additional_indexes.sql.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from datastores.sql.sql_db import MSSQLDB
+from materialization.index_advisor import run_index_advisor
+
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format='[%(asctime)s] %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--db_option",
+        type=str,
+        default=None,
+        required=False,
+        help="Database to use (see main.py). If none provided, it will be asked via CLI. The remote production endpoint is not supported"
+    )
+
+    parser.add_argument(
+        "--skip_db_setup",
+        action="store_true",
+        default=False,
+        help="Skip the database setup, assuming it is already running instead"
+    )
+
+    parser.add_argument(
+        "--report_file",
+        required=True,
+        help="Path of the .json file to store the report in"
+    )
+
+    parser.add_argument(
+        "--proposals_file",
+        required=False,
+        default=None,
+        help="Path of the .sql file to store the proposed indexes in. Defaults to the report file, with the .sql extension"
+    )
+
+    parser.add_argument(
+        "--create_indexes",
+        action="store_true",
+        default=False,
+        help="Create the proposed indexes in the DB, and time the queries again afterwards"
+    )
+
+    parser.add_argument(
+        "--repetitions",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of times each query is executed, the fastest execution is reported"
+    )
+
+    parser.add_argument(
+        "--cold_cache",
+        action="store_true",
+        default=False,
+        help="Empty the buffer pool of the DB before every execution, so that all queries read their data from disk"
+    )
+
+    parser.add_argument(
+        "--typed_activity_mappings",
+        action="store_true",
+        default=False,
+        help="Analyze the queries of the typed activity mappings (see main.py) instead of the replicated ones"
+    )
+
+    args = parser.parse_args()
+
+    db = MSSQLDB()
+    if not args.skip_db_setup:
+        db.select_and_start_db(args.db_option)
+
+    try:
+        run_index_advisor(db,
+                          args.report_file,
+                          args.proposals_file or os.path.splitext(args.report_file)[0] + ".sql",
+                          create_indexes=args.create_indexes,
+                          repetitions=args.repetitions,
+                          cold_cache=args.cold_cache,
+                          typed_activity_mappings=args.typed_activity_mappings)
+    finally:
+        db.close()
@@ -24,6 +24,7 @@ import os
 import sys
 
 from datastores.rdf import rdf_datastore_client
+from datastores.sql.sql_db import MSSQLDB
 from main import serve_KG
 
 from rdflib import Graph, Literal, XSD
@@ -108,12 +109,14 @@ def clear_datastores():
     asyncio.run(rdf_datastore_client.clear_triples())
 
 
-def run_validation_test(test_key: str):
+def run_validation_test(test_key: str, db: MSSQLDB):
     logging.info(f"Running test: {test_names[test_key]}")
 
+    # The container is kept between tests, only the DB is restored
+    db.select_and_start_db(test_key)
     serve_KG(skip_ontologies_upload=True,
-             db_option=test_key,
-             skip_materialization=False)
+             skip_materialization=False,
+             db=db)
 
     ttl_graph = load_ttl_graph(test_files[test_key])
     endpoint_graph = load_endpoint_graph()
@@ -180,15 +183,19 @@ if __name__ == "__main__":
         logging.warning("WARNING: Running the mappings output test under Qlever is unsupported. "
                         "Until Qlever correctly serializes datatypes, it will produce mismatches on composition values and thus incorrectly fail the tests.")
 
-    if args.test == "all":
-        results = {}
+    db = MSSQLDB()
+    try:
+        if args.test == "all":
+            results = {}
 
-        for key in test_names.keys():
-            results[key] = run_validation_test(key)
+            for key in test_names.keys():
+                results[key] = run_validation_test(key, db)
 
-        logging.info("Mappings output validation results:")
-        for key, res in results.items():
-            logging.info(f"{test_names[key]}. Passed: {res}")
-    else:
-        run_validation_test(args.test)
+            logging.info("Mappings output validation results:")
+            for key, res in results.items():
+                logging.info(f"{test_names[key]}. Passed: {res}")
+        else:
+            run_validation_test(args.test, db)
+    finally:
+        db.stop_DB()
 
@@ -4,7 +4,8 @@ Module to run a series of performance tests, via the following procedure:
     2. Create a set of run configurations using these statistics for different numbers of samples. This test will be repeated
        by increasing the probabilities, thus simulating increasingly active RDMS instances
     3. For each run, generate a synthetic DB following its probabilities, materialize the KG and perform all postprocessing
-       steps on it. Performance logs will be saved to .json files
+       steps on it. Repetitions of a configuration share the same synthetic DB, which is reverted to a snapshot between
+       them (see reset_sql_db). Performance logs will be saved to .json files
 
 All configurations and results are saved to .json files, and indicated by calling this script as a CLI application
 
@@ -16,6 +17,7 @@ import asyncio
 import json
 import logging
 import math
+import re
 import sys
 import time
 import traceback
@@ -342,14 +344,109 @@ def get_runs_configuration_from_file(f):
         return json.load(f)
 
 
-def stop_datastores(args, sql_db: MSSQLDB):
+def stop_datastores(args, sql_db: MSSQLDB, stop_sql_db: bool = True):
     logging.info("Clearing datastore...")
     asyncio.run(rdf_datastore_client.clear_triples())
 
     logging.info("Restarting datastore...")
     asyncio.run(rdf_datastore_client.restart_datastore())
 
-    sql_db.stop_DB()
+    if stop_sql_db:
+        sql_db.stop_DB()
+
+
+def get_multiplier(run_config: dict[str, Any]) -> str | None:
+    """
+    Returns the multiplier of the activity of a run configuration, or None if it is not one of the tested ones
+    """
+    # TODO this is DB-backup-specific
+    max_measurements_in_main_samples = run_config["max_measurements_in_main_samples"]
+    if max_measurements_in_main_samples == 4:
+        return "No multiplier"
+    elif max_measurements_in_main_samples == 5:
+        return "1.25"
+    elif max_measurements_in_main_samples == 6:
+        return "1.5"
+    elif max_measurements_in_main_samples == 7:
+        return "1.75"
+    elif max_measurements_in_main_samples == 8:
+        return "2"
+    return None
+
+
+def get_db_state_identifier(num_main_samples: int, multiplier: str) -> str:
+    """
+    Returns the identifier of the SQL DB state of a run, naming both its backup and its snapshot. Repetitions of a
+    configuration (n_run) share it, so that they all measure the pipeline over the same records
+    """
+    return f"performance_test_db_dump_{num_main_samples}_main_samples_multiplier_{multiplier}"
+
+
+def get_snapshot_name(db_state_identifier: str) -> str:
+    return re.sub(r"\W", "_", db_state_identifier)
+
+
+def reset_sql_db(sql_db: MSSQLDB,
+                 run_config: dict[str, Any],
+                 num_main_samples: int,
+                 db_state_identifier: str,
+                 keep_snapshot: bool):
+    """
+    Brings the SQL DB to the state of a run. In order of preference:
+        1. Reverting it to its snapshot, if the running container has one (see MSSQLDB.create_snapshot). Takes seconds
+        2. Restoring its backup, if there is one
+        3. Generating its synthetic records
+
+    Snapshots are copy-on-write, so the first write of the run to each page of the DB (e.g. the staging tables) also
+    copies it to the snapshot. Hence, a snapshot is only kept if another run will revert to it, i.e. if keep_snapshot.
+    The last run of a DB state drops it beforehand and runs without one
+
+    :param keep_snapshot: Whether another run of the same DB state follows this one
+    """
+    snapshot_name = get_snapshot_name(db_state_identifier)
+
+    if (sql_db.get_docker_container_id() is not None
+            and sql_db.is_ready()
+            and snapshot_name in sql_db.list_snapshots()):
+        logging.info("Snapshot already exists for the DB state, reverting to it...")
+        sql_db.revert_to_snapshot(snapshot_name)
+        if not keep_snapshot:
+            sql_db.drop_snapshot(snapshot_name)
+        return
+
+    sql_db.select_and_start_db(db_option='c')
+
+    if sql_db.database_backup_exists(db_state_identifier):
+        logging.info("Backup already exists for the DB state, restoring...")
+        sql_db.restore_database(db_state_identifier)
+        sql_db.apply_additional_indexes()
+    else:
+        create_synthetic_records(
+            run_config["num_users"],
+            run_config["num_areas"],
+            run_config["num_projects"],
+
+            num_main_samples,
+            run_config["chance_to_have_piece"],
+            run_config["max_piece_depth"],
+
+            run_config["num_substrates"],
+            run_config["chance_to_have_idea"],
+            run_config["chance_to_have_request_for_synthesis"],
+
+            run_config["chance_to_have_handover"],
+            run_config["max_handovers_per_sample"],
+
+            run_config["chance_to_have_measurement_in_main_sample"],
+            run_config["max_measurements_in_main_samples"],
+            run_config["chance_to_have_measurement_in_sample_piece"],
+            run_config["max_measurements_in_sample_pieces"],
+
+            run_config["chance_for_EDX_measurement"],
+        )
+
+    if keep_snapshot:
+        sql_db.create_snapshot(snapshot_name)
 
 
 def get_log_file(log_file):
@@ -383,7 +480,8 @@ def save_run(completed_runs,
              file_upload_time,
              n_triples,
              query_benchmark_results,
-             log_file):
+             log_file,
+             sql_db_snapshot: bool = False):
     run_config_for_log = run_config.copy()
     run_config_for_log["num_main_samples"] = num_main_samples
 
@@ -398,7 +496,10 @@ def save_run(completed_runs,
             "resource_usage_postprocessing": resource_usage_postprocessing,
 
             "n_triples_generated": n_triples,
-            "query_benchmark_results": query_benchmark_results
+            "query_benchmark_results": query_benchmark_results,
+
+            # Whether the SQL DB had a (copy-on-write) snapshot during the run, see reset_sql_db
+            "sql_db_snapshot": sql_db_snapshot
         }
     )
 
@@ -440,67 +541,39 @@ if __name__ == "__main__":
     completed_runs = get_log_file(args.log_file)
     backup_identifier = None
 
-    try:
-        for i, run_config in enumerate(runs_config):
-            for num_main_samples in run_config["num_main_samples"]:
-                if is_run_completed(completed_runs,
-                                    num_main_samples,
-                                    run_config):
-                    logging.info("Run already completed, skipping...")
-                    continue
-
-                # TODO this is DB-backup-specific
-                max_measurements_in_main_samples = run_config["max_measurements_in_main_samples"]
-                if max_measurements_in_main_samples == 4:
-                    multiplier = "No multiplier"
-                elif max_measurements_in_main_samples == 5:
-                    multiplier = "1.25"
-                elif max_measurements_in_main_samples == 6:
-                    multiplier = "1.5"
-                elif max_measurements_in_main_samples == 7:
-                    multiplier = "1.75"
-                elif max_measurements_in_main_samples == 8:
-                    multiplier = "2"
-                else:
-                    continue
-
-                if multiplier != "2" or num_main_samples != 10_000:
-                    continue
-
-                logging.info(f"Executing test for multiplier '{multiplier}', n_samples {num_main_samples}, n_run: {run_config['n_run']}")
-
-
-                backup_identifier = f"performance_test_db_dump_{num_main_samples}_main_samples_multiplier_{multiplier}_run_{run_config['n_run']}"
+    # DB state identifier -> pending runs of it, as (run configuration, num_main_samples, multiplier)
+    pending_runs_per_db_state = dict()
+    for run_config in runs_config:
+        for num_main_samples in run_config["num_main_samples"]:
+            if is_run_completed(completed_runs,
+                                num_main_samples,
+                                run_config):
+                logging.info("Run already completed, skipping...")
+                continue
 
-                sql_db.select_and_start_db(db_option='c')
-
-                if sql_db.database_backup_exists(backup_identifier):
-                    logging.info("Backup already exists for configuration, restoring...")
-                    sql_db.restore_database(backup_identifier)
-                else:
-                    create_synthetic_records(
-                        run_config["num_users"],
-                        run_config["num_areas"],
-                        run_config["num_projects"],
+            multiplier = get_multiplier(run_config)
+            if multiplier is None:
+                continue
 
-                        num_main_samples,
-                        run_config["chance_to_have_piece"],
-                        run_config["max_piece_depth"],
+            if multiplier != "2" or num_main_samples != 10_000:
+                continue
 
-                        run_config["num_substrates"],
-                        run_config["chance_to_have_idea"],
-                        run_config["chance_to_have_request_for_synthesis"],
+            db_state_identifier = get_db_state_identifier(num_main_samples, multiplier)
+            pending_runs_per_db_state.setdefault(db_state_identifier, []).append((run_config, num_main_samples, multiplier))
 
-                        run_config["chance_to_have_handover"],
-                        run_config["max_handovers_per_sample"],
+    try:
+        # Repetitions of the same DB state are run back to back, so that all but the first one revert to its snapshot
+        for backup_identifier, pending_runs in pending_runs_per_db_state.items():
+            for j, (run_config, num_main_samples, multiplier) in enumerate(pending_runs):
+                logging.info(f"Executing test for multiplier '{multiplier}', n_samples {num_main_samples}, n_run: {run_config['n_run']}")
 
-                        run_config["chance_to_have_measurement_in_main_sample"],
-                        run_config["max_measurements_in_main_samples"],
-                        run_config["chance_to_have_measurement_in_sample_piece"],
-                        run_config["max_measurements_in_sample_pieces"],
+                keep_snapshot = j < len(pending_runs) - 1
+                reset_sql_db(sql_db, run_config, num_main_samples, backup_identifier, keep_snapshot)
 
-                        run_config["chance_for_EDX_measurement"],
-                    )
+                # Backed up before the run modifies it, so that the backup holds the DB state itself
+                if not sql_db.database_backup_exists(backup_identifier):
+                    logging.info("Backing up the SQL DB...")
+                    sql_db.dump_database(backup_identifier)
 
                 mappings_performance_log, resource_usage_mappings, performance_log_postprocessing, resource_usage_postprocessing,  file_upload_time = (
                     serve_KG(skip_ontologies_upload=False,
@@ -535,14 +608,15 @@ if __name__ == "__main__":
                                           file_upload_time,
                                           n_triples,
                                           query_benchmark_results,
-                                          args.log_file)
-
-                if not sql_db.database_backup_exists(backup_identifier):
-                    logging.info("Backing up the SQL DB...")
-                    sql_db.dump_database(backup_identifier)
+                                          args.log_file,
+                                          sql_db_snapshot=keep_snapshot)
 
                 if not args.evaluate_only_sql_queries:
-                    stop_datastores(args, sql_db)
+                    # The SQL container (and the snapshot of the DB state, if any) is kept for the next run
+                    stop_datastores(args, sql_db, stop_sql_db=False)
+
+        if sql_db.get_docker_container_id() is not None:
+            sql_db.stop_DB()
 
     except KeyboardInterrupt:
         logging.info("Ctrl-c detected, stopping datastores...")